@@ -0,0 +1,110 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+LOG = logging.getLogger(__name__)
+DEFAULT_CACHE_DIR = '~/.cache/contractor'
+
+
+class IntrospectionCache(object):
+    """On-disk cache of resource listings
+
+    Entries are keyed by a scope (the cloud/region/project the listing came
+    from) and a resource kind, and expire after ttl seconds. A ttl of 0
+    disables the cache entirely. With refresh set, cached entries are
+    ignored but fresh listings are still written back.
+    """
+    def __init__(self, path=DEFAULT_CACHE_DIR, ttl=0, refresh=False):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.refresh = refresh
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _filename(self, scope, kind):
+        key = json.dumps([scope, kind], sort_keys=True).encode('utf-8')
+        return os.path.join(self.path,
+                            '%s.json' % hashlib.sha1(key).hexdigest())
+
+    def get(self, scope, kind):
+        if not self.enabled or self.refresh:
+            return None
+
+        try:
+            with open(self._filename(scope, kind)) as fh:
+                entry = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                LOG.warning('Failed to read cached %s: %s', kind, e)
+            return None
+        except ValueError:
+            LOG.warning('Ignoring corrupt cache entry for %s', kind)
+            return None
+
+        age = time.time() - entry['cached_at']
+
+        if age > self.ttl:
+            LOG.debug('Cached %s expired %ds ago', kind, age - self.ttl)
+            return None
+
+        LOG.info('Using %d cached %s from %ds ago', len(entry['resources']),
+                 kind, age)
+
+        return entry['resources']
+
+    def set(self, scope, kind, resources):
+        if not self.enabled:
+            return
+
+        # Tasks introspect concurrently, so another may get there first
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        entry = {
+            'scope': scope,
+            'kind': kind,
+            'cached_at': time.time(),
+            'resources': resources,
+        }
+
+        # Write then rename, so a concurrent reader never sees half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(entry, fh)
+
+        os.rename(tmp, self._filename(scope, kind))
+
+    def invalidate(self, scope, kind):
+        try:
+            os.unlink(self._filename(scope, kind))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            LOG.debug('Invalidated cached %s', kind)
@@ -0,0 +1,256 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import errno
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from keystoneclient import access
+from keystoneclient.v2_0 import client as ks_client
+from neutronclient.v2_0 import client as ne_client
+from novaclient.v1_1 import client as nv_client
+
+
+LOG = logging.getLogger(__name__)
+
+_CREDENTIAL_KEYS = ('auth_url', 'region_name', 'username', 'user_id',
+                    'password', 'project_id', 'project_name')
+
+
+def _response_size(resp):
+    headers = getattr(resp, 'headers', resp)
+
+    try:
+        return int(headers.get('content-length'))
+    except (AttributeError, TypeError, ValueError):
+        pass
+
+    content = getattr(resp, 'content', None)
+
+    return len(content) if content is not None else None
+
+
+class ClientRegistry(object):
+    """Hands out authenticated API clients to tasks
+
+    Each set of credentials is authenticated against Keystone once, and the
+    resulting token is shared by every client created for them. Clients are
+    reused by all tasks running in a thread; each thread gets its own, as
+    the underlying HTTP connections are not safe to share between threads.
+
+    If token_cache is given, tokens are also persisted there and reused by
+    later runs until they are about to expire.
+
+    Observers added with add_observer() are called with (service, method,
+    url, status, start, duration, size) after every API request the
+    clients make. Request and response bodies are only logged if
+    log_bodies is set, as large listings make that costly.
+    """
+    def __init__(self, token_cache=None, log_bodies=False):
+        self.token_cache = os.path.expanduser(token_cache) if token_cache \
+            else None
+
+        self.log_bodies = log_bodies
+
+        # neutronclient logs every request and response body at DEBUG, and
+        # has no option to stop it like novaclient's http_log_debug
+        if not log_bodies:
+            logging.getLogger('neutronclient').setLevel(logging.INFO)
+
+        self._lock = threading.Lock()
+        self._auth_refs = {}
+        self._local = threading.local()
+        self._observers = []
+
+    def add_observer(self, observer):
+        self._observers.append(observer)
+
+    def _observe(self, service, http_client):
+        """Wrap an HTTP client's request method to report to the observers"""
+        request = http_client.request
+
+        def _request(url, method, *args, **kwargs):
+            start = time.time()
+            status = None
+            size = None
+
+            try:
+                resp, body = request(url, method, *args, **kwargs)
+
+                # requests has status_code, httplib2 has status
+                status = getattr(resp, 'status_code',
+                                 getattr(resp, 'status', None))
+                size = _response_size(resp)
+
+                return resp, body
+            except Exception as e:
+                status = getattr(e, 'code', None) or \
+                    getattr(e, 'status_code', None)
+                raise
+            finally:
+                duration = time.time() - start
+
+                for observer in self._observers:
+                    try:
+                        observer(service, method, url, status, start,
+                                 duration, size)
+                    except Exception:
+                        LOG.exception('API call observer failed')
+
+        http_client.request = _request
+
+    def _get_key(self, credentials):
+        values = [credentials.get(k, None) for k in _CREDENTIAL_KEYS]
+        return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+    def _read_token_cache(self):
+        try:
+            with open(self.token_cache) as fh:
+                return json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                LOG.warning('Failed to read token cache: %s', e)
+        except ValueError:
+            LOG.warning('Ignoring corrupt token cache %s', self.token_cache)
+
+        return {}
+
+    def _load_token(self, key, region_name):
+        if self.token_cache is None:
+            return None
+
+        body = self._read_token_cache().get(key, None)
+
+        if body is None:
+            return None
+
+        return access.AccessInfo.factory(body=body, region_name=region_name)
+
+    def _save_token(self, key, auth_ref):
+        if self.token_cache is None:
+            return
+
+        tokens = self._read_token_cache()
+        tokens[key] = {'access': dict(auth_ref)}
+
+        fd = os.open(self.token_cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     0o600)
+
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(tokens, fh)
+
+    def _authenticate(self, credentials):
+        LOG.info('Authenticating as %s against %s',
+                 credentials.get('username', None) or
+                 credentials.get('user_id', None),
+                 credentials.get('auth_url', None))
+
+        keystone = ks_client.Client(
+            auth_url=credentials.get('auth_url', None),
+            username=credentials.get('username', None),
+            user_id=credentials.get('user_id', None),
+            password=credentials.get('password', None),
+            tenant_id=credentials.get('project_id', None),
+            tenant_name=credentials.get('project_name', None),
+            region_name=credentials.get('region_name', None),
+        )
+
+        return keystone.auth_ref
+
+    def _get_auth_ref(self, credentials):
+        key = self._get_key(credentials)
+        region_name = credentials.get('region_name', None)
+
+        with self._lock:
+            auth_ref = self._auth_refs.get(key, None)
+
+            if auth_ref is None or auth_ref.will_expire_soon():
+                auth_ref = self._load_token(key, region_name)
+
+                if auth_ref is None or auth_ref.will_expire_soon():
+                    auth_ref = self._authenticate(credentials)
+                    self._save_token(key, auth_ref)
+
+                self._auth_refs[key] = auth_ref
+
+        return auth_ref
+
+    def _get_endpoint(self, auth_ref, service_type, region_name):
+        kwargs = {}
+
+        if region_name is not None:
+            kwargs = {'attr': 'region', 'filter_value': region_name}
+
+        return auth_ref.service_catalog.url_for(service_type=service_type,
+                                                endpoint_type='publicURL',
+                                                **kwargs)
+
+    def _get_client(self, service, credentials, factory, http_client):
+        """Return this thread's client for a service
+
+        :param factory: Creates the client, given a token and endpoint
+        :param http_client: Returns the client's underlying HTTP client
+        """
+        clients = self._local.__dict__.setdefault('clients', {})
+        key = (service, self._get_key(credentials))
+
+        if key not in clients:
+            auth_ref = self._get_auth_ref(credentials)
+            endpoint = self._get_endpoint(
+                auth_ref, service, credentials.get('region_name', None))
+
+            LOG.debug('Creating %s client for %s', service, endpoint)
+            clients[key] = factory(auth_ref.auth_token, endpoint)
+            self._observe(service, http_client(clients[key]))
+
+        return clients[key]
+
+    def nova(self, credentials):
+        def _factory(token, endpoint):
+            return nv_client.Client(
+                auth_url=credentials.get('auth_url', None),
+                username=credentials.get('username', None),
+                api_key=credentials.get('password', None),
+                project_id=credentials.get('project_id', None),
+                tenant_id=credentials.get('project_id', None),
+                region_name=credentials.get('region_name', None),
+                auth_token=token,
+                bypass_url=endpoint,
+                http_log_debug=self.log_bodies,
+            )
+
+        return self._get_client('compute', credentials, _factory,
+                                lambda c: c.client)
+
+    def neutron(self, credentials):
+        def _factory(token, endpoint):
+            return ne_client.Client(
+                auth_url=credentials['auth_url'],
+                username=credentials.get('username', None),
+                user_id=credentials.get('user_id', None),
+                password=credentials['password'],
+                tenant_name=credentials.get('project_name', None),
+                tenant_id=credentials.get('project_id', None),
+                region_name=credentials.get('region_name', None),
+                token=token,
+                endpoint_url=endpoint,
+            )
+
+        return self._get_client('network', credentials, _factory,
+                                lambda c: c.httpclient)
@@ -14,18 +14,362 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 from __future__ import absolute_import
+from contractor import cache
+from contractor import clients
+from contractor import graph
 from contractor.openstack.common import log as logging
+from contractor import remote
 from contractor import runner
+from contractor import tracing
+import json
 from oslo.config import cfg
+import prettytable
 import sys
 
 CONF = cfg.CONF
 CONF.set_default('debug', True)
 CONF.set_default('verbose', True)
 
+cli_opts = [
+    cfg.IntOpt('workers', default=runner.DEFAULT_WORKERS,
+               help='Maximum number of tasks to run concurrently'),
+    cfg.IntOpt('introspect-workers', default=None,
+               help='Maximum number of tasks to introspect concurrently, '
+                    'defaults to all of them'),
+    cfg.StrOpt('cache-dir', default=cache.DEFAULT_CACHE_DIR,
+               help='Directory to cache introspected resources in'),
+    cfg.IntOpt('cache-ttl', default=0,
+               help='Seconds to reuse cached introspection results for, '
+                    '0 disables the cache'),
+    cfg.BoolOpt('refresh', default=False,
+                help='Ignore any cached introspection results'),
+    cfg.StrOpt('token-cache', default=None,
+               help='File to persist Keystone tokens in between runs'),
+    cfg.StrOpt('report', default=None,
+               help='File to write a JSON report of the run\'s timings to'),
+    cfg.StrOpt('trace', default=None,
+               help='File to write a Chrome trace event JSON of the API '
+                    'calls made to'),
+    cfg.FloatOpt('trace-sample-rate', default=1.0,
+                 help='Fraction of successful API calls to trace'),
+    cfg.IntOpt('trace-buffer', default=tracing.DEFAULT_CAPACITY,
+               help='Number of the most recent API calls to trace'),
+    cfg.BoolOpt('log-api-bodies', default=False,
+                help='Log API request and response bodies'),
+]
+
+TRACER = None
+
+
+def _get_runner():
+    c = cache.IntrospectionCache(path=CONF.cache_dir, ttl=CONF.cache_ttl,
+                                 refresh=CONF.refresh)
+    cl = clients.ClientRegistry(token_cache=CONF.token_cache,
+                                log_bodies=CONF.log_api_bodies)
+
+    if TRACER is not None:
+        cl.add_observer(TRACER.trace)
+
+    return runner.Runner(config=CONF.command.config,
+                         environment=CONF.command.environment,
+                         workers=CONF.workers, cache=c, clients=cl,
+                         introspect_workers=CONF.introspect_workers)
+
+
+def _format_name(name):
+    if isinstance(name, (list, tuple)):
+        return ' / '.join(name)
+
+    return name
+
+
+def _print_plan_table(plan):
+    table = prettytable.PrettyTable(['Task', 'Action', 'Resource', 'Details'])
+    table.align = 'l'
+
+    for task_name in sorted(plan['tasks']):
+        changes = plan['tasks'][task_name]['changes']
+
+        for action in ('create', 'update', 'replace', 'destroy'):
+            for change in changes.get(action, []):
+                details = ', '.join('%s=%s' % (k, change[k])
+                                    for k in sorted(change) if k != 'name')
+                table.add_row([task_name, action, _format_name(change['name']),
+                               details])
+
+    print(table)
+
+
+def do_plan():
+    plan = _get_runner().plan()
+
+    if CONF.command.output:
+        with open(CONF.command.output, 'w') as fh:
+            json.dump(plan, fh, indent=2, sort_keys=True)
+
+    if CONF.command.format == 'json':
+        changes = dict((n, t['changes']) for n, t in plan['tasks'].items())
+        print(json.dumps(changes, indent=2, sort_keys=True))
+    else:
+        _print_plan_table(plan)
+
+
+def _print_report(report):
+    table = prettytable.PrettyTable(['Phase', 'Task', 'Start', 'Duration',
+                                     'OK'])
+    table.align = 'l'
+
+    for span in sorted(report['tasks'], key=lambda s: -s['duration']):
+        table.add_row([span['phase'], span['task'], '%.2f' % span['start'],
+                       '%.2f' % span['duration'], span['ok']])
+
+    print(table)
+
+    table = prettytable.PrettyTable(['Service', 'Method', 'URL', 'Count',
+                                     'Errors', 'Total', 'Mean', 'Max'])
+    table.align = 'l'
+
+    for call in sorted(report['api'], key=lambda c: -c['total']):
+        table.add_row([call['service'], call['method'], call['url'],
+                       call['count'], call['errors'], '%.2f' % call['total'],
+                       '%.3f' % call['mean'], '%.3f' % call['max']])
+
+    print(table)
+
+    ssh_count = sum(h['count'] for h in report['ssh'])
+
+    if ssh_count > 0:
+        print('%d SSH commands on %d hosts took %.2fs in total, at most '
+              '%.2fs' % (ssh_count, len(report['ssh']),
+                         sum(h['total'] for h in report['ssh']),
+                         max(h['max'] for h in report['ssh'])))
+
+    print('Run took %.2fs' % report['duration'])
+
+
+def do_apply():
+    plan = None
+
+    if CONF.command.plan:
+        with open(CONF.command.plan) as fh:
+            plan = json.load(fh)
+
+    r = _get_runner()
+
+    try:
+        r.execute(plan=plan)
+    finally:
+        if CONF.report:
+            r.metrics.save(CONF.report)
+
+        _print_report(r.metrics.report())
+
+
+def do_run():
+    r = _get_runner()
+
+    # The instances' addresses come from introspection
+    r.plan()
+
+    try:
+        executor = remote.Executor(r)
+        names = executor.select(role=CONF.command.role)
+
+        result = executor.run(CONF.command.remote_command, names,
+                              workers=CONF.command.parallel,
+                              timeout=CONF.command.timeout)
+    finally:
+        r.ssh.close()
+
+    for name, host_result in result:
+        print('%s: exit status %r%s' % (
+            name, host_result.exit_status,
+            ', %s' % host_result.error if host_result.error else ''))
+
+    print(result.summary())
+
+    if not result.ok:
+        sys.exit(1)
+
+
+def _print_schedule(total, path, tasks):
+    table = prettytable.PrettyTable(['Task', 'Duration', 'Start', 'Finish',
+                                     'Slack', 'Critical'])
+    table.align = 'l'
+
+    for name in sorted(tasks, key=lambda n: (tasks[n]['earliest_start'], n)):
+        t = tasks[name]
+        table.add_row([name, '%.2f' % t['duration'],
+                       '%.2f' % t['earliest_start'],
+                       '%.2f' % t['earliest_finish'], '%.2f' % t['slack'],
+                       name in path])
+
+    print(table)
+    print('Critical path (%.2fs): %s' % (total, ' -> '.join(path)))
+
+
+def do_graph():
+    r = _get_runner()
+    phase = CONF.command.phase
+
+    # The destroy phases walk the DAG backwards
+    if phase in ('decomission', 'destroy'):
+        depends = r.rdepends
+    else:
+        depends = r.depends
+
+    total, path, tasks = None, (), None
+
+    if CONF.command.report:
+        reports = []
+
+        for report in CONF.command.report:
+            with open(report) as fh:
+                reports.append(json.load(fh))
+
+        total, path, tasks = graph.schedule(
+            depends, graph.task_durations(reports, phase))
+
+    if CONF.command.format == 'table':
+        if tasks is None:
+            raise Exception('The table format needs timings from --report')
+
+        _print_schedule(total, path, tasks)
+        return
+
+    if CONF.command.format == 'json':
+        output = graph.to_json(depends, total, tasks, path)
+    else:
+        output = graph.to_dot(depends, tasks, path)
+
+    if CONF.command.output:
+        with open(CONF.command.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+def _add_environment_args(parser):
+    parser.add_argument('environment',
+                        help='Name of the environment to build')
+    parser.add_argument('config', nargs='?', default='contractor.json',
+                        help='Path to the contractor config file')
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser(
+        'plan', help='Show the changes apply would make, without making them')
+    _add_environment_args(parser)
+    parser.add_argument('--format', choices=['table', 'json'],
+                        default='table')
+    parser.add_argument('--output', help='Save the plan to this file')
+    parser.set_defaults(func=do_plan)
+
+    parser = subparsers.add_parser('apply', help='Build the environment')
+    _add_environment_args(parser)
+    parser.add_argument('--plan',
+                        help='Apply a plan saved by "plan --output" rather '
+                             'than introspecting again')
+    parser.set_defaults(func=do_apply)
+
+    parser = subparsers.add_parser(
+        'run', help="Run a command on the environment's instances")
+    _add_environment_args(parser)
+    parser.add_argument('remote_command', metavar='command',
+                        help='Command to run on each instance')
+    parser.add_argument('--role', help='Only run on instances of this role')
+    parser.add_argument('--parallel', type=int,
+                        default=remote.DEFAULT_WORKERS,
+                        help='Maximum number of instances to run on at once')
+    parser.add_argument('--timeout', type=int,
+                        help='Seconds to allow the command on each instance')
+    parser.set_defaults(func=do_run)
+
+    parser = subparsers.add_parser(
+        'graph', help='Export the task graph, and find its critical path')
+    _add_environment_args(parser)
+    parser.add_argument('--format', choices=['dot', 'json', 'table'],
+                        default='dot')
+    parser.add_argument('--output', help='Save the graph to this file')
+    parser.add_argument('--phase', default='build',
+                        choices=['build', 'comission', 'decomission',
+                                 'destroy'],
+                        help='Phase to analyse the timings of')
+    parser.add_argument('--report', action='append',
+                        help='Run report saved by "apply --report" to take '
+                             'task timings from. May be repeated, the '
+                             'timings are averaged.')
+    parser.set_defaults(func=do_graph)
+
+
+command_opt = cfg.SubCommandOpt('command', title='Commands',
+                                handler=add_command_parsers)
+
+CONF.register_cli_opts(cli_opts)
+CONF.register_cli_opt(command_opt)
+
+COMMANDS = ('plan', 'apply', 'run', 'graph')
+
+
+def _get_value_flags():
+    """Return the command line flags which are followed by a value"""
+    flags = set(['--config-file', '--config-dir'])
+
+    for opt in cli_opts + logging.common_cli_opts + logging.logging_cli_opts:
+        if isinstance(opt, cfg.BoolOpt):
+            continue
+
+        names = [opt.name] + [d.name for d in
+                              getattr(opt, 'deprecated_opts', []) if d.name]
+
+        for name in names:
+            flags.add('--%s' % name)
+            flags.add('--%s' % name.replace('_', '-'))
+
+        if opt.short:
+            flags.add('-%s' % opt.short)
+
+    return flags
+
+
+def _insert_legacy_command(argv):
+    """Make "contractor [options] <environment> [config]" an apply
+
+    That form predates the subcommands. Options before it, and their
+    values, are left where they are.
+    """
+    value_flags = _get_value_flags()
+    i = 0
+
+    while i < len(argv) and argv[i].startswith('-'):
+        if argv[i] == '--':
+            return argv
+
+        if '=' not in argv[i] and argv[i] in value_flags:
+            i += 1
+
+        i += 1
+
+    if i < len(argv) and argv[i] not in COMMANDS:
+        argv = argv[:i] + ['apply'] + argv[i:]
+
+    return argv
+
+
 def main():
-    environment = str(sys.argv[1])
-    config = str(sys.argv[2]) if len(sys.argv) > 2 else 'contractor.json'
+    argv = _insert_legacy_command(sys.argv[1:])
+
+    CONF(argv, project='contractor')
     logging.setup('contractor')
-    r = runner.Runner(config=config, environment=environment)
-    r.execute()
+
+    global TRACER
+
+    if CONF.trace:
+        TRACER = tracing.Tracer(capacity=CONF.trace_buffer,
+                                sample_rate=CONF.trace_sample_rate)
+
+    try:
+        CONF.command.func()
+    finally:
+        if TRACER is not None:
+            TRACER.export_chrome(CONF.trace)
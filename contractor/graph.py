@@ -0,0 +1,167 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+
+
+def task_durations(reports, phase):
+    """Return the mean duration of each task in a phase, over run reports
+
+    :param reports: Reports saved by metrics.Recorder
+    """
+    totals = {}
+
+    for report in reports:
+        for span in report['tasks']:
+            if span['phase'] == phase:
+                totals.setdefault(span['task'], []).append(span['duration'])
+
+    return dict((t, sum(d) / len(d)) for t, d in totals.items())
+
+
+def _topological(depends):
+    order = []
+    waiting = dict((n, set(d)) for n, d in depends.items())
+
+    while len(waiting) > 0:
+        ready = sorted(n for n, d in waiting.items() if len(d) == 0)
+
+        if len(ready) == 0:
+            raise Exception('Task dependencies form a cycle: %s' %
+                            ', '.join(sorted(waiting)))
+
+        for name in ready:
+            del waiting[name]
+
+        for d in waiting.values():
+            d.difference_update(ready)
+
+        order.extend(ready)
+
+    return order
+
+
+def schedule(depends, durations):
+    """Work out when each task could start and finish, given unlimited workers
+
+    :param depends: Map of task name to the names of the tasks it waits on
+    :param durations: Map of task name to duration, tasks missing from it
+                      are taken to be instant
+    :returns: The total duration, the critical path, and a map of task name
+              to its duration, earliest and latest start and finish, and
+              slack. A task's slack is how much longer it could take
+              without making the whole phase take longer.
+    """
+    order = _topological(depends)
+    rdepends = dict((n, set()) for n in depends)
+
+    for name, befores in depends.items():
+        for before in befores:
+            rdepends[before].add(name)
+
+    tasks = {}
+
+    for name in order:
+        start = max([tasks[d]['earliest_finish'] for d in depends[name]] or
+                    [0.0])
+        duration = durations.get(name, 0.0)
+
+        tasks[name] = {
+            'duration': duration,
+            'earliest_start': start,
+            'earliest_finish': start + duration,
+        }
+
+    total = max([t['earliest_finish'] for t in tasks.values()] or [0.0])
+
+    for name in reversed(order):
+        finish = min([tasks[a]['latest_start'] for a in rdepends[name]] or
+                     [total])
+
+        tasks[name]['latest_finish'] = finish
+        tasks[name]['latest_start'] = finish - tasks[name]['duration']
+        tasks[name]['slack'] = finish - tasks[name]['earliest_finish']
+
+    # Walk back from the task which finishes last, through whichever of
+    # each task's dependencies held it up
+    path = []
+    current = max(tasks, key=lambda n: (tasks[n]['earliest_finish'], n)) \
+        if tasks else None
+
+    while current is not None:
+        path.insert(0, current)
+
+        blockers = [d for d in depends[current]
+                    if tasks[d]['earliest_finish'] ==
+                    tasks[current]['earliest_start']]
+
+        current = max(blockers, key=lambda n: (tasks[n]['duration'], n)) \
+            if blockers else None
+
+    return total, path, tasks
+
+
+def to_dot(depends, tasks=None, path=()):
+    """Render the DAG in Graphviz's DOT language
+
+    Edges point from each task to those waiting on it. With a schedule,
+    nodes are labelled with their duration and slack, and the critical
+    path is highlighted.
+    """
+    lines = ['digraph contractor {', '    rankdir=LR;',
+             '    node [shape=box];']
+
+    for name in sorted(depends):
+        attrs = {}
+
+        if tasks is not None:
+            attrs['label'] = '%s\\n%.1fs (slack %.1fs)' % (
+                name, tasks[name]['duration'], tasks[name]['slack'])
+        if name in path:
+            attrs['color'] = 'red'
+            attrs['penwidth'] = '2'
+
+        if attrs:
+            lines.append('    "%s" [%s];' % (name, ', '.join(
+                '%s="%s"' % i for i in sorted(attrs.items()))))
+        else:
+            lines.append('    "%s";' % name)
+
+    for name in sorted(depends):
+        for before in sorted(depends[name]):
+            critical = before in path and name in path and \
+                path.index(name) == path.index(before) + 1
+            lines.append('    "%s" -> "%s"%s;' % (
+                before, name, ' [color="red", penwidth="2"]'
+                if critical else ''))
+
+    lines.append('}')
+
+    return '\n'.join(lines)
+
+
+def to_json(depends, total=None, tasks=None, path=()):
+    graph = {
+        'tasks': dict((n, {'depends': sorted(d)}) for n, d in depends.items()),
+    }
+
+    if tasks is not None:
+        for name, task in tasks.items():
+            graph['tasks'][name].update(task)
+
+        graph['duration'] = total
+        graph['critical_path'] = list(path)
+
+    return json.dumps(graph, indent=2, sort_keys=True)
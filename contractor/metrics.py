@@ -0,0 +1,153 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import logging
+import re
+import threading
+import time
+
+from contractor.openstack.common import timeutils
+from six.moves.urllib import parse
+
+
+LOG = logging.getLogger(__name__)
+
+# Path segments which identify a single resource, e.g. UUIDs and project ids
+_ID_SEGMENT = re.compile(r'^(?:[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}'
+                         r'[0-9a-fA-F]{12}|[0-9a-fA-F]{32}|\d+)$')
+
+
+def url_template(url):
+    """Return the path of a URL with any resource ids replaced by {id}
+
+    e.g. "https://nova:8774/v2/<project>/servers/<uuid>?x=y" becomes
+    "/v2/{id}/servers/{id}", so calls on different resources group together.
+    """
+    path = parse.urlparse(url).path
+
+    return '/'.join('{id}' if _ID_SEGMENT.match(s) else s
+                    for s in path.split('/'))
+
+
+class _Stats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration, error=False):
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+
+class Recorder(object):
+    """Collects the timings of a run
+
+    Spans are recorded for each phase and each (phase, task) pair, with
+    their start relative to the start of the run. API calls are grouped by
+    service, HTTP method and URL template, and SSH commands by host.
+    """
+    def __init__(self, environment=None):
+        self.environment = environment
+
+        self._lock = threading.Lock()
+        self._started_at = timeutils.isotime()
+        self._start = time.time()
+
+        self.phases = []
+        self.tasks = []
+        self._api = {}
+        self._ssh = {}
+
+    def _span(self, start, duration, ok):
+        return {
+            'start': start - self._start,
+            'duration': duration,
+            'ok': ok,
+        }
+
+    def phase(self, phase, start, duration, ok=True):
+        span = self._span(start, duration, ok)
+        span['phase'] = phase
+
+        with self._lock:
+            self.phases.append(span)
+
+    def task(self, phase, task, start, duration, ok=True):
+        span = self._span(start, duration, ok)
+        span.update({'phase': phase, 'task': task})
+
+        with self._lock:
+            self.tasks.append(span)
+
+    def api_call(self, service, method, url, status, start, duration,
+                 size=None):
+        key = (service, method, url_template(url))
+        error = status is None or status >= 400
+
+        with self._lock:
+            self._api.setdefault(key, _Stats()).add(duration, error)
+
+    def ssh_command(self, result):
+        with self._lock:
+            self._ssh.setdefault(result.hostname, _Stats()).add(
+                result.duration or 0.0, not result.ok)
+
+    def report(self):
+        """Return everything recorded, in a form which can be saved as JSON"""
+        with self._lock:
+            api = []
+
+            for (service, method, url), stats in sorted(self._api.items()):
+                call = stats.to_dict()
+                call.update({'service': service, 'method': method,
+                             'url': url})
+                api.append(call)
+
+            ssh = []
+
+            for hostname, stats in sorted(self._ssh.items()):
+                host = stats.to_dict()
+                host['hostname'] = hostname
+                ssh.append(host)
+
+            return {
+                'environment': self.environment,
+                'started_at': self._started_at,
+                'duration': time.time() - self._start,
+                'phases': list(self.phases),
+                'tasks': list(self.tasks),
+                'api': api,
+                'ssh': ssh,
+            }
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+
+        LOG.info('Run report written to %s', path)
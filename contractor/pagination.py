@@ -0,0 +1,93 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+import re
+
+
+LOG = logging.getLogger(__name__)
+DEFAULT_PAGE_SIZE = 500
+
+# Nova's default osapi_max_limit, it returns no more than this per page
+DEFAULT_NOVA_MAX_LIMIT = 1000
+
+# Nova hands name filters to the database as a regex, escape only the
+# characters every regex flavour agrees are special.
+_REGEX_SPECIAL = re.compile(r'([.^$*+?()\[\]{}|\\])')
+
+
+def name_prefix_regex(prefix):
+    return '^' + _REGEX_SPECIAL.sub(r'\\\1', prefix)
+
+
+def iter_nova(manager, search_opts=None, page_size=DEFAULT_PAGE_SIZE,
+              max_limit=DEFAULT_NOVA_MAX_LIMIT):
+    """Iterate over a Nova collection a page at a time, using limit/marker
+
+    :param manager: A novaclient manager, e.g. client.servers
+    :param search_opts: Server side filters, passed on every request
+    :param max_limit: The deployment's osapi_max_limit. Larger pages are
+                      cut short by Nova, so page_size is capped to it.
+    """
+    page_size = min(page_size, max_limit)
+    marker = None
+    seen = set()
+
+    while True:
+        opts = dict(search_opts or {})
+        opts['limit'] = page_size
+
+        if marker is not None:
+            opts['marker'] = marker
+
+        page = manager.list(search_opts=opts)
+
+        LOG.debug('Fetched page of %d %s', len(page),
+                  manager.resource_class.__name__)
+
+        # An API which ignores the marker hands back the first page again
+        if len(page) > 0 and page[0].id in seen:
+            return
+
+        for resource in page:
+            seen.add(resource.id)
+            yield resource
+
+        # A short page is the last one. An oversized one means the API
+        # ignored the limit and returned everything.
+        if len(page) != page_size:
+            return
+
+        marker = page[-1].id
+
+
+def iter_neutron(list_func, collection, page_size=DEFAULT_PAGE_SIZE,
+                 **filters):
+    """Iterate over a Neutron collection a page at a time
+
+    Neutron returns a "next" link with each page when paginating, which the
+    client follows for us. Plugins without pagination support return the
+    whole collection in one go.
+
+    :param list_func: A neutronclient list method, e.g. client.list_networks
+    :param collection: Name of the collection in the response, e.g.
+                       "networks"
+    :param filters: Server side filters, e.g. tenant_id
+    """
+    for page in list_func(retrieve_all=False, limit=page_size, **filters):
+        LOG.debug('Fetched page of %d %s', len(page[collection]), collection)
+
+        for resource in page[collection]:
+            yield resource
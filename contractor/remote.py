@@ -0,0 +1,395 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+import os
+import paramiko
+import posixpath
+import six
+from six.moves import shlex_quote
+import tempfile
+import time
+import uuid
+
+from contractor import ssh
+from contractor import utils
+
+
+LOG = logging.getLogger(__name__)
+DEFAULT_WORKERS = 50
+DEFAULT_USERNAME = 'ubuntu'
+DEFAULT_BOOT_TIMEOUT = 300
+
+
+class FanOutResult(object):
+    """The per-host CommandResults of running a command across hosts"""
+    def __init__(self, command, results):
+        self.command = command
+        self.results = results
+
+    def __iter__(self):
+        return iter(sorted(self.results.items()))
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def succeeded(self):
+        return sorted(n for n, r in self.results.items() if r.ok)
+
+    @property
+    def failed(self):
+        return sorted(n for n, r in self.results.items() if not r.ok)
+
+    @property
+    def ok(self):
+        return len(self.failed) == 0
+
+    def summary(self):
+        return '%r succeeded on %d of %d hosts' % (
+            self.command, len(self.succeeded), len(self.results))
+
+
+class Executor(object):
+    """Runs commands on a runner's instances over SSH
+
+    Connection details come from the environment's "ssh" config:
+    username, port, and either private_key or private_key_file. If it has
+    a "gateway" (with a hostname, and optionally its own username and
+    port), connections hop through that bastion host.
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        self.store = runner.store
+
+        env_config = runner.config['environments'][runner.environment]
+        self.ssh_config = env_config.get('ssh', {})
+
+        self._private_key = None
+
+    @property
+    def private_key(self):
+        if self._private_key is None:
+            if 'private_key_file' in self.ssh_config:
+                path = os.path.expanduser(self.ssh_config['private_key_file'])
+
+                with open(path) as fh:
+                    self._private_key = fh.read()
+            else:
+                self._private_key = self.ssh_config['private_key']
+
+        return self._private_key
+
+    def select(self, role=None, names=None):
+        """Return the names of the instances matching a role and/or names"""
+        selected = []
+
+        for name, instance in self.store['instances'].items():
+            if role is not None and instance['role'] != role:
+                continue
+
+            if names is not None and name not in names:
+                continue
+
+            selected.append(name)
+
+        return sorted(selected)
+
+    def get_address(self, name, internal=False):
+        """Return an address to reach an instance at
+
+        :param internal: Skip floating IPs, for connections from inside the
+                         environment
+        """
+        # Prefer addresses from the config, as they're reachable by design.
+        # Fall back to whatever Nova says the instance has.
+        nics = self.store['instances'][name]['nics']
+        keys = ('fixed_ip',) if internal else ('floating_ip', 'fixed_ip')
+
+        for key in keys:
+            for nic in nics:
+                if nic[key] is not None:
+                    return nic[key]
+
+        for server in self.store['_os-nova_instances'].find(name):
+            for addresses in server.networks.values():
+                if len(addresses) > 0:
+                    return addresses[0]
+
+        raise Exception('Failed to find an address for instance: %s' % name)
+
+    def _get_gateway(self):
+        gateway_config = self.ssh_config.get('gateway', None)
+
+        if gateway_config is None:
+            return None
+
+        return self.runner.ssh.get(
+            gateway_config['hostname'],
+            gateway_config.get('username',
+                               self.ssh_config.get('username',
+                                                   DEFAULT_USERNAME)),
+            self.private_key,
+            port=gateway_config.get('port', None))
+
+    @property
+    def username(self):
+        return self.ssh_config.get('username', DEFAULT_USERNAME)
+
+    def connect(self, name):
+        return self.runner.ssh.get(
+            self.get_address(name),
+            self.username,
+            self.private_key,
+            port=self.ssh_config.get('port', None),
+            gateway=self._get_gateway())
+
+    def wait_for_ssh(self, name):
+        """Block until an instance accepts SSH connections
+
+        Freshly ACTIVE instances may still be booting. Gives up after the
+        ssh config's boot_timeout.
+        """
+        deadline = time.time() + self.ssh_config.get('boot_timeout',
+                                                     DEFAULT_BOOT_TIMEOUT)
+        interval = 2
+
+        while True:
+            result = self.connect(name).run('true', timeout=30)
+
+            if result.ok:
+                return
+
+            if time.time() > deadline:
+                raise Exception('Instance %s not reachable over SSH: %s' %
+                                (name, result.error))
+
+            LOG.debug('Instance %s not reachable over SSH yet: %s', name,
+                      result.error)
+
+            time.sleep(interval)
+            interval = min(interval * 2, 30)
+
+    def output_logger(self, name):
+        def _output(stream, line):
+            LOG.info('[%s %s] %s', name, stream, line)
+
+        return _output
+
+    def run(self, command, names, workers=DEFAULT_WORKERS, timeout=None,
+            output=True):
+        """Run a command on each named instance, up to workers at a time
+
+        :param output: Log each line of output, prefixed with the instance
+                       name, as it arrives
+        :returns: A FanOutResult
+        """
+        LOG.info('Running %r on %d instances', command, len(names))
+
+        def _run(name):
+            callback = self.output_logger(name) if output else None
+            return self.connect(name).run(command, timeout=timeout,
+                                          output=callback)
+
+        results = {}
+
+        for name, result, exc_info in utils.parallel_map(_run, names,
+                                                         workers):
+            if exc_info is not None:
+                # Failed before the command could run, e.g. no address
+                result = ssh.CommandResult(name, command)
+                result.error = str(exc_info[1])
+
+            if not result.ok:
+                LOG.error('%r failed on %s: exit status %r, %s', command,
+                          name, result.exit_status, result.error)
+
+            results[name] = result
+
+        fan_out_result = FanOutResult(command, results)
+        LOG.info(fan_out_result.summary())
+
+        return fan_out_result
+
+    def distribute(self, local_path, remote_path, names, mode=None,
+                   workers=DEFAULT_WORKERS, per_az=False):
+        """Upload a file to each named instance, skipping up to date copies
+
+        :param per_az: Only upload to one instance in each availability
+                       zone, and copy it to the rest of the zone from
+                       there. Saves pushing a large file through the
+                       gateway once per instance.
+        :returns: Map of instance name to whether the file was transferred
+        """
+        LOG.info('Distributing %s to %d instances', local_path, len(names))
+
+        if per_az:
+            zones = {}
+
+            for name in names:
+                az = self.store['instances'][name]['az']
+                zones.setdefault(az, []).append(name)
+
+            def _distribute(az):
+                return self._relay(local_path, remote_path, sorted(zones[az]),
+                                   mode, workers)
+
+            results = utils.parallel_map(_distribute, sorted(zones),
+                                         len(zones))
+        else:
+            def _upload(name):
+                return {name: self.connect(name).upload(local_path,
+                                                        remote_path,
+                                                        mode=mode)}
+
+            results = utils.parallel_map(_upload, names, workers)
+
+        transferred = {}
+        failed = []
+
+        for item, result, exc_info in results:
+            if exc_info is not None:
+                LOG.error('Failed to distribute %s to %s: %s', local_path,
+                          item, exc_info[1])
+                failed.append(item)
+            else:
+                transferred.update(result)
+
+        if len(failed) > 0:
+            raise Exception('Failed to distribute %s to: %s' % (
+                local_path, ', '.join(sorted(failed))))
+
+        LOG.info('Transferred %s to %d of %d instances', local_path,
+                 len([n for n in transferred if transferred[n]]), len(names))
+
+        return transferred
+
+    def _relay(self, local_path, remote_path, names, mode, workers):
+        """Upload a file to the first instance, and scp it to the others
+
+        The seed instance gets a throwaway key, which the others trust only
+        until the copy is done.
+        """
+        seed, peers = names[0], names[1:]
+        seed_connection = self.connect(seed)
+
+        transferred = {seed: seed_connection.upload(local_path, remote_path,
+                                                    mode=mode)}
+        checksum = ssh.file_checksum(local_path)
+
+        def _needs_copy(name):
+            return self.connect(name).checksum(remote_path) != checksum
+
+        stale = [n for n, needed, exc_info in
+                 utils.parallel_map(_needs_copy, peers, workers)
+                 if exc_info is not None or needed]
+
+        for name in peers:
+            transferred[name] = name in stale
+
+        if len(stale) == 0:
+            return transferred
+
+        marker = 'contractor-relay-%s' % uuid.uuid4().hex
+        key = paramiko.RSAKey.generate(2048)
+        authorized_key = '%s %s %s' % (key.get_name(), key.get_base64(),
+                                       marker)
+        key_path = posixpath.join('/tmp', marker)
+
+        def _check(result):
+            if not result.ok:
+                raise Exception('%r failed on %s: exit status %r, %s' % (
+                    result.command, result.hostname, result.exit_status,
+                    result.error or result.stderr))
+
+        def _authorize(name):
+            _check(self.connect(name).run(
+                'mkdir -p ~/.ssh && echo %s >> ~/.ssh/authorized_keys' %
+                shlex_quote(authorized_key)))
+
+        # The instances all listen on the environment's SSH port
+        port = self.ssh_config.get('port', None)
+        port_option = '-P %d ' % port if port is not None else ''
+
+        def _copy(name):
+            _check(seed_connection.run(
+                'scp -p %s-i %s -o StrictHostKeyChecking=no '
+                '-o UserKnownHostsFile=/dev/null %s %s@%s:%s' % (
+                    port_option, key_path, shlex_quote(remote_path),
+                    self.username, self.get_address(name, internal=True),
+                    shlex_quote(remote_path))))
+
+            if mode is not None:
+                _check(self.connect(name).run('chmod %o %s' % (
+                    mode, shlex_quote(remote_path))))
+
+        LOG.info('Relaying %s from %s to %d instances', remote_path, seed,
+                 len(stale))
+
+        fd, local_key_path = tempfile.mkstemp()
+
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                key.write_private_key(fh)
+
+            seed_connection.put(local_key_path, key_path, mode=0o600)
+
+            for name, result, exc_info in utils.parallel_map(
+                    _authorize, stale, workers):
+                if exc_info is not None:
+                    six.reraise(*exc_info)
+
+            # The seed's sessions are limited anyway, so don't go wider
+            for name, result, exc_info in utils.parallel_map(
+                    _copy, stale, seed_connection.max_sessions):
+                if exc_info is not None:
+                    six.reraise(*exc_info)
+        finally:
+            os.unlink(local_key_path)
+            failed = self._revoke_relay_key(seed, key_path, marker, stale,
+                                            workers)
+
+        # Only reached if the copy itself succeeded, a failed copy's error
+        # matters more. The failures are logged either way.
+        if len(failed) > 0:
+            raise Exception('Failed to remove relay key %s from: %s' % (
+                marker, ', '.join(failed)))
+
+        return transferred
+
+    def _revoke_relay_key(self, seed, key_path, marker, peers, workers):
+        """Delete a relay's key from the seed, and untrust it on the peers
+
+        :returns: The names of the instances it may be left on
+        """
+        def _revoke(name):
+            if name == seed:
+                command = 'rm -f %s' % shlex_quote(key_path)
+            else:
+                command = "sed -i '/ %s$/d' ~/.ssh/authorized_keys" % marker
+
+            return self.connect(name).run(command)
+
+        failed = []
+
+        for name, result, exc_info in utils.parallel_map(
+                _revoke, [seed] + list(peers), workers):
+            if exc_info is not None or not result.ok:
+                LOG.error('Failed to remove relay key %s from %s: %s',
+                          marker, name, exc_info[1] if exc_info is not None
+                          else result.error or result.stderr)
+                failed.append(name)
+
+        return sorted(failed)
@@ -15,17 +15,39 @@
 # under the License.
 import json
 import logging
+from multiprocessing.pool import ThreadPool
+import os
 import sdag2
+import six
+from six.moves import queue
 from stevedore import extension
+from contractor import cache as introspection_cache
+from contractor import clients as api_clients
+from contractor import metrics
+from contractor.openstack.common import timeutils
+from contractor import ssh
+from contractor import store
+import sys
+import time
 
 LOG = logging.getLogger(__name__)
+DEFAULT_WORKERS = 4
 
 
 class Runner(object):
-    def __init__(self, config, environment):
-        self.store = {}
+    def __init__(self, config, environment, workers=DEFAULT_WORKERS,
+                 cache=None, clients=None, introspect_workers=None):
+        self.store = store.Store()
 
         self.environment = environment
+        self.workers = max(1, workers)
+        self.introspect_workers = introspect_workers
+        self.cache = cache or introspection_cache.IntrospectionCache()
+        self.clients = clients or api_clients.ClientRegistry()
+
+        self.metrics = metrics.Recorder(environment)
+        self.clients.add_observer(self.metrics.api_call)
+        self.ssh = ssh.SSHConnectionPool(on_command=self.metrics.ssh_command)
 
         self._load_config(config)
         self._load_tasks()
@@ -35,6 +57,9 @@ class Runner(object):
         fh = open(config)
         self.config = json.load(fh)
 
+        # Relative paths in the config are relative to the config file
+        self.config_dir = os.path.dirname(os.path.abspath(config))
+
     def _load_tasks(self):
         self.task_classes = {}
 
@@ -55,81 +80,198 @@ class Runner(object):
         self.dag = sdag2.DAG()
         vertices = {}
 
+        # Track the edges ourselves too, the scheduler needs to know which
+        # tasks each task is waiting on.
+        self.depends = {}
+        self.rdepends = {}
+
         for name in self.task_classes.keys():
             vertices[name] = self.dag.add(name)
+            self.depends[name] = set()
+            self.rdepends[name] = set()
 
         # Iterate the tasks, adding edges where necessary
         for name, task in self.task_classes.items():
             # Add ordinary depends
             for depend in task.depends:
-                self.dag.add_edge(depend, name)
+                self._add_edge(depend, name)
 
             # Add reverse depends
             for rdepend in task.rdepends:
-                self.dag.add_edge(name, rdepend)
+                self._add_edge(name, rdepend)
 
-    def execute(self):
+    def _add_edge(self, before, after):
+        self.dag.add_edge(before, after)
+        self.depends[after].add(before)
+        self.rdepends[before].add(after)
+
+    def _init_tasks(self):
         self.tasks = {}
 
         topo = self.dag.topologicaly()
 
-        LOG.info('Task execution order: %s', topo)
+        LOG.info('Task execution order: %s (Workers: %d)', topo, self.workers)
 
         for name in topo:
             LOG.debug('Initializing task: %s', name)
             task = self.task_classes[name](self, self.environment, self.store)
             self.tasks[name] = task
 
-        self._execute_introspect(topo)
-        self._execute_build(topo)
-        self._execute_comission(topo)
-
-        topo.reverse()
+    def plan(self):
+        """Introspect the environment, without changing anything
 
-        self._execute_decomission(topo)
-        self._execute_destroy(topo)
+        :returns: The changes each task would make, in a form which can be
+                  saved as JSON and handed back to execute() later.
+        """
+        self._init_tasks()
+        self._execute_introspect()
 
-    def _execute_introspect(self, topo):
-        LOG.info('Executing introspect phase')
+        tasks = {}
 
-        for name in topo:
-            task = self.tasks[name]
+        for name, task in self.tasks.items():
             if task.enabled:
-                LOG.info('Running introspect for task: %s', name)
-                task.introspect()
+                tasks[name] = task.get_plan()
 
-    def _execute_build(self, topo):
-        LOG.info('Executing build phase')
+        return {
+            'environment': self.environment,
+            'created_at': timeutils.isotime(),
+            'tasks': tasks,
+        }
 
-        for name in topo:
-            task = self.tasks[name]
-            if task.enabled:
-                LOG.info('Running build for task: %s', name)
-                task.build()
+    def execute(self, plan=None):
+        self._init_tasks()
 
-    def _execute_comission(self, topo):
-        LOG.info('Executing comission phase')
+        if plan is None:
+            self._execute_introspect()
+        else:
+            self._load_plan(plan)
 
-        for name in topo:
-            task = self.tasks[name]
-            if task.enabled:
-                LOG.info('Running comission for task: %s', name)
-                task.comission()
+        try:
+            self._execute_build()
+            self._execute_comission()
 
-    def _execute_decomission(self, topo):
-        LOG.info('Executing decomission phase')
+            self._execute_decomission()
+            self._execute_destroy()
+        finally:
+            self.ssh.close()
 
-        for name in topo:
-            task = self.tasks[name]
-            if task.enabled:
-                LOG.info('Running decomission for task: %s', name)
-                task.decomission()
+    def _load_plan(self, plan):
+        if plan['environment'] != self.environment:
+            raise Exception('Plan is for environment %s, not %s' %
+                            (plan['environment'], self.environment))
 
-    def _execute_destroy(self, topo):
-        LOG.info('Executing destroy phase')
+        LOG.info('Using plan created at %s', plan['created_at'])
 
-        for name in topo:
-            task = self.tasks[name]
-            if task.enabled:
-                LOG.info('Running destroy for task: %s', name)
-                task.destroy()
+        for name, task in self.tasks.items():
+            if not task.enabled:
+                continue
+
+            if name not in plan['tasks']:
+                raise Exception('Plan has no entry for task: %s' % name)
+
+            task.load_plan(plan['tasks'][name])
+
+    def _execute_introspect(self):
+        # Introspection only reads, so there's no need to respect the DAG
+        # or the worker count for changes. Run everything at once, unless
+        # told otherwise, except where a task reuses another's listings.
+        depends = dict((n, set(t.introspect_depends))
+                       for n, t in self.tasks.items())
+
+        self._execute_phase('introspect', depends,
+                            workers=self.introspect_workers or len(self.tasks))
+
+    def _execute_build(self):
+        self._execute_phase('build', self.depends)
+
+    def _execute_comission(self):
+        self._execute_phase('comission', self.depends)
+
+    def _execute_decomission(self):
+        self._execute_phase('decomission', self.rdepends)
+
+    def _execute_destroy(self):
+        self._execute_phase('destroy', self.rdepends)
+
+    def _execute_phase(self, phase, depends, workers=None):
+        """Run a phase, starting each task as soon as those it waits on finish
+
+        :param phase: Name of the Task method to run
+        :param depends: Map of task name to the set of task names which must
+                        complete first. Pass the reverse depends to walk the
+                        DAG backwards.
+        :param workers: Number of tasks to run at once, defaults to the
+                        runner's worker count.
+        """
+        LOG.info('Executing %s phase', phase)
+
+        start = time.time()
+        waiting = dict((n, set(d) & set(self.tasks)) for n, d in
+                       depends.items() if n in self.tasks)
+        completed = queue.Queue()
+        pool = ThreadPool(max(1, workers or self.workers))
+
+        def _start_ready_tasks():
+            ready = [n for n, d in waiting.items() if len(d) == 0]
+
+            for name in ready:
+                del waiting[name]
+
+                if self.tasks[name].enabled:
+                    pool.apply_async(self._run_task, (phase, name),
+                                     callback=completed.put)
+                else:
+                    completed.put((name, None))
+
+            return len(ready)
+
+        failure = None
+
+        try:
+            running = _start_ready_tasks()
+
+            while running > 0:
+                name, exc_info = completed.get()
+                running -= 1
+
+                if exc_info is not None:
+                    LOG.error('Task %s failed during %s phase', name, phase)
+                    failure = failure or exc_info
+                    continue
+
+                for pending in waiting.values():
+                    pending.discard(name)
+
+                # Once a task has failed, let the running ones finish but
+                # don't start anything new.
+                if failure is None:
+                    running += _start_ready_tasks()
+        finally:
+            pool.close()
+            pool.join()
+
+            self.metrics.phase(phase, start, time.time() - start,
+                               ok=failure is None)
+
+        if failure is not None:
+            six.reraise(*failure)
+
+    def _run_task(self, phase, name):
+        LOG.info('Running %s for task: %s', phase, name)
+
+        start = time.time()
+        exc_info = None
+
+        try:
+            getattr(self.tasks[name], phase)()
+        except Exception:
+            exc_info = sys.exc_info()
+        finally:
+            duration = time.time() - start
+
+            LOG.info('Finished %s for task: %s in %.2fs', phase, name,
+                     duration)
+            self.metrics.task(phase, name, start, duration,
+                              ok=exc_info is None)
+
+        return (name, exc_info)
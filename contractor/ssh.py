@@ -13,24 +13,113 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import contextlib
 import cStringIO
+import errno
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import paramiko
+from six.moves import shlex_quote
 import select
 import socket
-import SocketServer
 import threading
+import time
 
 
 LOG = logging.getLogger(__name__)
 DEFAULT_SSH_PORT = 22
+DEFAULT_KEEPALIVE = 30
+DEFAULT_IDLE_TIMEOUT = 300
+# OpenSSH's default MaxSessions, the number of channels it allows at once
+DEFAULT_MAX_SESSIONS = 10
+BUFFER_SIZE = 32768
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class CommandResult(object):
+    """The outcome of running a command with SSHConnection.run()"""
+    def __init__(self, hostname, command):
+        self.hostname = hostname
+        self.command = command
+        self.exit_status = None
+        self.stdout = ''
+        self.stderr = ''
+        self.duration = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_status == 0
+
+    def __repr__(self):
+        return '<CommandResult %s exit_status=%r error=%r>' % (
+            self.hostname, self.exit_status, self.error)
+
+
+class _LineBuffer(object):
+    """Collects a stream's output, handing complete lines to a callback"""
+    def __init__(self, stream, callback=None):
+        self.stream = stream
+        self.callback = callback
+        self.chunks = []
+        self._partial = ''
+
+    def feed(self, data):
+        data = data.decode('utf-8', 'replace')
+        self.chunks.append(data)
+
+        if self.callback is None:
+            return
+
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+
+        for line in lines:
+            self.callback(self.stream, line)
+
+    def close(self):
+        if self.callback is not None and self._partial:
+            self.callback(self.stream, self._partial)
+
+        return ''.join(self.chunks)
+
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+
+    with open(path, 'rb') as fh:
+        while True:
+            data = fh.read(BUFFER_SIZE)
+
+            if len(data) == 0:
+                break
+
+            sha256.update(data)
+
+    return sha256.hexdigest()
 
 
 class SSHConnection(object):
-    def __init__(self, hostname, username, private_key, port=None):
+    def __init__(self, hostname, username, private_key, port=None,
+                 keepalive=DEFAULT_KEEPALIVE,
+                 max_sessions=DEFAULT_MAX_SESSIONS, gateway=None,
+                 on_command=None):
         self._connected = False
         self._tunnels = []
+        self._lock = threading.Lock()
+        self._sessions = threading.BoundedSemaphore(max_sessions)
+
+        # Operations running on this connection, and connections hopping
+        # through it, which keep it from being closed as idle
+        self._usage_lock = threading.Lock()
+        self._users = 0
+        self._hops = 0
+        self._hopping = False
 
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -39,6 +128,11 @@ class SSHConnection(object):
         self.port = port if port is not None else DEFAULT_SSH_PORT
         self.username = username
         self.private_key = self._get_private_key(private_key)
+        self.keepalive = keepalive
+        self.max_sessions = max_sessions
+        self.gateway = gateway
+        self.on_command = on_command
+        self.last_used = time.time()
 
     def _get_private_key(self, private_key):
         if isinstance(private_key, basestring):
@@ -58,7 +152,13 @@ class SSHConnection(object):
                 username = os.environ.get('HPCS_SSO_USERNAME', 'ubuntu')
                 LOG.debug("Trying to connect with user %s", username)
                 self._connect(username)
-            except paramiko.AuthenticationException:
+            except paramiko.SSHException:
+                # paramiko raises a plain SSHException, rather than an
+                # AuthenticationException, when it had no agent or local
+                # keys to try. Close the failed attempt's transport before
+                # falling back to our key.
+                self.client.close()
+
                 LOG.debug("Trying to connect with user %s", self.username)
                 self._connect(self.username, self.private_key)
         except paramiko.BadHostKeyException:
@@ -70,10 +170,35 @@ class SSHConnection(object):
         except socket.error:
             raise Exception('Unknown SSH Socket Error')
         else:
+            transport = self.client.get_transport()
+
+            # Keepalives let the transport notice a dead peer by itself,
+            # so checking liveness doesn't need a round trip.
+            transport.set_keepalive(self.keepalive)
+
+            # Running a command is a series of small messages, each waiting
+            # on a reply. Don't let Nagle's algorithm hold them back. (When
+            # hopping through a gateway, the socket is a channel.)
+            if isinstance(transport.sock, socket.socket):
+                transport.sock.setsockopt(socket.IPPROTO_TCP,
+                                          socket.TCP_NODELAY, 1)
+
+            if self.gateway is not None and not self._hopping:
+                self.gateway._add_hops(1)
+                self._hopping = True
+
             self._connected = True
 
     def _connect(self, username, private_key=None):
+        sock = None
+
+        if self.gateway is not None:
+            # Hop through the gateway over a channel on its transport. A
+            # failed login attempt closes the channel, so open one per try.
+            sock = self.gateway.open_channel(self.hostname, self.port)
+
         self.client.connect(
+            sock=sock,
             hostname=self.hostname,
             port=self.port,
             username=username,
@@ -83,25 +208,97 @@ class SSHConnection(object):
         )
 
     def disconnect(self):
-        for thread in self._tunnels:
-            thread.stop()
+        for tunnel in self._tunnels:
+            get_forwarder().remove_tunnel(tunnel)
+
+        self._tunnels = []
 
         self.client.close()
+        self._connected = False
+
+        if self._hopping:
+            self.gateway._add_hops(-1)
+            self._hopping = False
+
+    def _add_hops(self, count):
+        with self._usage_lock:
+            self._hops += count
+
+    @contextlib.contextmanager
+    def _in_use(self):
+        with self._usage_lock:
+            self._users += 1
+
+        try:
+            yield
+        finally:
+            with self._usage_lock:
+                self._users -= 1
+
+            self.touch()
+
+    @property
+    def busy(self):
+        """Whether anything is using the connection, or hopping through it
+
+        A busy connection may not have been used recently, e.g. while a
+        long command runs, but mustn't be closed.
+        """
+        with self._usage_lock:
+            return (self._users > 0 or self._hops > 0 or
+                    len(self._tunnels) > 0)
 
     @property
     def connected(self):
         if self._connected:
-            try:
-                # Are we *really* connected??
-                self.client.exec_command('/bin/pwd')
-            except paramiko.SSHException:
+            transport = self.client.get_transport()
+
+            if transport is None or not transport.is_active():
                 self._connected = False
 
         return self._connected
 
+    def _ensure_connected(self):
+        # Commands from many threads share this connection, make sure only
+        # one of them (re)connects it.
+        with self._lock:
+            if not self.connected:
+                self.connect()
+
+            self.touch()
+
+    def touch(self):
+        """Mark the connection, and any gateway it uses, as in use"""
+        self.last_used = time.time()
+
+        if self.gateway is not None:
+            self.gateway.touch()
+
+    def open_channel(self, hostname, port=None):
+        """Open a direct-tcpip channel to hostname:port via this host
+
+        The channel is a socket-like object, suitable for passing to another
+        SSHConnection as its gateway's sock.
+        """
+        self._ensure_connected()
+
+        port = port if port is not None else DEFAULT_SSH_PORT
+
+        try:
+            channel = self.client.get_transport().open_channel(
+                'direct-tcpip', (hostname, port), ('127.0.0.1', 0))
+        except paramiko.SSHException as e:
+            raise Exception('Failed to open channel to %s:%d via %s: %s' %
+                            (hostname, port, self.hostname, e))
+
+        if channel is None:
+            raise Exception('Channel to %s:%d was rejected by %s' %
+                            (hostname, port, self.hostname))
+
+        return channel
+
     def execute(self, command):
-        if not self.connected:
-            self.connect()
+        self._ensure_connected()
 
         try:
             (_, stdout, stderr, ) = self.client.exec_command(command)
@@ -113,95 +310,526 @@ class SSHConnection(object):
 
         return (stdout, stderr, )
 
+    def run(self, command, timeout=None, output=None):
+        """Run a command to completion, collecting its output
+
+        Unlike execute(), this waits for the command to exit. Many commands
+        may be run at once over the one connection, up to max_sessions.
+
+        :param timeout: Seconds to allow the command before giving up on it
+        :param output: Called with (stream, line) as each line of stdout
+                       or stderr arrives
+        :returns: A CommandResult
+        """
+        result = CommandResult(self.hostname, command)
+        start = time.time()
+
+        try:
+            with self._in_use():
+                self._ensure_connected()
+
+                with self._sessions:
+                    self._run(result, command, timeout, output)
+        except Exception as e:
+            result.error = str(e) or e.__class__.__name__
+        finally:
+            result.duration = time.time() - start
+
+        LOG.debug('Command %r on %s finished in %.2fs: %r', command,
+                  self.hostname, result.duration, result)
+
+        if self.on_command is not None:
+            self.on_command(result)
+
+        return result
+
+    def _run(self, result, command, timeout, output):
+        deadline = (time.time() + timeout) if timeout else None
+
+        channel = self.client.get_transport().open_session()
+
+        try:
+            channel.exec_command(command)
+
+            stdout = _LineBuffer('stdout', output)
+            stderr = _LineBuffer('stderr', output)
+
+            while True:
+                finished = channel.eof_received or channel.closed
+
+                if channel.recv_ready():
+                    stdout.feed(channel.recv(BUFFER_SIZE))
+                elif channel.recv_stderr_ready():
+                    stderr.feed(channel.recv_stderr(BUFFER_SIZE))
+                elif finished and channel.exit_status_ready():
+                    break
+                elif deadline is not None and time.time() > deadline:
+                    raise CommandTimeout('Timed out after %ds' % timeout)
+                elif finished:
+                    # The channel stays readable after EOF, wait for the
+                    # exit status instead.
+                    channel.status_event.wait(0.1)
+                else:
+                    # The channel is readable when stdout has data, stderr
+                    # and the exit status are picked up on the next pass.
+                    select.select([channel], [], [], 0.1)
+
+            # Output which arrived since it was last checked for is still
+            # buffered. Past EOF, recv() returns it without blocking, then
+            # nothing.
+            for recv, buf in ((channel.recv, stdout),
+                              (channel.recv_stderr, stderr)):
+                while True:
+                    data = recv(BUFFER_SIZE)
+
+                    if len(data) == 0:
+                        break
+
+                    buf.feed(data)
+
+            result.exit_status = channel.recv_exit_status()
+            result.stdout = stdout.close()
+            result.stderr = stderr.close()
+        finally:
+            channel.close()
+
+    def put(self, local_path, remote_path, mode=None):
+        """Upload a file over SFTP
+
+        Writes are pipelined, rather than waiting for the server to
+        acknowledge each chunk before sending the next.
+        """
+        with self._in_use():
+            self._ensure_connected()
+
+            # The SFTP session is a channel, counting towards max_sessions
+            # like a command
+            with self._sessions:
+                self._put(local_path, remote_path, mode)
+
+    def _put(self, local_path, remote_path, mode):
+        sftp = self.client.open_sftp()
+
+        try:
+            with open(local_path, 'rb') as local:
+                with sftp.open(remote_path, 'wb') as remote:
+                    remote.set_pipelined(True)
+
+                    while True:
+                        data = local.read(BUFFER_SIZE)
+
+                        if len(data) == 0:
+                            break
+
+                        remote.write(data)
+
+            if mode is not None:
+                sftp.chmod(remote_path, mode)
+        finally:
+            sftp.close()
+
+    def checksum(self, remote_path):
+        """Return the sha256 of a remote file, or None if it has none"""
+        result = self.run('sha256sum %s' % shlex_quote(remote_path))
+
+        if not result.ok:
+            return None
+
+        return result.stdout.split(' ', 1)[0]
+
+    def upload(self, local_path, remote_path, mode=None):
+        """Upload a file, unless the remote copy is already the same
+
+        :returns: True if the file was transferred
+        """
+        if self.checksum(remote_path) == file_checksum(local_path):
+            LOG.debug('%s:%s is up to date', self.hostname, remote_path)
+
+            if mode is not None:
+                self.run('chmod %o %s' % (mode, shlex_quote(remote_path)))
+
+            return False
+
+        self.put(local_path, remote_path, mode=mode)
+
+        return True
+
+    @property
+    def tunnels(self):
+        return list(self._tunnels)
+
     def tunnel(self, hostname, port=None):
-        if not self.connected:
-            self.connect()
+        """Forward an ephemeral local port to hostname:port via this host
 
-        class _ForwardHandler(_ForwardHandlerBase):
-            chain_host = hostname
-            chain_port = port if port is not None else DEFAULT_SSH_PORT
-            ssh_transport = self.client.get_transport()
+        :returns: The local port
+        """
+        self._ensure_connected()
 
-        local_port = 9002
-        server = _ForwardServer(('', local_port), _ForwardHandler)
+        port = port if port is not None else DEFAULT_SSH_PORT
 
-        thread = _ForwardThread(server)
-        thread.start()
+        tunnel = get_forwarder().add_tunnel(self.client.get_transport(),
+                                            hostname, port)
+        self._tunnels.append(tunnel)
 
-        self._tunnels.append(thread)
+        return tunnel.local_port
 
-        return local_port
 
+class SSHConnectionPool(object):
+    """Shares one SSHConnection per (hostname, port, username)
 
-class _ForwardThread(threading.Thread):
-    def __init__(self, server):
-        super(_ForwardThread, self).__init__()
-        self.server = server
-        self.running = False
+    Commands run on a pooled connection are multiplexed as channels over
+    its single transport. Connections unused for idle_timeout seconds are
+    closed the next time the pool is used, unless they're busy, e.g. with
+    a long command or a connection hopping through them. Any other
+    arguments, e.g. on_command, are passed on to each SSHConnection.
+    """
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, **kwargs):
+        self.idle_timeout = idle_timeout
+        self.connection_kwargs = kwargs
 
-    def run(self):
-        LOG.debug('Starting ServerThread')
-        self.running = True
-        self.server.serve_forever()
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def get(self, hostname, username, private_key, port=None, gateway=None):
+        """Return the pooled connection for a host
+
+        :param gateway: A (pooled) SSHConnection to a bastion host, which
+                        the connection will hop through
+        """
+        port = port if port is not None else DEFAULT_SSH_PORT
+        key = (hostname, port, username)
+
+        if gateway is not None:
+            key += (gateway.hostname, gateway.port, gateway.username)
+
+        with self._lock:
+            self._evict_idle()
+
+            connection = self._connections.get(key, None)
+
+            if connection is None:
+                LOG.debug('Creating pooled SSH connection to %s@%s:%d',
+                          username, hostname, port)
+                connection = SSHConnection(hostname, username, private_key,
+                                           port=port, gateway=gateway,
+                                           **self.connection_kwargs)
+                self._connections[key] = connection
+
+            connection.touch()
+
+            return connection
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+
+        for key, connection in list(self._connections.items()):
+            if connection.last_used < cutoff and not connection.busy:
+                LOG.debug('Closing idle SSH connection to %s@%s:%d',
+                          connection.username, connection.hostname,
+                          connection.port)
+                connection.disconnect()
+                del self._connections[key]
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.disconnect()
+
+            self._connections = {}
+
+
+class Tunnel(object):
+    """A local port forwarded to hostname:port over an SSH transport"""
+    def __init__(self, transport, hostname, port, listener):
+        self.transport = transport
+        self.hostname = hostname
+        self.port = port
+        self.listener = listener
+        self.local_port = listener.getsockname()[1]
+
+        # Counters, maintained by the Forwarder
+        self.connections = 0
+        self.active_connections = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self.closed = False
+
+    def __repr__(self):
+        return ('<Tunnel :%d -> %s:%d connections=%d sent=%d '
+                'received=%d>' % (self.local_port, self.hostname, self.port,
+                                  self.connections, self.bytes_sent,
+                                  self.bytes_received))
+
+
+class _Pipe(object):
+    """A forwarded connection: a local socket joined to an SSH channel"""
+    def __init__(self, tunnel, sock, channel):
+        self.tunnel = tunnel
+        self.sock = sock
+        self.channel = channel
+
+        # Data read from one side, waiting to be written to the other
+        self.to_channel = b''
+        self.to_sock = b''
+
+        self.sock_eof = False
+        self.channel_eof = False
+
+        # Whether each side has been sent EOF, once the other side has
+        # finished and everything it sent has been passed on. Either
+        # direction may carry on after the other is shut.
+        self.channel_shut = False
+        self.sock_shut = False
+
+        self.failed = False
+
+    @property
+    def finished(self):
+        return self.failed or (self.channel_shut and self.sock_shut)
+
+
+class Forwarder(threading.Thread):
+    """Forwards every tunnel's connections from one select() loop
+
+    Reads and writes are non-blocking and partial writes are buffered, so
+    nothing is dropped, and a slow reader only stalls its own connection.
+    Opening a connection's channel waits on the SSH server, so that's left
+    to a small pool of threads, which hand the connections back to the loop.
+    """
+    # Stop reading from one side while this much is waiting for the other
+    MAX_PENDING = 1024 * 1024
+
+    # Threads opening channels for newly accepted connections
+    OPEN_WORKERS = 4
+
+    def __init__(self):
+        super(Forwarder, self).__init__()
+        self.daemon = True
+
+        self._lock = threading.Lock()
+        self._tunnels = {}
+        self._pipes = []
+        self._opened = []
+        self._opener = None
+        self._running = True
+
+        # Lets other threads interrupt select() when tunnels change
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+
+    def _wakeup(self):
+        self._wakeup_w.send(b'x')
+
+    def add_tunnel(self, transport, hostname, port, bind_address='127.0.0.1'):
+        """Start forwarding an ephemeral local port to hostname:port"""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((bind_address, 0))
+        listener.listen(128)
+        listener.setblocking(0)
+
+        tunnel = Tunnel(transport, hostname, port, listener)
+
+        with self._lock:
+            self._tunnels[listener] = tunnel
+
+        self._wakeup()
+
+        LOG.debug('Tunnel open :%d -> %s:%d', tunnel.local_port, hostname,
+                  port)
+
+        return tunnel
+
+    def remove_tunnel(self, tunnel):
+        # The loop closes the listener and any connections
+        tunnel.closed = True
+        self._wakeup()
 
     def stop(self):
-        LOG.debug('Stopping ServerThread')
+        self._running = False
+        self._wakeup()
+        self.join()
+
+    def run(self):
+        while self._running:
+            self._adopt_opened()
+            tunnels = self._close_finished()
+
+            readers = [self._wakeup_r] + list(tunnels.keys())
+            writers = []
+            channel_pending = False
 
-        if self.running:
-            self.running = False
-            self.server.shutdown()
-            self.join()
+            for pipe in self._pipes:
+                if len(pipe.to_channel) < self.MAX_PENDING \
+                        and not pipe.sock_eof:
+                    readers.append(pipe.sock)
+                if len(pipe.to_sock) < self.MAX_PENDING \
+                        and not pipe.channel_eof:
+                    readers.append(pipe.channel)
+                if pipe.to_sock:
+                    writers.append(pipe.sock)
+                if pipe.to_channel:
+                    channel_pending = True
 
+            # Channels can't be select()ed for writing, poll while they
+            # have data waiting.
+            r, w, _ = select.select(readers, writers, [],
+                                    0.01 if channel_pending else None)
 
-class _ForwardServer(SocketServer.ThreadingTCPServer):
-    daemon_threads = True
-    allow_reuse_address = True
+            if self._wakeup_r in r:
+                self._wakeup_r.recv(1024)
 
+            for pipe in list(self._pipes):
+                self._service(pipe, r, w)
 
-class _ForwardHandlerBase(SocketServer.BaseRequestHandler):
-    def handle(self):
+            for listener in r:
+                if listener in tunnels:
+                    self._accept(tunnels[listener])
+
+        self._adopt_opened()
+
+        for pipe in list(self._pipes):
+            self._close_pipe(pipe)
+
+        for listener in self._tunnels:
+            listener.close()
+
+        if self._opener is not None:
+            self._opener.close()
+
+    def _accept(self, tunnel):
         try:
-            chan = self.ssh_transport.open_channel(
-                'direct-tcpip', (self.chain_host, self.chain_port),
-                self.request.getpeername())
+            sock, peer = tunnel.listener.accept()
+        except socket.error:
+            return
+
+        # Opening the channel waits on a round trip to the SSH server, which
+        # would stall every other connection, so do it off the loop.
+        if self._opener is None:
+            self._opener = ThreadPool(self.OPEN_WORKERS)
 
+        self._opener.apply_async(self._open, (tunnel, sock, peer))
+
+    def _open(self, tunnel, sock, peer):
+        try:
+            channel = tunnel.transport.open_channel(
+                'direct-tcpip', (tunnel.hostname, tunnel.port), peer)
         except Exception as e:
-            LOG.error('Incoming request to %s:%d failed: %s', self.chain_host,
-                      self.chain_port, repr(e))
+            LOG.error('Incoming request to %s:%d failed: %r', tunnel.hostname,
+                      tunnel.port, e)
+            sock.close()
             return
 
-        if chan is None:
+        if channel is None:
             LOG.error('Incoming request to %s:%d was rejected by the SSH '
-                      'server.', self.chain_host, self.chain_port)
+                      'server.', tunnel.hostname, tunnel.port)
+            sock.close()
             return
 
-        LOG.debug('Connected! Tunnel open %r -> %r -> %r',
-                  self.request.getpeername(),
-                  chan.getpeername(),
-                  (self.chain_host, self.chain_port))
+        sock.setblocking(0)
+        channel.setblocking(0)
 
-        while True:
-            r, w, x = select.select([self.request, chan], [], [])
+        with self._lock:
+            self._opened.append(_Pipe(tunnel, sock, channel))
 
-            if self.request in r:
-                data = self.request.recv(1024)
+        self._wakeup()
 
-                if len(data) == 0:
-                    break
+        LOG.debug('Connected! Tunnel open %r -> %r', peer,
+                  (tunnel.hostname, tunnel.port))
 
-                chan.send(data)
+    def _adopt_opened(self):
+        """Start servicing the connections _open() has handed back"""
+        with self._lock:
+            opened, self._opened = self._opened, []
 
-            if chan in r:
-                data = chan.recv(1024)
+        for pipe in opened:
+            pipe.tunnel.connections += 1
+            pipe.tunnel.active_connections += 1
+            self._pipes.append(pipe)
 
-                if len(data) == 0:
-                    break
-
-                self.request.send(data)
+    def _service(self, pipe, readable, writable):
+        try:
+            if pipe.sock in readable:
+                data = pipe.sock.recv(BUFFER_SIZE)
 
-        peername = self.request.getpeername()
+                if len(data) == 0:
+                    pipe.sock_eof = True
+                else:
+                    pipe.to_channel += data
 
-        chan.close()
-        self.request.close()
+            if pipe.channel in readable:
+                data = pipe.channel.recv(BUFFER_SIZE)
 
-        LOG.debug('Disconnected! Tunnel closed from %r', peername)
+                if len(data) == 0:
+                    pipe.channel_eof = True
+                else:
+                    pipe.to_sock += data
+
+            while pipe.to_channel and pipe.channel.send_ready():
+                sent = pipe.channel.send(pipe.to_channel)
+                pipe.to_channel = pipe.to_channel[sent:]
+                pipe.tunnel.bytes_sent += sent
+
+            if pipe.to_sock and pipe.sock in writable:
+                sent = pipe.sock.send(pipe.to_sock)
+                pipe.to_sock = pipe.to_sock[sent:]
+                pipe.tunnel.bytes_received += sent
+
+            # Pass on a half-close once everything before it has gone
+            if pipe.sock_eof and not pipe.to_channel and \
+                    not pipe.channel_shut:
+                pipe.channel.shutdown_write()
+                pipe.channel_shut = True
+
+            if pipe.channel_eof and not pipe.to_sock and not pipe.sock_shut:
+                pipe.sock.shutdown(socket.SHUT_WR)
+                pipe.sock_shut = True
+        except (socket.error, socket.timeout, EOFError,
+                paramiko.SSHException) as e:
+            if getattr(e, 'errno', None) in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+
+            LOG.debug('Tunnel connection to %s:%d failed: %r',
+                      pipe.tunnel.hostname, pipe.tunnel.port, e)
+            pipe.failed = True
+
+    def _close_finished(self):
+        """Tidy up closed tunnels and connections, return the open tunnels"""
+        for pipe in list(self._pipes):
+            if pipe.finished or pipe.tunnel.closed:
+                self._close_pipe(pipe)
+
+        with self._lock:
+            for listener, tunnel in list(self._tunnels.items()):
+                if tunnel.closed:
+                    listener.close()
+                    del self._tunnels[listener]
+
+            return dict(self._tunnels)
+
+    def _close_pipe(self, pipe):
+        if pipe in self._pipes:
+            self._pipes.remove(pipe)
+
+        pipe.channel.close()
+        pipe.sock.close()
+        pipe.tunnel.active_connections -= 1
+
+        LOG.debug('Disconnected! Tunnel closed to %s:%d',
+                  pipe.tunnel.hostname, pipe.tunnel.port)
+
+
+_forwarder = None
+_forwarder_lock = threading.Lock()
+
+
+def get_forwarder():
+    """Return the process-wide Forwarder, starting it if needed"""
+    global _forwarder
+
+    with _forwarder_lock:
+        if _forwarder is None:
+            _forwarder = Forwarder()
+            _forwarder.start()
+
+    return _forwarder
@@ -0,0 +1,134 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _get_attr(resource, attr):
+    # Neutron hands back dicts, Nova hands back Resource objects
+    if isinstance(resource, dict):
+        return resource.get(attr)
+
+    return getattr(resource, attr, None)
+
+
+class ResourceCollection(object):
+    """A set of cloud resources, indexed by both id and name"""
+    def __init__(self, kind, resources=()):
+        self.kind = kind
+
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_name = {}
+
+        self.extend(resources)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def append(self, resource):
+        id_ = _get_attr(resource, 'id')
+        name = _get_attr(resource, 'name')
+
+        with self._lock:
+            if id_ in self._by_id:
+                # Replacing a resource we already know about, e.g. with a
+                # refreshed copy. Drop the old name, it may have changed.
+                self._unindex_name(_get_attr(self._by_id[id_], 'name'), id_)
+
+            self._by_id[id_] = resource
+
+            ids = self._by_name.setdefault(name, [])
+            ids.append(id_)
+
+            if len(ids) > 1:
+                LOG.warning('Found %d %ss with name %s: %s', len(ids),
+                            self.kind, name, ', '.join(ids))
+
+    def extend(self, resources):
+        for resource in resources:
+            self.append(resource)
+
+    def remove(self, id_):
+        with self._lock:
+            resource = self._by_id.pop(id_)
+            self._unindex_name(_get_attr(resource, 'name'), id_)
+
+        return resource
+
+    def _unindex_name(self, name, id_):
+        ids = self._by_name[name]
+        ids.remove(id_)
+
+        if len(ids) == 0:
+            del self._by_name[name]
+
+    def names(self):
+        return set(self._by_name.keys())
+
+    def get(self, id_, default=None):
+        return self._by_id.get(id_, default)
+
+    def find(self, name):
+        """Return every resource with the given name"""
+        with self._lock:
+            return [self._by_id[i] for i in self._by_name.get(name, [])]
+
+    def find_ids(self, name):
+        with self._lock:
+            return list(self._by_name.get(name, []))
+
+    def get_by_name(self, name):
+        """Return the one resource with the given name
+
+        Raises if there is no such resource, or if the name is ambiguous.
+        """
+        resources = self.find(name)
+
+        if len(resources) == 0:
+            raise Exception('Failed to find %s with name: %s' %
+                            (self.kind, name))
+        elif len(resources) > 1:
+            raise Exception('Found %d %ss with name: %s' %
+                            (len(resources), self.kind, name))
+
+        return resources[0]
+
+    def get_id(self, name):
+        return _get_attr(self.get_by_name(name), 'id')
+
+
+class Store(dict):
+    """State shared between the tasks of a run
+
+    Plain keys hold the parsed config (e.g. "instances"), while resources
+    discovered or created in the cloud are held in ResourceCollections.
+    """
+    def add_collection(self, key, kind, resources=()):
+        collection = ResourceCollection(kind, resources)
+        self[key] = collection
+
+        return collection
@@ -20,6 +20,21 @@ class Task(object):
     depends = []
     rdepends = []
 
+    # The tasks whose introspection this one reuses, and so must wait for.
+    # Everything else introspects at once.
+    introspect_depends = []
+
+    # The attributes introspect() records its decisions in, by action
+    changes = {
+        'create': 'to_create',
+        'update': 'to_update',
+        'destroy': 'to_destroy',
+    }
+
+    # (store key, kind) of each ResourceCollection introspect() fills in.
+    # The first is the collection the task's changes refer to.
+    collections = []
+
     def __init__(self, runner, environment, store):
         self.runner = runner
         self.environment = environment
@@ -28,6 +43,123 @@ class Task(object):
     def _get_environment_config(self):
         return self.runner.config['environments'][self.environment]
 
+    def _get_cache_scope(self):
+        credentials = self._get_environment_config()['credentials']
+
+        return [
+            credentials.get('auth_url', None),
+            credentials.get('region_name', None),
+            credentials.get('project_id', None) or
+            credentials.get('project_name', None),
+            self.environment,
+        ]
+
+    def _cached(self, kind, fetch, dump=None, load=None):
+        """Return the listing of a resource kind, from the cache if fresh
+
+        :param fetch: Callable performing the real listing
+        :param dump: Converts fetched resources into something JSON-able
+        :param load: Converts cached resources back again
+        """
+        cache = self.runner.cache
+        scope = self._get_cache_scope()
+
+        resources = cache.get(scope, kind)
+
+        if resources is not None:
+            return load(resources) if load else resources
+
+        resources = fetch()
+        cache.set(scope, kind, dump(resources) if dump else resources)
+
+        return resources
+
+    def _invalidate_cached(self, kind):
+        """Must be called before making changes to resources of a kind"""
+        self.runner.cache.invalidate(self._get_cache_scope(), kind)
+
+    def _diff(self, current, desired):
+        """Return the fields of desired which differ from current
+
+        Dicts are compared on the keys desired has, as the API usually
+        fills in more than the config says.
+        """
+        changed = {}
+
+        for key, value in desired.items():
+            existing = current.get(key, None)
+
+            if isinstance(value, dict) and isinstance(existing, dict):
+                if all(existing.get(k, None) == v for k, v in value.items()):
+                    continue
+            elif existing == value:
+                continue
+
+            changed[key] = value
+
+        return changed
+
+    def _get_update(self, name):
+        """Return the changes an existing resource needs to match the config
+
+        :returns: A dict of field name to the value it should have
+        """
+        return {}
+
+    def _filter_updates(self, names):
+        """Return the names of the existing resources which have drifted"""
+        return set(n for n in names if len(self._get_update(n)) > 0)
+
+    def _describe_change(self, action, name):
+        """Return details of a planned change, for display"""
+        if action == 'create' or len(self.collections) == 0:
+            return {}
+
+        collection = self.store[self.collections[0][0]]
+        change = {'ids': collection.find_ids(name)}
+
+        if action == 'update':
+            change['changes'] = self._get_update(name)
+
+        return change
+
+    def _dump_resources(self, key, resources):
+        return list(resources)
+
+    def _load_resources(self, key, resources):
+        return resources
+
+    def get_plan(self):
+        """Return what introspect() decided, in a form that can be saved"""
+        changes = {}
+
+        for action, attr in self.changes.items():
+            changes[action] = []
+
+            for name in sorted(getattr(self, attr, None) or []):
+                change = self._describe_change(action, name)
+                change['name'] = name
+                changes[action].append(change)
+
+        resources = {}
+
+        for key, kind in self.collections:
+            resources[key] = self._dump_resources(key, self.store[key])
+
+        return {'changes': changes, 'resources': resources}
+
+    def load_plan(self, plan):
+        """Restore the state introspect() left behind from get_plan()"""
+        for key, kind in self.collections:
+            self.store.add_collection(
+                key, kind, self._load_resources(key, plan['resources'][key]))
+
+        for action, attr in self.changes.items():
+            # JSON has no tuples, turn any compound names back into them
+            setattr(self, attr, set(
+                tuple(c['name']) if isinstance(c['name'], list) else c['name']
+                for c in plan['changes'].get(action, [])))
+
     @property
     def enabled(self):
         return True
@@ -14,69 +14,299 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import logging
+from contractor import pagination
 from contractor.task import base
-from neutronclient.v2_0 import client as ne_client
+from contractor import utils
+from contractor import waiter
 from neutronclient.common import exceptions as ne_exceptions
+import random
+import time
 
 
 LOG = logging.getLogger(__name__)
+DEFAULT_BULK_SIZE = 50
+DEFAULT_DELETE_WORKERS = 10
+DEFAULT_DELETE_TIMEOUT = 300
+
+# Neutron's reply to a list body when the plugin doesn't allow bulk
+BULK_UNSUPPORTED_MESSAGE = 'bulk operation not supported'
+
+ROUTER_INTERFACE_OWNERS = ['network:router_interface',
+                           'network:router_interface_distributed',
+                           'network:ha_router_replicated_interface']
+
+# The fields which may be set in the config, and changed in place later
+NETWORK_FIELDS = ('admin_state_up', 'shared')
+SUBNET_FIELDS = ('gateway_ip', 'enable_dhcp', 'dns_nameservers',
+                 'host_routes', 'allocation_pools')
+
+
+def _status_code(e):
+    return getattr(e, 'status_code', None)
+
+
+def _bulk_unsupported(e):
+    """Whether a failed create was rejected for having a list body
+
+    Any other 400, e.g. a bad CIDR, is a real error in the resources.
+    """
+    if _status_code(e) == 404:
+        return True
+
+    return _status_code(e) == 400 and \
+        BULK_UNSUPPORTED_MESSAGE in str(e).lower()
 
 
 class NeutronTask(base.Task):
-    def __init__(self, runner, environment, store):
-        super(NeutronTask, self).__init__(runner, environment, store)
+    @property
+    def ne_client(self):
+        credentials = self._get_environment_config()['credentials']
+        return self.runner.clients.neutron(credentials)
+
+    def _get_neutron_config(self):
+        return self._get_environment_config().get('neutron', {})
+
+    def _list(self, collection, kind=None, **filters):
+        """List a collection a page at a time, via the introspection cache
+
+        :param kind: What to cache the listing as, needed if it's filtered
+        """
+        neutron_config = self._get_neutron_config()
+        list_func = getattr(self.ne_client, 'list_%s' % collection)
+
+        filters.update(neutron_config.get('filters', {}))
+
+        def _fetch():
+            return list(pagination.iter_neutron(
+                list_func, collection,
+                page_size=neutron_config.get('page_size',
+                                             pagination.DEFAULT_PAGE_SIZE),
+                **filters))
+
+        return self._cached(kind or 'neutron_%s' % collection, _fetch)
+
+    def _bulk_create(self, resource, create_func, bodies):
+        """Create resources using as few requests as possible
+
+        Neutron accepts a list of resources in a single POST. If the plugin
+        doesn't support that, fall back to creating them one at a time.
+
+        :param resource: Name of the resource, e.g. "network"
+        :param bodies: The resource bodies to create
+        :returns: The created resources
+        """
+        neutron_config = self._get_neutron_config()
+        bulk_size = max(1, neutron_config.get('bulk_size', DEFAULT_BULK_SIZE))
+        collection = '%ss' % resource
+
+        created = []
+        bulk = bulk_size > 1
+
+        for i in range(0, len(bodies), bulk_size):
+            batch = bodies[i:i + bulk_size]
+
+            if bulk and len(batch) > 1:
+                try:
+                    resp = create_func(body={collection: batch})
+                except ne_exceptions.NeutronClientException as e:
+                    # Plugins without bulk support reject the list body.
+                    # Anything else, e.g. a conflict or being over quota,
+                    # would fail one at a time too.
+                    if not _bulk_unsupported(e):
+                        raise
+
+                    # Bulk creates are atomic, so nothing was created
+                    LOG.warning('Bulk %s create failed, falling back to '
+                                'one at a time: %s', resource, e)
+                    bulk = False
+                else:
+                    created.extend(resp[collection])
+                    continue
 
-        env_config = self._get_environment_config()
+            for body in batch:
+                created.append(create_func(body={resource: body})[resource])
 
-        self.ne_client = ne_client.Client(
-            auth_url=env_config['credentials']['auth_url'],
-            username=env_config['credentials'].get('username', None),
-            user_id=env_config['credentials'].get('user_id', None),
-            password=env_config['credentials']['password'],
-            tenant_name=env_config['credentials'].get('project_name', None),
-            tenant_id=env_config['credentials'].get('project_id', None),
-            region_name=env_config['credentials'].get('region_name', None),
-        )
+        for r in created:
+            LOG.info('Created %s %s with id %s', resource, r['name'], r['id'])
 
-    def _get_network_id_from_name(self, name):
-        for network in self.store['_os-neutron_networks']:
-            if network['name'] == name:
-                return network['id']
+        return created
 
-        raise Exception('Failed to find network with name: %s', name)
+    def _delete_with_retry(self, description, delete_func,
+                           prepare_func=None):
+        """Call delete_func, retrying while Neutron says it's in use
 
-    def _get_subnet_id_from_name(self, name):
-        for subnet in self.store['_os-neutron_subnets']:
-            if subnet['name'] == name:
-                return subnet['id']
+        Deleting e.g. a subnet conflicts while ports on it are still being
+        cleaned up after their instances, so back off and try again, up to
+        the neutron config's delete_timeout. Something already gone counts
+        as deleted, but only if delete_func says so.
 
-        raise Exception('Failed to find subnet with name: %s', name)
+        :param prepare_func: Called before each attempt, e.g. to clear out
+                             what's in the way
+        """
+        deadline = time.time() + self._get_neutron_config().get(
+            'delete_timeout', DEFAULT_DELETE_TIMEOUT)
+        interval = waiter.DEFAULT_INTERVAL
 
-    def _get_router_id_from_name(self, name):
-        for router in self.store['_os-neutron_routers']:
-            if router['name'] == name:
-                return router['id']
+        while True:
+            if prepare_func is not None:
+                prepare_func()
+
+            try:
+                delete_func()
+                return
+            except ne_exceptions.NeutronClientException as e:
+                if _status_code(e) == 404:
+                    LOG.debug('%s is already gone', description)
+                    return
+
+                if _status_code(e) != 409 or time.time() > deadline:
+                    raise
+
+                LOG.info('%s is in use, retrying in %.1fs: %s', description,
+                         interval, e)
+
+            jitter = interval * waiter.DEFAULT_JITTER
+            time.sleep(interval + random.uniform(-jitter, jitter))
+            interval = min(interval * waiter.DEFAULT_BACKOFF,
+                           waiter.DEFAULT_MAX_INTERVAL)
+
+    def _delete_resources(self, resource, delete_func, names,
+                          prepare_func=None):
+        """Delete every resource with the given names, concurrently
+
+        :param delete_func: Called with each resource to delete
+        :param prepare_func: Called with each resource before each attempt
+                             to delete it
+        """
+        collection = self.store[self.collections[0][0]]
+        workers = self._get_neutron_config().get('delete_workers',
+                                                 DEFAULT_DELETE_WORKERS)
+        resources = []
+
+        for name in sorted(names):
+            resources.extend(collection.find(name))
+
+        def _delete(r):
+            description = '%s %s with id %s' % (resource, r['name'], r['id'])
+
+            prepare = (lambda: prepare_func(r)) if prepare_func else None
+
+            LOG.info('Destroying %s', description)
+            self._delete_with_retry(description, lambda: delete_func(r),
+                                    prepare)
+            LOG.info('Destroyed %s', description)
+
+            collection.remove(r['id'])
 
-        raise Exception('Failed to find router with name: %s', name)
+        failed = []
+
+        for r, _, exc_info in utils.parallel_map(_delete, resources, workers):
+            if exc_info is not None:
+                LOG.error('Failed to destroy %s %s with id %s: %s', resource,
+                          r['name'], r['id'], exc_info[1])
+                failed.append(r['id'])
+
+        if len(failed) > 0:
+            raise Exception('Failed to destroy %d %ss: %s' % (
+                len(failed), resource, ', '.join(failed)))
+
+    def _delete_dangling_ports(self, **filters):
+        """Clear out the ports which would stop a network or subnet going
+
+        Router interfaces are removed from their routers, and ports with no
+        device are deleted. DHCP ports go with their network, and instances'
+        ports go with the instance, so both are left alone. Ports which
+        disappear in the meantime are skipped.
+        """
+        for port in self.ne_client.list_ports(**filters)['ports']:
+            try:
+                if port['device_owner'] in ROUTER_INTERFACE_OWNERS:
+                    LOG.info('Removing interface %s from router %s',
+                             port['id'], port['device_id'])
+                    self.ne_client.remove_interface_router(
+                        port['device_id'], {'port_id': port['id']})
+                elif not port['device_id']:
+                    LOG.info('Deleting dangling port %s', port['id'])
+                    self.ne_client.delete_port(port['id'])
+            except ne_exceptions.NeutronClientException as e:
+                if _status_code(e) != 404:
+                    raise
+
+                LOG.debug('Port %s is already gone', port['id'])
+
+    def _get_desired(self, name):
+        """Return the updatable fields of a resource, as the config has them"""
+        return {}
+
+    def _get_update(self, name):
+        collection = self.store[self.collections[0][0]]
+        desired = self._get_desired(name)
+        changes = {}
+
+        for resource in collection.find(name):
+            changes.update(self._diff(resource, desired))
+
+        return changes
+
+    def _update_resources(self, resource, update_func, names):
+        """Update the drifted fields of existing resources in place
+
+        Only the fields which differ are sent, to each resource which
+        differs.
+        """
+        collection = self.store[self.collections[0][0]]
+
+        for name in sorted(names):
+            desired = self._get_desired(name)
+
+            for existing in collection.find(name):
+                changes = self._diff(existing, desired)
+
+                if len(changes) == 0:
+                    continue
+
+                LOG.info('Updating %s %s with id %s: %s', resource, name,
+                         existing['id'], ', '.join(sorted(changes)))
+
+                resp = update_func(existing['id'], body={resource: changes})
+                collection.append(resp[resource])
+
+    def _get_network_id_from_name(self, name):
+        return self.store['_os-neutron_networks'].get_id(name)
+
+    def _get_subnet_id_from_name(self, name):
+        return self.store['_os-neutron_subnets'].get_id(name)
+
+    def _get_router_id_from_name(self, name):
+        return self.store['_os-neutron_routers'].get_id(name)
 
 
 class RouterTask(NeutronTask):
     provides = 'router'
     depends = []
 
+    changes = {
+        'create': 'routers_to_create',
+        'update': 'routers_to_update',
+        'destroy': 'routers_to_destroy',
+    }
+    collections = [('_os-neutron_routers', 'router')]
+
     routers_to_create = None
     routers_to_update = None
     routers_to_destroy = None
 
     def introspect(self):
-        routers = self.ne_client.list_routers()['routers']
-        self.store['_os-neutron_routers'] = routers
+        routers = self._list('routers')
+        routers = self.store.add_collection('_os-neutron_routers', 'router',
+                                            routers)
 
-        existing_routers = set([r['name'] for r in routers])
+        existing_routers = routers.names()
         expected_routers = set(self._get_environment_config()['routers'].keys())
 
         self.routers_to_create = expected_routers.difference(existing_routers)
-        self.routers_to_update = expected_routers.intersection(existing_routers)
+        self.routers_to_update = self._filter_updates(
+            expected_routers.intersection(existing_routers))
         self.routers_to_destroy = existing_routers.difference(expected_routers)
 
         LOG.info('Router TODO - C(%d) U(%d) D(%d)',
@@ -84,9 +314,20 @@ class RouterTask(NeutronTask):
                  len(self.routers_to_update),
                  len(self.routers_to_destroy))
 
+    def _get_desired(self, name):
+        c = self._get_environment_config()['routers'][name]
+
+        if 'external_gateway_info' not in c:
+            return {}
+
+        return {'external_gateway_info': c['external_gateway_info']}
+
     def build(self):
         router_config = self._get_environment_config()['routers']
 
+        if self.routers_to_create or self.routers_to_update:
+            self._invalidate_cached('neutron_routers')
+
         for name in self.routers_to_create:
             LOG.info('Creating router %s', name)
 
@@ -103,34 +344,45 @@ class RouterTask(NeutronTask):
             LOG.info('Router %s created with id %s', name, resp['router']['id'])
             self.store['_os-neutron_routers'].append(resp['router'])
 
+        self._update_resources('router', self.ne_client.update_router,
+                               self.routers_to_update)
+
     def destroy(self):
-        for name in self.routers_to_destroy:
-            LOG.info('Destroying router %s', name)
+        if self.routers_to_destroy:
+            self._invalidate_cached('neutron_routers')
 
-            for router in self.store['_os-neutron_routers']:
-                if router['name'] == name:
-                    self.ne_client.delete_router(router['id'])
-                    LOG.info('Router %s with id %s destroyed', name,
-                             router['id'])
+        self._delete_resources(
+            'router', lambda r: self.ne_client.delete_router(r['id']),
+            self.routers_to_destroy,
+            lambda r: self._delete_dangling_ports(device_id=r['id']))
 
 
 class NetworkTask(NeutronTask):
     provides = 'network'
     depends = ['router']
 
+    changes = {
+        'create': 'networks_to_create',
+        'update': 'networks_to_update',
+        'destroy': 'networks_to_destroy',
+    }
+    collections = [('_os-neutron_networks', 'network')]
+
     networks_to_create = None
     networks_to_update = None
     networks_to_destroy = None
 
     def introspect(self):
-        networks = self.ne_client.list_networks()['networks']
-        self.store['_os-neutron_networks'] = networks
+        networks = self._list('networks')
+        networks = self.store.add_collection('_os-neutron_networks',
+                                             'network', networks)
 
-        existing_networks = set([n['name'] for n in networks])
+        existing_networks = networks.names()
         expected_networks = set(self._get_environment_config()['networks'].keys())
 
         self.networks_to_create = expected_networks.difference(existing_networks)
-        self.networks_to_update = expected_networks.intersection(existing_networks)
+        self.networks_to_update = self._filter_updates(
+            expected_networks.intersection(existing_networks))
         self.networks_to_destroy = existing_networks.difference(expected_networks)
 
         LOG.info('Network TODO - C(%d) U(%d) D(%d)',
@@ -138,43 +390,58 @@ class NetworkTask(NeutronTask):
                  len(self.networks_to_update),
                  len(self.networks_to_destroy))
 
+    def _get_desired(self, name):
+        c = self._get_environment_config()['networks'][name]
+        return dict((k, c[k]) for k in NETWORK_FIELDS if k in c)
+
     def build(self):
-        network_config = self._get_environment_config()['networks']
+        if self.networks_to_create or self.networks_to_update:
+            self._invalidate_cached('neutron_networks')
+
+        bodies = []
 
-        for name in self.networks_to_create:
+        for name in sorted(self.networks_to_create):
             LOG.info('Creating network %s', name)
 
-            c = network_config[name]
+            body = self._get_desired(name)
+            body['name'] = name
 
-            body = {
-                'network': {
-                    'name': name
-                }
-            }
+            bodies.append(body)
+
+        networks = self._bulk_create('network', self.ne_client.create_network,
+                                     bodies)
+        self.store['_os-neutron_networks'].extend(networks)
 
-            resp = self.ne_client.create_network(body=body)
-            LOG.info('Network %s created with id %s', name, resp['network']['id'])
-            self.store['_os-neutron_networks'].append(resp['network'])
+        self._update_resources('network', self.ne_client.update_network,
+                               self.networks_to_update)
 
     def destroy(self):
-        for name in self.networks_to_destroy:
-            LOG.info('Skipping destroy of network %s', name)
-            if name == 'Ext-Net':
-                continue
+        if self.networks_to_destroy:
+            self._invalidate_cached('neutron_networks')
+
+        names = set(self.networks_to_destroy)
 
-            LOG.info('Destroying network %s', name)
+        if 'Ext-Net' in names:
+            LOG.info('Skipping destroy of network Ext-Net')
+            names.discard('Ext-Net')
 
-            for network in self.store['_os-neutron_networks']:
-                if network['name'] == name:
-                    self.ne_client.delete_network(network['id'])
-                    LOG.info('Network %s with id %s destroyed', name,
-                             network['id'])
+        self._delete_resources(
+            'network', lambda r: self.ne_client.delete_network(r['id']),
+            names,
+            lambda r: self._delete_dangling_ports(network_id=r['id']))
 
 
 class SubnetTask(NeutronTask):
     provides = 'subnet'
     depends = ['network']
 
+    changes = {
+        'create': 'subnets_to_create',
+        'update': 'subnets_to_update',
+        'destroy': 'subnets_to_destroy',
+    }
+    collections = [('_os-neutron_subnets', 'subnet')]
+
     subnets_to_create = None
     subnets_to_update = None
     subnets_to_destroy = None
@@ -193,15 +460,24 @@ class SubnetTask(NeutronTask):
 
         return subnets
 
+    def _describe_change(self, action, name):
+        if action == 'create':
+            c = self._get_subnets_from_config()[name]
+            return {'network': c['network'], 'cidr': c['cidr']}
+
+        return super(SubnetTask, self)._describe_change(action, name)
+
     def introspect(self):
-        subnets = self.ne_client.list_subnets()['subnets']
-        self.store['_os-neutron_subnets'] = subnets
+        subnets = self._list('subnets')
+        subnets = self.store.add_collection('_os-neutron_subnets', 'subnet',
+                                            subnets)
 
-        existing_subnets = set([s['name'] for s in subnets])
+        existing_subnets = subnets.names()
         expected_subnets = set(self._get_subnets_from_config().keys())
 
         self.subnets_to_create = expected_subnets.difference(existing_subnets)
-        self.subnets_to_update = expected_subnets.intersection(existing_subnets)
+        self.subnets_to_update = self._filter_updates(
+            expected_subnets.intersection(existing_subnets))
         self.subnets_to_destroy = existing_subnets.difference(expected_subnets)
 
         LOG.info('Subnet TODO - C(%d) U(%d) D(%d)',
@@ -209,43 +485,79 @@ class SubnetTask(NeutronTask):
                  len(self.subnets_to_update),
                  len(self.subnets_to_destroy))
 
+    def _get_desired(self, name):
+        c = self._get_subnets_from_config()[name]
+        return dict((k, c[k]) for k in SUBNET_FIELDS if k in c)
+
+    def _get_update(self, name):
+        c = self._get_subnets_from_config()[name]
+
+        # Neutron can't change these in place
+        for subnet in self.store['_os-neutron_subnets'].find(name):
+            if subnet['cidr'] != c['cidr']:
+                LOG.warning('Subnet %s with id %s has cidr %s, not %s. It '
+                            'must be destroyed and rebuilt to change it',
+                            name, subnet['id'], subnet['cidr'], c['cidr'])
+
+        return super(SubnetTask, self)._get_update(name)
+
     def build(self):
         subnet_config = self._get_subnets_from_config()
 
-        for name in self.subnets_to_create:
+        if self.subnets_to_create or self.subnets_to_update:
+            self._invalidate_cached('neutron_subnets')
+
+        bodies = []
+
+        for name in sorted(self.subnets_to_create):
             LOG.info('Creating subnets %s', name)
 
             c = subnet_config[name]
 
             network_id = self._get_network_id_from_name(c['network'])
 
-            body = {
-                'subnet': {
-                    'name': name,
-                    'network_id': network_id,
-                    'ip_version': c.get('ip_version', 4),
-                    'cidr': c['cidr'],
-                }
-            }
+            body = self._get_desired(name)
+            body.update({
+                'name': name,
+                'network_id': network_id,
+                'ip_version': c.get('ip_version', 4),
+                'cidr': c['cidr'],
+            })
+
+            bodies.append(body)
+
+        subnets = self._bulk_create('subnet', self.ne_client.create_subnet,
+                                    bodies)
+        self.store['_os-neutron_subnets'].extend(subnets)
 
-            resp = self.ne_client.create_subnet(body=body)
-            LOG.info('Subnet %s created with id %s', name, resp['subnet']['id'])
-            self.store['_os-neutron_subnets'].append(resp['subnet'])
+        self._update_resources('subnet', self.ne_client.update_subnet,
+                               self.subnets_to_update)
 
     def destroy(self):
-        for name in self.subnets_to_destroy:
-            LOG.info('Destroying subnet %s', name)
+        if self.subnets_to_destroy:
+            self._invalidate_cached('neutron_subnets')
 
-            for subnet in self.store['_os-neutron_subnets']:
-                if subnet['name'] == name:
-                    self.ne_client.delete_subnet(subnet['id'])
-                    LOG.info('Subnet %s with id %s destroyed', name,
-                             subnet['id'])
+        self._delete_resources(
+            'subnet', lambda r: self.ne_client.delete_subnet(r['id']),
+            self.subnets_to_destroy,
+            lambda r: self._delete_dangling_ports(
+                fixed_ips=['subnet_id=%s' % r['id']]))
 
 
 class RouterInterfaceTask(NeutronTask):
     provides = 'router_interface'
     depends = ['subnet', 'router']
+    introspect_depends = ['subnet', 'router']
+
+    changes = {
+        'create': 'ri_to_create',
+        'update': 'ri_to_update',
+        'destroy': 'ri_to_destroy',
+    }
+
+    # Router interfaces are ports, named here for the (router, subnet)
+    # they join
+    collections = [('_os-neutron_router_interfaces', 'router interface')]
 
     def _parse_config(self):
         router_interfaces = []
@@ -262,13 +574,57 @@ class RouterInterfaceTask(NeutronTask):
 
         return router_interfaces
 
+    def _load_resources(self, key, resources):
+        for resource in resources:
+            resource['name'] = tuple(resource['name'])
+
+        return resources
+
+    def _get_names(self, key, collection):
+        """Map the ids of a collection to names, as its task found them"""
+        if key in self.store:
+            resources = self.store[key]
+        else:
+            # Its task is disabled, so never introspected
+            resources = self._list(collection)
+
+        return dict((r['id'], r['name']) for r in resources)
+
+    def _list_interfaces(self):
+        routers = self._get_names('_os-neutron_routers', 'routers')
+        subnets = self._get_names('_os-neutron_subnets', 'subnets')
+        interfaces = []
+
+        ports = self._list('ports', kind='neutron_router_interface_ports',
+                           device_owner=ROUTER_INTERFACE_OWNERS)
+
+        for port in ports:
+            if port['device_id'] not in routers:
+                continue
+
+            for fixed_ip in port['fixed_ips']:
+                if fixed_ip['subnet_id'] in subnets:
+                    interfaces.append({
+                        'id': port['id'],
+                        'name': (routers[port['device_id']],
+                                 subnets[fixed_ip['subnet_id']]),
+                        'router_id': port['device_id'],
+                        'subnet_id': fixed_ip['subnet_id'],
+                    })
+
+        return interfaces
+
     def introspect(self):
-        ri_config = self._parse_config()
+        interfaces = self.store.add_collection(
+            '_os-neutron_router_interfaces', 'router interface',
+            self._list_interfaces())
+
+        existing = interfaces.names()
+        expected = set(self._parse_config())
 
-        # TODO...
-        self.ri_to_create = ri_config
-        self.ri_to_update = []
-        self.ri_to_destroy = []
+        self.ri_to_create = expected.difference(existing)
+        self.ri_to_update = set()
+        self.ri_to_destroy = existing.difference(expected)
 
         LOG.info('Router Interface TODO - C(%d) U(%d) D(%d)',
                  len(self.ri_to_create),
@@ -276,24 +632,46 @@ class RouterInterfaceTask(NeutronTask):
                  len(self.ri_to_destroy))
 
     def build(self):
-        for ri in self.ri_to_create:
+        if self.ri_to_create:
+            self._invalidate_cached('neutron_router_interface_ports')
+
+        for ri in sorted(self.ri_to_create):
             router_id = self._get_router_id_from_name(ri[0])
             subnet_id = self._get_subnet_id_from_name(ri[1])
 
             body = {"subnet_id": subnet_id}
 
             try:
-                self.ne_client.add_interface_router(router_id, body)
+                resp = self.ne_client.add_interface_router(router_id, body)
             except ne_exceptions.NeutronClientException as e:
                 if 'Router already has a port on subnet' in str(e):
-                    pass
+                    continue
                 else:
                     raise
 
+            self.store['_os-neutron_router_interfaces'].append({
+                'id': resp['port_id'],
+                'name': ri,
+                'router_id': router_id,
+                'subnet_id': subnet_id,
+            })
+
+    def destroy(self):
+        if self.ri_to_destroy:
+            self._invalidate_cached('neutron_router_interface_ports')
+
+        self._delete_resources(
+            'router interface',
+            lambda r: self.ne_client.remove_interface_router(
+                r['router_id'], {'port_id': r['id']}),
+            self.ri_to_destroy)
+
 class SecurityGroupTask(NeutronTask):
     provides = 'security_group'
     depends = []
 
+    collections = [('_os-neutron_security_groups', 'security group')]
+
     def __init__(self, runner, environment, store):
         super(SecurityGroupTask, self).__init__(runner, environment, store)
 
@@ -316,16 +694,23 @@ class SecurityGroupTask(NeutronTask):
                 'description': '%s instances' % group_name,
             }
 
+    def _describe_change(self, action, name):
+        if action == 'create':
+            return {'description': self.security_groups[name]['description']}
+
+        return super(SecurityGroupTask, self)._describe_change(action, name)
+
     def introspect(self):
-        security_groups = self.ne_client.list_security_groups()['security_groups']
+        security_groups = self._list('security_groups')
 
-        self.store['_os-neutron_security_groups'] = {s['name']: s for s in security_groups}
+        security_groups = self.store.add_collection(
+            '_os-neutron_security_groups', 'security group', security_groups)
 
-        existing = set([s['name'] for s in security_groups])
+        existing = security_groups.names()
         expected = set(self.security_groups.keys())
 
         self.to_create = expected.difference(existing)
-        self.to_update = expected.intersection(existing)
+        self.to_update = self._filter_updates(expected.intersection(existing))
         self.to_destroy = existing.difference(expected)
 
         LOG.info('Security Group TODO - C(%d) U(%d) D(%d)',
@@ -333,29 +718,43 @@ class SecurityGroupTask(NeutronTask):
                  len(self.to_update),
                  len(self.to_destroy))
 
+    def _get_desired(self, name):
+        return {'description': self.security_groups[name]['description']}
+
     def build(self):
         LOG.info('Building %s security groups', len(self.to_create))
 
-        for name in self.to_create:
+        if self.to_create or self.to_update:
+            self._invalidate_cached('neutron_security_groups')
+
+        bodies = []
+
+        for name in sorted(self.to_create):
             LOG.info('Building security group with name %s', name)
 
-            body = {
-                "security_group": {
-                    "name": name,
-                    "description": self.security_groups[name]['description'],
-                },
-            }
+            bodies.append({
+                "name": name,
+                "description": self.security_groups[name]['description'],
+            })
+
+        security_groups = self._bulk_create(
+            'security_group', self.ne_client.create_security_group, bodies)
+        self.store['_os-neutron_security_groups'].extend(security_groups)
 
-            self.ne_client.create_security_group(body)
+        self._update_resources('security_group',
+                               self.ne_client.update_security_group,
+                               self.to_update)
 
     def destroy(self):
         LOG.info('Destroying %s security groups', len(self.to_destroy))
 
-        for name in self.to_destroy:
-            LOG.info('Destroying security group with name %s', name)
-            security_group_id = self.store['_os-neutron_security_groups'][name]['id']
+        if self.to_destroy:
+            self._invalidate_cached('neutron_security_groups')
 
-            self.ne_client.delete_security_group(security_group_id)
+        self._delete_resources(
+            'security_group',
+            lambda r: self.ne_client.delete_security_group(r['id']),
+            self.to_destroy)
 
 class SecurityGroupRuleTask(NeutronTask):
     provides = 'security_group_rules'
@@ -14,46 +14,95 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 from contractor.openstack.common import timeutils
+from contractor import pagination
+from contractor import remote
 from contractor import ssh
 from contractor.task import base
+from contractor.task import provision
+from contractor import utils
+from contractor import waiter
+import datetime
+from novaclient import exceptions as nv_exceptions
 import logging
-from novaclient.v1_1 import client as nv_client
+import re
+import six
 import time
 
 
 LOG = logging.getLogger(__name__)
 DEFAULT_PATTERN = "svc-%(env)s%(az)s-%(role)s%(number)04d"
+DEFAULT_CREATE_WORKERS = 10
+DEFAULT_DELETE_WORKERS = 10
+DEFAULT_DELETE_TIMEOUT = 600
+DEFAULT_MAX_UNAVAILABLE = 1
+
+# How a role's update_policy replaces instances whose image changed
+REPLACE_REBUILD = 'rebuild'
+REPLACE_RECREATE = 'replace'
 
 
 class NovaTask(base.Task):
-    def __init__(self, runner, environment, store):
-        super(NovaTask, self).__init__(runner, environment, store)
+    @property
+    def nv_client(self):
+        credentials = self._get_environment_config()['credentials']
+        return self.runner.clients.nova(credentials)
 
-        env_config = self._get_environment_config()
+    def _get_nova_config(self):
+        return self._get_environment_config().get('nova', {})
 
-        self.nv_client = nv_client.Client(
-            auth_url=env_config['credentials'].get('auth_url', None),
-            username=env_config['credentials'].get('username', None),
-            api_key=env_config['credentials'].get('password', None),
-            project_id=env_config['credentials'].get('project_id', None),
-            tenant_id=env_config['credentials'].get('project_id', None),
-            region_name=env_config['credentials'].get('region_name', None),
-            http_log_debug=True,
-        )
+    def _iter_servers(self, search_opts):
+        nova_config = self._get_nova_config()
+
+        return pagination.iter_nova(
+            self.nv_client.servers, search_opts,
+            page_size=nova_config.get('page_size',
+                                      pagination.DEFAULT_PAGE_SIZE),
+            max_limit=nova_config.get('osapi_max_limit',
+                                      pagination.DEFAULT_NOVA_MAX_LIMIT))
 
     def _get_network_id_from_name(self, name):
-        for network in self.store['_os-neutron_networks']:
-            if network['name'] == name:
-                return network['id']
+        return self.store['_os-neutron_networks'].get_id(name)
+
+    def _to_resources(self, manager, infos):
+        return [manager.resource_class(manager, i, loaded=True)
+                for i in infos]
 
-        raise Exception('Failed to find network with name: %s', name)
+    def _cached_resources(self, kind, manager, fetch):
+        # Resources are cached as their raw API representation, and turned
+        # back into novaclient Resource objects on the way out.
+        return self._cached(
+            kind, fetch,
+            dump=lambda resources: [r._info for r in resources],
+            load=lambda infos: self._to_resources(manager, infos))
 
 
 class InstanceTask(NovaTask):
+    """Builds the roles' instances
+
+    Instances whose image changes are only replaced if their role has an
+    update_policy, e.g.:
+
+        "update_policy": {"method": "rebuild", "max_unavailable": "25%",
+                          "health_check": "curl -sf http://localhost/"}
+
+    The rebuild method keeps the instance, and its addresses, while the
+    replace method deletes and recreates it, which also picks up a new
+    flavor. Each role and AZ is replaced max_unavailable instances at a
+    time, with each batch ACTIVE, provisioned and passing the optional
+    health check command before the next starts.
+    """
     provides = 'instance'
     depends = ['router_interface', 'network', 'subnet', 'security_group',
                'keypair']
 
+    changes = {
+        'create': 'to_create',
+        'update': 'to_update',
+        'replace': 'to_replace',
+        'destroy': 'to_destroy',
+    }
+    collections = [('_os-nova_instances', 'instance')]
+
     def __init__(self, runner, environment, store):
         super(InstanceTask, self).__init__(runner, environment, store)
 
@@ -104,112 +153,650 @@ class InstanceTask(NovaTask):
                     'nics': nics,
                     'keypair': keypair,
                     'provisioners': provisioners,
+                    'update_policy': role.get('update_policy', None),
                 }
 
+    def _describe_change(self, action, name):
+        if action == 'create':
+            instance = self.store['instances'][name]
+            return dict((k, instance[k]) for k in ('role', 'image', 'flavor',
+                                                   'az'))
+        elif action == 'replace':
+            change = super(InstanceTask, self)._describe_change(action, name)
+            change['changes'] = self._get_replacement(name)
+            return change
+
+        return super(InstanceTask, self)._describe_change(action, name)
+
+    def _dump_resources(self, key, resources):
+        return [r._info for r in resources]
+
+    def _load_resources(self, key, resources):
+        return self._to_resources(self.nv_client.servers, resources)
+
+    def _get_name_prefix(self):
+        # The part of the name pattern that is the same for every instance
+        # in this environment, e.g. "svc-prod" for the default pattern
+        pattern = self.runner.config.get('pattern', DEFAULT_PATTERN)
+        prefix = re.match(r'(?:[^%]|%%|%\(env\)s)*', pattern).group(0)
+
+        return prefix % {'env': self.environment}
+
+    def _list_servers(self):
+        """List this environment's servers, a page at a time
+
+        Nova can't filter on metadata, so the server side filter is on the
+        name prefix and the environment metadata is checked here.
+        """
+        prefix = self._get_name_prefix()
+        search_opts = {}
+
+        if prefix:
+            search_opts['name'] = pagination.name_prefix_regex(prefix)
+
+        return [s for s in self._iter_servers(search_opts)
+                if s.metadata.get('environment', None) == self.environment
+                or s.name in self.store['instances']]
+
     def introspect(self):
-        instances = self.nv_client.servers.list()
-        self.store['_os-nova_instances'] = {i.name: i for i in instances}
+        instances = self._cached_resources('nova_servers',
+                                           self.nv_client.servers,
+                                           self._list_servers)
+        instances = self.store.add_collection('_os-nova_instances',
+                                              'instance', instances)
 
-        existing = set([i.name for i in instances])
+        existing = instances.names()
         expected = set(self.store['instances'].keys())
 
         self.to_create = expected.difference(existing)
-        self.to_update = expected.intersection(existing)
+        self.to_replace = set(n for n in expected.intersection(existing)
+                              if len(self._get_replacement(n)) > 0)
+
+        # Recreating an instance brings in its new flavor and networks too,
+        # don't update it in place first. A rebuild keeps both.
+        recreated = set(n for n in self.to_replace
+                        if self._get_policy_method(n) == REPLACE_RECREATE)
+        self.to_update = self._filter_updates(
+            expected.intersection(existing).difference(recreated))
         self.to_destroy = existing.difference(expected)
 
-        LOG.info('Instance TODO - C(%d) U(%d) D(%d)',
+        LOG.info('Instance TODO - C(%d) U(%d) R(%d) D(%d)',
                  len(self.to_create),
                  len(self.to_update),
+                 len(self.to_replace),
                  len(self.to_destroy))
 
+    def _get_update(self, name):
+        instance = self.store['instances'][name]
+        policy = instance['update_policy'] or {}
+        networks = set(nic['network'] for nic in instance['nics'])
+        metadata = {
+            'environment': instance['environment'],
+            'role': instance['role'],
+        }
+        changes = {}
+
+        # Replacing an instance picks up the new flavor too
+        resize = policy.get('method', REPLACE_REBUILD) != REPLACE_RECREATE
+
+        for server in self.store['_os-nova_instances'].find(name):
+            if resize and str(server.flavor['id']) != str(instance['flavor']):
+                changes['flavor'] = instance['flavor']
+
+            # Without nics in the config, Nova picks the networks itself
+            if len(networks) > 0 and \
+                    set(server.networks.keys()) != networks:
+                changes['networks'] = sorted(networks)
+
+            if self._diff(server.metadata, metadata):
+                changes['metadata'] = metadata
+
+            # Instances booted from volume have no image
+            if instance['update_policy'] is None and server.image and \
+                    str(server.image['id']) != str(instance['image']):
+                LOG.warning('Instance %s with id %s has image %s, not %s. It '
+                            'must be rebuilt to change it, see '
+                            'update_policy', name, server.id,
+                            server.image['id'], instance['image'])
+
+        return changes
+
+    def _get_policy_method(self, name):
+        policy = self.store['instances'][name]['update_policy'] or {}
+        return policy.get('method', REPLACE_REBUILD)
+
+    def _get_replacement(self, name):
+        """Return the changes which need an instance rebuilt or replaced"""
+        instance = self.store['instances'][name]
+        policy = instance['update_policy']
+        changes = {}
+
+        if policy is None:
+            return changes
+
+        recreate = policy.get('method', REPLACE_REBUILD) == REPLACE_RECREATE
+
+        for server in self.store['_os-nova_instances'].find(name):
+            if server.image and \
+                    str(server.image['id']) != str(instance['image']):
+                changes['image'] = instance['image']
+
+            if recreate and \
+                    str(server.flavor['id']) != str(instance['flavor']):
+                changes['flavor'] = instance['flavor']
+
+        return changes
+
+    def _update_instance(self, name):
+        """Apply the in-place changes an instance needs
+
+        :returns: The servers which were resized, and need confirming once
+                  they reach VERIFY_RESIZE
+        """
+        instance = self.store['instances'][name]
+        changes = self._get_update(name)
+        resized = []
+
+        for server in self.store['_os-nova_instances'].find(name):
+            metadata = self._diff(server.metadata, changes.get('metadata', {}))
+
+            if metadata:
+                LOG.info('Updating metadata of instance %s (%s): %s', name,
+                         server.id, ', '.join(sorted(metadata)))
+                self.nv_client.servers.set_meta(server, metadata)
+
+            if 'networks' in changes:
+                self._update_networks(server, instance['nics'])
+
+            if 'flavor' in changes and \
+                    str(server.flavor['id']) != str(instance['flavor']):
+                LOG.info('Resizing instance %s (%s) from flavor %s to %s',
+                         name, server.id, server.flavor['id'],
+                         instance['flavor'])
+                self.nv_client.servers.resize(server, instance['flavor'])
+                resized.append(server)
+
+        return resized
+
+    def _update_networks(self, server, nics):
+        """Attach and detach interfaces to match the configured networks
+
+        New networks are attached before old ones are detached, and the
+        last interface is never detached, so the instance stays reachable.
+        """
+        expected = dict((nic['network'], nic) for nic in nics)
+        existing = set(server.networks.keys())
+
+        networks = self.store['_os-neutron_networks']
+        stale = dict((net_id, n) for n in existing.difference(expected)
+                     for net_id in networks.find_ids(n))
+        interfaces = server.interface_list()
+        remaining = len([i for i in interfaces if i.net_id not in stale])
+
+        for network in sorted(set(expected).difference(existing)):
+            LOG.info('Attaching instance %s (%s) to network %s', server.name,
+                     server.id, network)
+            server.interface_attach(None,
+                                    self._get_network_id_from_name(network),
+                                    expected[network]['fixed_ip'])
+            remaining += 1
+
+        if remaining == 0:
+            LOG.warning('Not detaching instance %s (%s) from its only '
+                        'network', server.name, server.id)
+            return
+
+        for interface in interfaces:
+            if interface.net_id in stale:
+                LOG.info('Detaching instance %s (%s) from network %s',
+                         server.name, server.id, stale[interface.net_id])
+                server.interface_detach(interface.port_id)
+
+    def _wait_for_status(self, ids, status, since, missing_status=None,
+                         name_filter=True, timeout=None):
+        """Wait for servers to reach a status
+
+        Polls with one listing of the servers changed since the given time
+        per tick, rather than a GET per pending server.
+
+        :param missing_status: Status of servers missing from the listing
+        :param name_filter: Only list servers named like this environment's
+        :param timeout: Seconds to wait, rather than the nova config's
+                        wait_timeout
+        :returns: The servers which reached the status, by id, and the ids
+                  of those which went to ERROR
+        """
+        nova_config = self._get_nova_config()
+
+        # The last seen version of each server, for the caller
+        servers = {}
+
+        search_opts = {'changes-since': since}
+        prefix = self._get_name_prefix()
+
+        if prefix and name_filter:
+            search_opts['name'] = pagination.name_prefix_regex(prefix)
+
+        def _poll(pending):
+            # Statuses come from this listing alone, so servers which have
+            # dropped out of it since get missing_status
+            statuses = {}
+
+            for server in self._iter_servers(search_opts):
+                if server.id in pending:
+                    servers[server.id] = server
+                    statuses[server.id] = server.status
+
+            return statuses
+
+        w = waiter.Waiter(
+            _poll,
+            interval=nova_config.get('wait_interval',
+                                     waiter.DEFAULT_INTERVAL),
+            max_interval=nova_config.get('wait_max_interval',
+                                         waiter.DEFAULT_MAX_INTERVAL),
+            timeout=timeout if timeout is not None else
+            nova_config.get('wait_timeout', None),
+            error_policy=nova_config.get('error_policy',
+                                         waiter.ERROR_POLICY_ABORT))
+
+        done, errored = w.wait(ids, status, errors=('ERROR',),
+                               missing_status=missing_status)
+
+        return dict((i, servers.get(i, None)) for i in done), errored
+
+    def _since(self):
+        # Servers changed from here on show up in a changes-since listing,
+        # allow some slack for clock skew between us and Nova.
+        return timeutils.isotime(
+            timeutils.utcnow() - datetime.timedelta(minutes=5))
+
+    def _create_instance(self, name):
+        LOG.info('Building instance with name %s', name)
+
+        nics = []
+        for nic in self.store['instances'][name]['nics']:
+            net_id = self._get_network_id_from_name(nic['network'])
+            nics.append({
+                'net-id': net_id,
+                'v4-fixed-ip': nic['fixed_ip'],
+            })
+
+        self._create_rate_limiter.wait()
+
+        return self.nv_client.servers.create(
+            name=name,
+            image=self.store['instances'][name]['image'],
+            flavor=self.store['instances'][name]['flavor'],
+            availability_zone=self.store['instances'][name]['az'],
+            nics=nics,
+            security_groups=['default', self.store['instances'][name]['role']],
+            key_name=self.store['instances'][name]['keypair'],
+            meta={
+                'environment': self.store['instances'][name]['environment'],
+                'role': self.store['instances'][name]['role'],
+            },
+        )
+
     def build(self):
         LOG.info('Building %s instances', len(self.to_create))
 
+        if self.to_create or self.to_update or self.to_replace:
+            self._invalidate_cached('nova_servers')
+
+        nova_config = self._get_nova_config()
+        workers = nova_config.get('create_workers', DEFAULT_CREATE_WORKERS)
+
+        # Optional cap on servers.create calls per second, to stay under the
+        # Nova API rate limits.
+        self._create_rate_limiter = utils.RateLimiter(
+            nova_config.get('create_rate', None))
+
+        since = self._since()
+
         created_instances = []
+        failed_instances = {}
 
-        for name in self.to_create:
-            LOG.info('Building instance with name %s', name)
-
-            nics = []
-            for nic in self.store['instances'][name]['nics']:
-                net_id = self._get_network_id_from_name(nic['network'])
-                nics.append({
-                    'net-id': net_id,
-                    'v4-fixed-ip': nic['fixed_ip'],
-                })
-
-            instance = self.nv_client.servers.create(
-                name=name,
-                image=self.store['instances'][name]['image'],
-                flavor=self.store['instances'][name]['flavor'],
-                availability_zone=self.store['instances'][name]['az'],
-                nics=nics,
-                security_groups=['default', self.store['instances'][name]['role']],
-                key_name=self.store['instances'][name]['keypair'],
-                meta={
-                    'environment': self.store['instances'][name]['environment'],
-                    'role': self.store['instances'][name]['role'],
-                },
-            )
-
-            created_instances.append(instance)
+        results = utils.parallel_map(self._create_instance,
+                                     sorted(self.to_create), workers)
+
+        for name, instance, exc_info in results:
+            if exc_info is None:
+                created_instances.append(instance)
+            else:
+                LOG.error('Failed to build instance with name %s: %s', name,
+                          exc_info[1])
+                failed_instances[name] = exc_info[1]
 
         # Block for instances to become "active"
         LOG.info('Waiting for %d instances to become ACTIVE',
                  len(created_instances))
 
-        pending_instances = [i.id for i in created_instances]
-
-        while len(pending_instances) != 0:
-            time.sleep(10)
-
-            for instance_id in pending_instances:
-                instance = self.nv_client.servers.get(instance_id)
+        active, errored = self._wait_for_status(
+            [i.id for i in created_instances], 'ACTIVE', since)
 
-                if instance.status == 'ACTIVE':
-                    LOG.info('Instance %s (%s) is ACTIVE', instance.name,
+        for instance in created_instances:
+            if instance.id in errored:
+                LOG.critical('Instance %s (%s) is ERROR', instance.name,
                              instance.id)
-                    pending_instances.remove(instance.id)
-                elif instance.status == 'ERROR':
-                    LOG.critical('Instance %s (%s) is ERROR', instance.name,
-                                 instance.id)
-                else:
-                    LOG.info('Instance %s (%s) is %s', instance.name,
-                             instance.id, instance.status)
+                failed_instances[instance.name] = 'ERROR'
+
+        created_instances = [active[i.id] for i in created_instances
+                             if i.id in active]
 
-        LOG.info('All newly created instances ACTIVE')
+        LOG.info('%d newly created instances ACTIVE', len(created_instances))
 
         time.sleep(10)
 
         for instance in created_instances:
-            # Add any floating IPs
+            self._add_floating_ips(instance)
 
-            for nic in self.store['instances'][instance.name]['nics']:
-                if nic['floating_ip'] is not None:
-                    LOG.info('Attaching floating ip %s to instance %s (%s)',
-                             nic['floating_ip'], instance.name, instance.id)
+        self.store['_os-nova_created-instances'] = {i.name: i for i in created_instances}
+        self.store['_os-nova_instances'].extend(created_instances)
 
-                    instance.add_floating_ip(nic['floating_ip'],
-                                             nic['fixed_ip'])
+        failed_instances.update(self._update_instances(since, workers))
+        failed_instances.update(self._replace_instances())
 
+        if len(failed_instances) > 0:
+            raise Exception('Failed to build %d instances: %s' % (
+                len(failed_instances), ', '.join(sorted(failed_instances))))
 
-        self.store['_os-nova_created-instances'] = {i.name: i for i in created_instances}
-        self.store['_os-nova_instances'].update(self.store['_os-nova_created-instances'])
+    def _update_instances(self, since, workers):
+        """Apply in-place changes to the drifted instances
+
+        :returns: Map of the names of the instances which failed to update
+                  to the reason
+        """
+        LOG.info('Updating %d instances', len(self.to_update))
+
+        failed_instances = {}
+        resized = []
+
+        results = utils.parallel_map(self._update_instance,
+                                     sorted(self.to_update), workers)
+
+        for name, servers, exc_info in results:
+            if exc_info is None:
+                resized.extend(servers)
+            else:
+                LOG.error('Failed to update instance with name %s: %s', name,
+                          exc_info[1])
+                failed_instances[name] = exc_info[1]
+
+        if len(resized) == 0:
+            return failed_instances
+
+        LOG.info('Waiting for %d resized instances to become VERIFY_RESIZE',
+                 len(resized))
+
+        verify, errored = self._wait_for_status([s.id for s in resized],
+                                                'VERIFY_RESIZE', since)
+
+        for server in resized:
+            if server.id in verify:
+                LOG.info('Confirming resize of instance %s (%s)', server.name,
+                         server.id)
+                self.nv_client.servers.confirm_resize(server)
+                self.store['_os-nova_instances'].append(verify[server.id])
+            else:
+                LOG.critical('Instance %s (%s) failed to resize', server.name,
+                             server.id)
+                failed_instances[server.name] = 'ERROR'
+
+        return failed_instances
+
+    def _add_floating_ips(self, instance):
+        for nic in self.store['instances'][instance.name]['nics']:
+            if nic['floating_ip'] is not None:
+                LOG.info('Attaching floating ip %s to instance %s (%s)',
+                         nic['floating_ip'], instance.name, instance.id)
+
+                instance.add_floating_ip(nic['floating_ip'], nic['fixed_ip'])
+
+    def _get_batch_size(self, role, az, policy):
+        max_unavailable = policy.get('max_unavailable',
+                                     DEFAULT_MAX_UNAVAILABLE)
+
+        # A percentage of the role's instances in the AZ
+        if isinstance(max_unavailable, six.string_types) and \
+                max_unavailable.endswith('%'):
+            count = len([i for i in self.store['instances'].values()
+                         if i['role'] == role and i['az'] == az])
+            max_unavailable = count * float(max_unavailable[:-1]) / 100
+
+        return max(1, int(max_unavailable))
+
+    def _replace_instances(self):
+        """Rebuild or replace instances, a batch per role and AZ at a time
+
+        The roles and AZs are rolled concurrently. A batch failing stops
+        its role and AZ, so no more of its instances are taken down.
+
+        :returns: Map of the names of the instances which failed to be
+                  replaced, or weren't because an earlier batch failed, to
+                  the reason
+        """
+        LOG.info('Replacing %d instances', len(self.to_replace))
+
+        groups = {}
+
+        for name in sorted(self.to_replace):
+            instance = self.store['instances'][name]
+            groups.setdefault((instance['role'], instance['az']),
+                              []).append(name)
+
+        failed_instances = {}
+
+        results = utils.parallel_map(
+            lambda g: self._replace_group(g[0], g[1], groups[g]),
+            sorted(groups), max(1, len(groups)))
+
+        for (role, az), _, exc_info in results:
+            if exc_info is not None:
+                LOG.error('Failed to replace instances of role %s in %s: %s',
+                          role, az, exc_info[1])
+
+                for name in groups[(role, az)]:
+                    failed_instances[name] = exc_info[1]
+
+        return failed_instances
+
+    def _replace_group(self, role, az, names):
+        policy = self.store['instances'][names[0]]['update_policy']
+        batch_size = self._get_batch_size(role, az, policy)
+
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+
+            LOG.info('Replacing %d of %d instances of role %s in %s: %s',
+                     len(batch), len(names), role, az, ', '.join(batch))
+
+            self._replace_batch(batch, policy)
+
+    def _replace_batch(self, names, policy):
+        since = self._since()
+        servers = []
+        missing = {}
+        recreate = policy.get('method', REPLACE_REBUILD) == REPLACE_RECREATE
+
+        if recreate:
+            servers, missing = self._recreate_instances(names)
+        else:
+            for name in names:
+                image = self.store['instances'][name]['image']
+
+                for server in self.store['_os-nova_instances'].find(name):
+                    LOG.info('Rebuilding instance %s (%s) with image %s',
+                             name, server.id, image)
+                    self.nv_client.servers.rebuild(server, image)
+                    servers.append(server)
+
+        active, errored = self._wait_for_status([s.id for s in servers],
+                                                'ACTIVE', since)
+
+        # Those which did come up are kept, even if others in the batch
+        # didn't
+        for server in active.values():
+            if recreate:
+                self._add_floating_ips(server)
+
+            self.store['_os-nova_instances'].append(server)
+
+        for server in servers:
+            if server.id in errored:
+                missing[server.name] = 'ERROR'
+
+        if len(missing) > 0:
+            raise Exception('%d instances are missing: %s' % (
+                len(missing), ', '.join('%s (%s)' % (n, missing[n])
+                                        for n in sorted(missing))))
+
+        self._check_health(names, policy)
+
+    def _recreate_instances(self, names):
+        """Delete instances, then create them again concurrently
+
+        :returns: The new servers, and a map of the names of any which
+                  failed to be created to the error
+        """
+        old_servers = []
+
+        for name in names:
+            old_servers.extend(self.store['_os-nova_instances'].find(name))
+
+        # Wait for them to go, their fixed IPs are needed by the new ones
+        failed = self._delete_servers(old_servers)
+
+        if len(failed) > 0:
+            raise Exception('Failed to delete %d instances: %s' % (
+                len(failed), ', '.join(s.name for s in failed)))
+
+        workers = self._get_nova_config().get('create_workers',
+                                              DEFAULT_CREATE_WORKERS)
+        servers = []
+        failed_instances = {}
+
+        for name, server, exc_info in utils.parallel_map(
+                self._create_instance, names, workers):
+            if exc_info is None:
+                servers.append(server)
+            else:
+                LOG.error('Failed to recreate instance %s: %s', name,
+                          exc_info[1])
+                failed_instances[name] = exc_info[1]
+
+        return servers, failed_instances
+
+    def _check_health(self, names, policy):
+        """Provision the replaced instances, and run the health check"""
+        health_check = policy.get('health_check', None)
+        executor = remote.Executor(self.runner)
+
+        def _check(name):
+            instance = self.store['instances'][name]
+
+            if instance['provisioners'] or health_check:
+                provision.provision(executor, name)
+
+            if health_check is None:
+                return
+
+            result = executor.connect(name).run(
+                health_check, timeout=policy.get('health_check_timeout', None),
+                output=executor.output_logger(name))
+
+            if not result.ok:
+                raise Exception('Health check %r failed on %s: exit status '
+                                '%r, %s' % (health_check, name,
+                                            result.exit_status,
+                                            result.error or result.stderr))
+
+        for name, _, exc_info in utils.parallel_map(_check, names,
+                                                    len(names)):
+            if exc_info is not None:
+                six.reraise(*exc_info)
+
+    def _delete_servers(self, servers):
+        """Delete servers, and wait until they're gone
+
+        The deletes are sent concurrently, then tracked together with one
+        listing per tick. Returning only once they're gone lets whatever
+        needs them out of the way, e.g. their ports, networks and security
+        groups, go as soon as possible.
+
+        :returns: The servers which failed to delete
+        """
+        since = self._since()
+        workers = self._get_nova_config().get('delete_workers',
+                                              DEFAULT_DELETE_WORKERS)
+
+        def _delete(server):
+            LOG.info('Deleting instance %s (%s)', server.name, server.id)
+
+            try:
+                server.delete()
+            except nv_exceptions.NotFound:
+                LOG.debug('Instance %s (%s) is already gone', server.name,
+                          server.id)
+
+        pending = []
+        failed = []
+
+        for server, _, exc_info in utils.parallel_map(_delete, servers,
+                                                      workers):
+            if exc_info is None:
+                pending.append(server)
+            else:
+                LOG.error('Failed to delete instance %s (%s): %s',
+                          server.name, server.id, exc_info[1])
+                failed.append(server)
+
+        LOG.info('Waiting for %d instances to be deleted', len(pending))
+
+        # Deleted servers show up in a changes-since listing as DELETED for
+        # a while, and then not at all. Those being destroyed may be named
+        # for an old pattern, so don't filter on the name.
+        deleted, errored = self._wait_for_status(
+            [s.id for s in pending], 'DELETED', since,
+            missing_status='DELETED', name_filter=False,
+            timeout=self._get_nova_config().get('delete_timeout',
+                                                DEFAULT_DELETE_TIMEOUT))
+
+        for server in pending:
+            if server.id in deleted:
+                self.store['_os-nova_instances'].remove(server.id)
+            else:
+                LOG.critical('Instance %s (%s) is ERROR', server.name,
+                             server.id)
+                failed.append(server)
+
+        return failed
 
     def destroy(self):
         LOG.info('Destroying %s instances', len(self.to_destroy))
 
-        for name in self.to_destroy:
+        if self.to_destroy:
+            self._invalidate_cached('nova_servers')
+
+        servers = []
+
+        for name in sorted(self.to_destroy):
             LOG.info('Destroying instance with name %s', name)
+            servers.extend(self.store['_os-nova_instances'].find(name))
+
+        failed = self._delete_servers(servers)
 
-            server = self.store['_os-nova_instances'].get(name)
-            server.delete()
+        if len(failed) > 0:
+            raise Exception('Failed to destroy %d instances: %s' % (
+                len(failed), ', '.join(sorted(s.name for s in failed))))
 
 
 class KeyPairTask(NovaTask):
     provides = 'keypair'
     depends = []
 
+    collections = [('_os-nova_keypairs', 'keypair')]
+
     def __init__(self, runner, environment, store):
         super(KeyPairTask, self).__init__(runner, environment, store)
 
@@ -223,9 +810,31 @@ class KeyPairTask(NovaTask):
                 'public_key' : keypair.get('public_key')
             }
 
+    def _dump_resources(self, key, resources):
+        return [r._info for r in resources]
+
+    def _load_resources(self, key, resources):
+        return self._to_resources(self.nv_client.keypairs, resources)
+
+    def _get_update(self, name):
+        public_key = self.store['keypairs'][name]['public_key']
+
+        if public_key is None:
+            return {}
+
+        for keypair in self.store['_os-nova_keypairs'].find(name):
+            if keypair.public_key.strip() != public_key.strip():
+                return {'public_key': public_key}
+
+        return {}
+
     def introspect(self):
-        keypairs = self.nv_client.keypairs.list()
-        existing = set([k.name for k in keypairs])
+        keypairs = self._cached_resources('nova_keypairs',
+                                          self.nv_client.keypairs,
+                                          self.nv_client.keypairs.list)
+        keypairs = self.store.add_collection('_os-nova_keypairs', 'keypair',
+                                             keypairs)
+        existing = keypairs.names()
 
         LOG.info('Existing: %s', keypairs)
         LOG.info('Existing: %s', existing)
@@ -235,7 +844,7 @@ class KeyPairTask(NovaTask):
         LOG.info('Expected: %s', expected)
 
         self.to_create = expected.difference(existing)
-        self.to_update = expected.intersection(existing)
+        self.to_update = self._filter_updates(expected.intersection(existing))
         self.to_destroy = existing.difference(expected)
 
         LOG.info('KeyPair TODO - C(%d) U(%d) D(%d)',
@@ -246,13 +855,28 @@ class KeyPairTask(NovaTask):
     def build(self):
         LOG.info('Creating %s keypairs', len(self.to_create))
 
+        if self.to_create or self.to_update:
+            self._invalidate_cached('nova_keypairs')
+
         for name in self.to_create:
             LOG.info('Creating keypair %s : %s', name, self.store['keypairs'][name]['public_key'])
             self.nv_client.keypairs.create(name, self.store['keypairs'][name]['public_key'])
 
+        # Nova can't change a keypair's public key, so replace it. Existing
+        # instances keep the key they were booted with.
+        for name in self.to_update:
+            public_key = self.store['keypairs'][name]['public_key']
+
+            LOG.info('Replacing keypair %s : %s', name, public_key)
+            self.nv_client.keypairs.delete(name)
+            self.nv_client.keypairs.create(name, public_key)
+
     def destroy(self):
         LOG.info('Deleting %s keypairs', len(self.to_destroy))
 
+        if self.to_destroy:
+            self._invalidate_cached('nova_keypairs')
+
         for name in self.to_destroy:
             LOG.info('Deleting keypair %s', name)
             self.nv_client.keypairs.delete(name)
@@ -0,0 +1,173 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+import os
+import posixpath
+import time
+
+from contractor import remote
+from contractor.task import base
+from contractor import utils
+
+
+LOG = logging.getLogger(__name__)
+
+
+def get_provisioners(config, role_name):
+    """Return a role's provisioner steps, in order"""
+    provisioners = config['roles'][role_name].get('provisioners', [])
+
+    # Older configs have a dict of named provisioners
+    if isinstance(provisioners, dict):
+        provisioners = [provisioners[k] for k in sorted(provisioners)]
+
+    return provisioners
+
+
+def _get_path(runner, path):
+    return os.path.join(runner.config_dir, os.path.expanduser(path))
+
+
+def _run_step(executor, name, step):
+    connection = executor.connect(name)
+    step_type = step.get('type', 'shell')
+
+    if step_type == 'shell':
+        command = step['command']
+    elif step_type == 'script':
+        remote_path = posixpath.join(
+            '/tmp', 'contractor-%s' % os.path.basename(step['source']))
+        connection.upload(_get_path(executor.runner, step['source']),
+                          remote_path, mode=0o755)
+        command = remote_path
+    elif step_type == 'file':
+        mode = step.get('mode', None)
+        connection.upload(_get_path(executor.runner, step['source']),
+                          step['destination'],
+                          mode=int(mode, 8) if mode is not None else None)
+        return
+    else:
+        raise Exception('Unknown provisioner type: %s' % step_type)
+
+    result = connection.run(command, timeout=step.get('timeout', None),
+                            output=executor.output_logger(name))
+
+    if not result.ok:
+        raise Exception('%r failed with exit status %r: %s' % (
+            command, result.exit_status, result.error or result.stderr))
+
+
+def provision(executor, name):
+    """Run an instance's provisioners, once it's reachable over SSH
+
+    Used by ProvisionTask for new instances, and by InstanceTask for those
+    it replaces.
+    """
+    provisioners = get_provisioners(executor.runner.config,
+                                    executor.store['instances'][name]['role'])
+
+    start = time.time()
+    executor.wait_for_ssh(name)
+
+    for i, step in enumerate(provisioners):
+        LOG.info('Provisioning %s: step %d of %d (%s)', name, i + 1,
+                 len(provisioners), step.get('type', 'shell'))
+        _run_step(executor, name, step)
+
+    LOG.info('Provisioned %s in %.2fs', name, time.time() - start)
+
+
+class ProvisionTask(base.Task):
+    """Runs each role's provisioners on newly created instances
+
+    A role's provisioners are a list of steps, run in order:
+
+        {"type": "shell", "command": "apt-get update"}
+        {"type": "script", "source": "scripts/setup.sh"}
+        {"type": "file", "source": "files/app.conf",
+         "destination": "/etc/app.conf", "mode": "0644"}
+
+    Roles may list the roles they "depend" on, which are provisioned
+    first. All the instances of the roles whose dependencies are done are
+    provisioned concurrently.
+    """
+    provides = 'provision'
+    depends = ['instance']
+
+    def _get_provisioners(self, role_name):
+        return get_provisioners(self.runner.config, role_name)
+
+    def _get_role_waves(self):
+        """Group the roles into waves, each depending only on earlier ones"""
+        roles_config = self.runner.config['roles']
+        waiting = dict((n, set(r.get('depends', [])) & set(roles_config))
+                       for n, r in roles_config.items())
+        waves = []
+
+        while len(waiting) > 0:
+            wave = set(n for n, d in waiting.items() if len(d) == 0)
+
+            if len(wave) == 0:
+                raise Exception('Role dependencies form a cycle: %s' %
+                                ', '.join(sorted(waiting)))
+
+            for name in wave:
+                del waiting[name]
+
+            for depends in waiting.values():
+                depends.difference_update(wave)
+
+            waves.append(wave)
+
+        return waves
+
+    def comission(self):
+        created = self.store.get('_os-nova_created-instances', {})
+
+        if len(created) == 0:
+            LOG.info('No new instances to provision')
+            return
+
+        executor = remote.Executor(self.runner)
+        workers = executor.ssh_config.get('workers', remote.DEFAULT_WORKERS)
+
+        failed = []
+
+        for wave in self._get_role_waves():
+            names = sorted(
+                n for n in created
+                if self.store['instances'][n]['role'] in wave
+                and len(self._get_provisioners(
+                    self.store['instances'][n]['role'])) > 0)
+
+            if len(names) == 0:
+                continue
+
+            LOG.info('Provisioning %d instances of roles: %s', len(names),
+                     ', '.join(sorted(wave)))
+
+            results = utils.parallel_map(
+                lambda n: provision(executor, n), names, workers)
+
+            for name, _, exc_info in results:
+                if exc_info is not None:
+                    LOG.error('Failed to provision %s: %s', name, exc_info[1])
+                    failed.append(name)
+
+            # Later roles may depend on these, don't carry on without them
+            if len(failed) > 0:
+                raise Exception('Failed to provision %d instances: %s' %
+                                (len(failed), ', '.join(failed)))
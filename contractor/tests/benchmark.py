@@ -0,0 +1,208 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Benchmarks full builds against the fake Nova and Neutron
+
+    python -m contractor.tests.benchmark [--sizes 10 100 1000]
+        [--latency 0.05] [--error-rate 0] [--build-time 1]
+
+For each size, an environment of that many instances is built from
+scratch, then applied again with nothing to change. The wall time, API
+calls made and peak memory of each are reported.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from contractor import cache
+from contractor import runner
+from contractor.tests import fakes
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+ENVIRONMENT = 'bench'
+ROLES = ('web', 'app', 'db', 'cache')
+AZS = ('az1', 'az2', 'az3')
+
+
+def make_config(instances):
+    """Return a config with instances spread over the roles and AZs"""
+    roles = dict((r, {'image': 'image-%s' % r, 'flavor': '100',
+                      'instances': {ENVIRONMENT: []}}) for r in ROLES)
+
+    for i in range(instances):
+        role = roles[ROLES[i % len(ROLES)]]
+        role['instances'][ENVIRONMENT].append({
+            'number': i,
+            'az': AZS[i % len(AZS)],
+            'nics': [{'network': 'bench-net'}],
+        })
+
+    return {
+        'environments': {
+            ENVIRONMENT: {
+                'credentials': {'auth_url': 'http://keystone.invalid/v2.0',
+                                'username': 'bench', 'password': 'bench',
+                                'project_name': 'bench'},
+                'routers': {'bench-router': {'subnets': ['bench-subnet']}},
+                'networks': {
+                    'bench-net': {
+                        'subnets': {
+                            'bench-subnet': {'cidr': '10.0.0.0/16'},
+                        },
+                    },
+                },
+                'keypairs': {},
+                'nova': {'wait_interval': 0.1, 'wait_max_interval': 1},
+            },
+        },
+        'roles': roles,
+        'security_groups': {},
+    }
+
+
+def _peak_memory():
+    """Return the peak memory in MB since the last _reset_peak_memory()"""
+    if tracemalloc is not None:
+        return tracemalloc.get_traced_memory()[1] / 1024.0 / 1024
+
+    # The high water mark of the whole process, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _reset_peak_memory():
+    if tracemalloc is not None:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+def _apply(config_path, cloud, workers):
+    _reset_peak_memory()
+
+    r = runner.Runner(config_path, ENVIRONMENT, workers=workers,
+                      cache=cache.IntrospectionCache(ttl=0),
+                      clients=fakes.FakeClientRegistry(cloud))
+
+    start = time.time()
+    error = None
+
+    try:
+        r.execute()
+    except Exception as e:
+        error = str(e)
+
+    report = r.metrics.report()
+
+    return {
+        'seconds': time.time() - start,
+        'api_calls': sum(c['count'] for c in report['api']),
+        'api_errors': sum(c['errors'] for c in report['api']),
+        'peak_mb': _peak_memory(),
+        'error': error,
+        'report': report,
+    }
+
+
+def run(sizes, latency=0.0, error_rate=0.0, build_time=1.0,
+        build_error_rate=0.0, workers=runner.DEFAULT_WORKERS, seed=None):
+    """Run the benchmark for each size
+
+    :returns: A list of result dicts, one per size and run
+    """
+    results = []
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        for size in sizes:
+            config_path = os.path.join(tmpdir, 'contractor-%d.json' % size)
+
+            with open(config_path, 'w') as fh:
+                json.dump(make_config(size), fh)
+
+            cloud = fakes.FakeCloud(latency=latency, error_rate=error_rate,
+                                    build_time=build_time,
+                                    build_error_rate=build_error_rate,
+                                    seed=seed)
+
+            for run_name in ('build', 'no-op'):
+                result = _apply(config_path, cloud, workers)
+                result.update({'instances': size, 'run': run_name})
+                results.append(result)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds each API call takes')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of API calls which fail')
+    parser.add_argument('--build-time', type=float, default=1.0,
+                        help='Seconds each server takes to build')
+    parser.add_argument('--build-error-rate', type=float, default=0.0,
+                        help='Fraction of servers which go to ERROR')
+    parser.add_argument('--workers', type=int,
+                        default=runner.DEFAULT_WORKERS)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output',
+                        help='Save the results, with full run reports, as '
+                             'JSON to this file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    results = run(args.sizes, latency=args.latency,
+                  error_rate=args.error_rate, build_time=args.build_time,
+                  build_error_rate=args.build_error_rate,
+                  workers=args.workers, seed=args.seed)
+
+    print('%-10s %-6s %10s %10s %8s %10s  %s' % (
+        'Instances', 'Run', 'Seconds', 'API calls', 'Errors', 'Peak MB',
+        'Result'))
+
+    for r in results:
+        print('%-10d %-6s %10.2f %10d %8d %10.1f  %s' % (
+            r['instances'], r['run'], r['seconds'], r['api_calls'],
+            r['api_errors'], r['peak_mb'], r['error'] or 'ok'))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    return 1 if any(r['error'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
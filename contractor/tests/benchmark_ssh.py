@@ -0,0 +1,309 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Benchmarks contractor.ssh against local fake SSH servers
+
+    python -m contractor.tests.benchmark_ssh fan-out [--hosts 1 10 50]
+        [--rounds 5] [--workers 50] [--latency 0] [--gateway] [--shell]
+    python -m contractor.tests.benchmark_ssh tunnel [--megabytes 64]
+        [--streams 1 4]
+
+fan-out runs a command on every host at once, as Executor.run() does,
+over pooled connections. The first round includes connecting to each
+host. tunnel pushes data through SSHConnection.tunnel() to a local sink.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+
+from contractor import remote
+from contractor import ssh
+from contractor import utils
+from contractor.tests import fake_ssh
+
+
+LOG = logging.getLogger(__name__)
+USERNAME = 'bench'
+COMMAND = 'hostname'
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def fan_out(hosts, rounds=5, workers=remote.DEFAULT_WORKERS, latency=0.0,
+            gateway=False, shell=False):
+    """Time running a command across simulated hosts
+
+    :param gateway: Hop through a bastion, itself a fake server
+    :param shell: Really run the command, rather than a canned reply
+    :returns: A result dict
+    """
+    host_key = fake_ssh.generate_key()
+    client_key = fake_ssh.generate_key()
+    commands = {} if shell else {COMMAND: (0, 'fake\n', '')}
+
+    servers = [fake_ssh.FakeSSHServer(host_key=host_key,
+                                      client_key=client_key,
+                                      latency=latency, commands=commands)
+               for _ in range(hosts + (1 if gateway else 0))]
+
+    for server in servers:
+        server.setUp()
+
+    bastion = servers.pop() if gateway else None
+    pool = ssh.SSHConnectionPool()
+
+    def _run(server):
+        via = None
+
+        if bastion is not None:
+            via = pool.get(bastion.hostname, USERNAME, bastion.private_key,
+                           port=bastion.port)
+
+        connection = pool.get(server.hostname, USERNAME, server.private_key,
+                              port=server.port, gateway=via)
+
+        return connection.run(COMMAND)
+
+    round_times = []
+    durations = []
+    failures = 0
+
+    try:
+        for i in range(rounds):
+            start = time.time()
+            results = utils.parallel_map(_run, servers, workers)
+            round_times.append(time.time() - start)
+
+            for server, result, exc_info in results:
+                if exc_info is not None or not result.ok:
+                    LOG.error('Command on :%d failed: %s', server.port,
+                              exc_info[1] if exc_info else result.error)
+                    failures += 1
+                elif i > 0:
+                    # The first round's durations include connecting
+                    durations.append(result.duration)
+    finally:
+        pool.close()
+
+        for server in servers + ([bastion] if gateway else []):
+            server.cleanUp()
+
+    warm = round_times[1:] or round_times
+
+    return {
+        'hosts': hosts,
+        'rounds': rounds,
+        'gateway': gateway,
+        'connect_round': round_times[0],
+        'warm_round': sum(warm) / len(warm),
+        'commands_per_second': hosts * len(warm) / sum(warm),
+        'p50': _percentile(durations, 50) if durations else None,
+        'p95': _percentile(durations, 95) if durations else None,
+        'max': max(durations) if durations else None,
+        'failures': failures,
+    }
+
+
+class _Sink(threading.Thread):
+    """Reads the number of bytes each connection announces, then replies"""
+    def __init__(self):
+        super(_Sink, self).__init__()
+        self.daemon = True
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+
+            thread = threading.Thread(target=self._drain, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _drain(self, sock):
+        received = 0
+
+        try:
+            header = b''
+
+            while not header.endswith(b'\n'):
+                header += sock.recv(1)
+
+            expected = int(header)
+
+            while received < expected:
+                data = sock.recv(ssh.BUFFER_SIZE)
+
+                if len(data) == 0:
+                    break
+
+                received += len(data)
+
+            sock.sendall(str(received).encode('ascii'))
+        finally:
+            sock.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def _send(port, size, received):
+    block = b'x' * ssh.BUFFER_SIZE
+    sock = socket.create_connection(('127.0.0.1', port))
+
+    try:
+        sock.sendall(str(size).encode('ascii') + b'\n')
+        remaining = size
+
+        while remaining > 0:
+            sock.sendall(block[:remaining])
+            remaining -= len(block)
+
+        received.append(int(sock.recv(64)))
+    finally:
+        sock.close()
+
+
+def tunnel(megabytes=64, streams=1):
+    """Time pushing data through a tunnel, over `streams` connections
+
+    :returns: A result dict
+    """
+    server = fake_ssh.FakeSSHServer()
+    server.setUp()
+
+    sink = _Sink()
+    sink.start()
+
+    connection = ssh.SSHConnection(server.hostname, USERNAME,
+                                   server.private_key, port=server.port)
+
+    try:
+        port = connection.tunnel('127.0.0.1', sink.port)
+        size = megabytes * 1024 * 1024 // streams
+        received = []
+
+        threads = [threading.Thread(target=_send,
+                                    args=(port, size, received))
+                   for _ in range(streams)]
+
+        start = time.time()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        seconds = time.time() - start
+    finally:
+        connection.disconnect()
+        sink.close()
+        server.cleanUp()
+
+    return {
+        'megabytes': megabytes,
+        'streams': streams,
+        'seconds': seconds,
+        'mb_per_second': sum(received) / 1024.0 / 1024 / seconds,
+        'failures': streams - sum(1 for r in received if r == size),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output',
+                        help='Save the results as JSON to this file')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    fan_out_parser = subparsers.add_parser('fan-out')
+    fan_out_parser.add_argument('--hosts', type=int, nargs='+',
+                                default=[1, 10, 50])
+    fan_out_parser.add_argument('--rounds', type=int, default=5)
+    fan_out_parser.add_argument('--workers', type=int,
+                                default=remote.DEFAULT_WORKERS)
+    fan_out_parser.add_argument('--latency', type=float, default=0.0,
+                                help='Seconds each command takes')
+    fan_out_parser.add_argument('--gateway', action='store_true',
+                                help='Hop through a bastion host')
+    fan_out_parser.add_argument('--shell', action='store_true',
+                                help='Run the command with the local shell')
+
+    tunnel_parser = subparsers.add_parser('tunnel')
+    tunnel_parser.add_argument('--megabytes', type=int, default=64)
+    tunnel_parser.add_argument('--streams', type=int, nargs='+',
+                               default=[1, 4])
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # The fake servers complain as each client hangs up
+    logging.getLogger('%s.transport' % fake_ssh.__name__).setLevel(
+        logging.CRITICAL)
+
+    if args.benchmark == 'fan-out':
+        results = [fan_out(h, rounds=args.rounds, workers=args.workers,
+                           latency=args.latency, gateway=args.gateway,
+                           shell=args.shell)
+                   for h in args.hosts]
+
+        print('%-6s %12s %12s %10s %8s %8s %8s %8s' % (
+            'Hosts', 'Connect (s)', 'Warm (s)', 'Cmds/s', 'p50', 'p95',
+            'Max', 'Failed'))
+
+        for r in results:
+            print('%-6d %12.3f %12.3f %10.1f %8.3f %8.3f %8.3f %8d' % (
+                r['hosts'], r['connect_round'], r['warm_round'],
+                r['commands_per_second'], r['p50'] or 0, r['p95'] or 0,
+                r['max'] or 0, r['failures']))
+    elif args.benchmark == 'tunnel':
+        results = [tunnel(args.megabytes, s) for s in args.streams]
+
+        print('%-8s %10s %10s %10s %8s' % (
+            'Streams', 'MB', 'Seconds', 'MB/s', 'Failed'))
+
+        for r in results:
+            print('%-8d %10d %10.2f %10.1f %8d' % (
+                r['streams'], r['megabytes'], r['seconds'],
+                r['mb_per_second'], r['failures']))
+    else:
+        parser.error('Choose a benchmark: fan-out or tunnel')
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    return 1 if any(r['failures'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""A local SSH server, for exercising contractor.ssh without real hosts"""
+import logging
+import os
+import select
+import socket
+import subprocess
+import threading
+import time
+
+import fixtures
+import paramiko
+import six
+
+
+LOG = logging.getLogger(__name__)
+KEY_BITS = 2048
+BUFFER_SIZE = 32768
+
+
+def generate_key():
+    return paramiko.RSAKey.generate(KEY_BITS)
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self.filename, attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        return paramiko.SFTP_OK
+
+
+class _SFTPInterface(paramiko.SFTPServerInterface):
+    """Serves the local filesystem, as the user running the server
+
+    Relative paths are taken from the server's root, as a remote user's are
+    from their home directory.
+    """
+    def __init__(self, server, root, *args, **kwargs):
+        super(_SFTPInterface, self).__init__(server, *args, **kwargs)
+        self.root = root
+
+    def canonicalize(self, path):
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def list_folder(self, path):
+        path = self.canonicalize(path)
+
+        try:
+            attrs = []
+
+            for filename in os.listdir(path):
+                attr = paramiko.SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(path, filename)))
+                attr.filename = filename
+                attrs.append(attr)
+
+            return attrs
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.stat(self.canonicalize(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.lstat(self.canonicalize(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self.canonicalize(path)
+
+        try:
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_CREAT and attr is not None:
+            attr._flags &= ~attr.FLAG_PERMISSIONS
+            paramiko.SFTPServer.set_file_attr(path, attr)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        handle = _SFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, self.canonicalize(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self.canonicalize(oldpath),
+                          self.canonicalize(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self.canonicalize(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self.canonicalize(path))
+
+    def chattr(self, path, attr):
+        return self._call(paramiko.SFTPServer.set_file_attr,
+                          self.canonicalize(path), attr)
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        return paramiko.SFTP_OK
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, server, transport):
+        self.server = server
+        self.transport = transport
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        if key == self.server.client_key:
+            return paramiko.AUTH_SUCCESSFUL
+
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=self.server._exec,
+                                  args=(channel, command))
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+    def check_channel_direct_tcpip_request(self, chanid, origin,
+                                           destination):
+        # Connect now, so a refused connection is reported to the client
+        # as a failure to open the channel, as OpenSSH does.
+        try:
+            sock = socket.create_connection(destination)
+        except socket.error as e:
+            LOG.debug('Forward to %s:%d failed: %s', destination[0],
+                      destination[1], e)
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+
+        self.server._add_forward(self.transport, chanid, sock)
+
+        return paramiko.OPEN_SUCCEEDED
+
+
+class FakeSSHServer(fixtures.Fixture):
+    """A paramiko SSH server, listening on an ephemeral local port
+
+    Any username is accepted, with the client_key. It supports exec,
+    SFTP and direct-tcpip channels, so SSHConnection's run(), put(),
+    tunnel() and gateway hops all work against it. SFTP and commands act
+    on the local filesystem, as the user running the server; `root` is a
+    temporary directory to use for files, and where relative paths start.
+
+    Run several, sharing a host_key and client_key, to simulate many hosts.
+    Give each its own bind_address on 127.0.0.0/8, and the same port, for
+    them to look like hosts with sshd on one port.
+
+    :param latency: Seconds each command takes before producing its output
+    :param commands: Map of command to its canned (exit status, stdout,
+                     stderr)
+    :param shell: Run other commands with the local shell. Otherwise they
+                  exit with status 127.
+    :param port: The port to listen on, by default an ephemeral one
+    """
+    def __init__(self, host_key=None, client_key=None, latency=0.0,
+                 commands=None, shell=True, bind_address='127.0.0.1',
+                 port=0):
+        super(FakeSSHServer, self).__init__()
+
+        self.host_key = host_key
+        self.client_key = client_key
+        self.latency = latency
+        self.commands = commands or {}
+        self.shell = shell
+        self.hostname = bind_address
+        self.port = port
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._transports = []
+        self._forwards = {}
+
+        # Counters, for tests to check against
+        self.connections = 0
+        self.commands_run = []
+        self.bytes_forwarded = 0
+
+    def setUp(self):
+        super(FakeSSHServer, self).setUp()
+
+        if self.host_key is None:
+            self.host_key = generate_key()
+
+        if self.client_key is None:
+            self.client_key = generate_key()
+
+        self.root = self.useFixture(fixtures.TempDir()).path
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.hostname, self.port))
+        self._listener.listen(128)
+        self.port = self._listener.getsockname()[1]
+
+        self._running = True
+        self._start_thread(self._serve)
+        self.addCleanup(self._stop)
+
+    @property
+    def private_key(self):
+        """The client key, as the string SSHConnection expects"""
+        output = six.StringIO()
+        self.client_key.write_private_key(output)
+
+        return output.getvalue()
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+    def _stop(self):
+        self._running = False
+
+        with self._lock:
+            transports, self._transports = self._transports, []
+
+        for transport in transports:
+            transport.close()
+
+        self._listener.close()
+
+    def _serve(self):
+        while self._running:
+            readable, _, _ = select.select([self._listener], [], [], 0.1)
+
+            if not readable or not self._running:
+                continue
+
+            try:
+                sock, _ = self._listener.accept()
+            except socket.error:
+                continue
+
+            # Otherwise replies to the client's small requests wait on its
+            # delayed ACKs, and the server dominates the timings
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            transport = paramiko.Transport(sock)
+            transport.set_log_channel('%s.transport' % __name__)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            _SFTPInterface, self.root)
+
+            with self._lock:
+                self.connections += 1
+                self._transports.append(transport)
+
+            self._start_thread(self._accept, transport)
+
+    def _accept(self, transport):
+        try:
+            transport.start_server(server=_ServerInterface(self, transport))
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            LOG.debug('SSH negotiation failed: %s', e)
+            transport.close()
+            return
+
+        # The transport only keeps weak references to its channels, hold
+        # on to each session until it's closed, or it may be collected
+        # before its exec request arrives. Those requests are handled as
+        # they arrive, direct-tcpip channels are forwarded from here.
+        sessions = []
+
+        while self._running and transport.is_active():
+            channel = transport.accept(0.1)
+            sessions = [c for c in sessions if not c.closed]
+
+            if channel is None:
+                continue
+
+            with self._lock:
+                sock = self._forwards.pop((transport, channel.get_id()), None)
+
+            if sock is not None:
+                self._start_thread(self._forward, channel, sock)
+            else:
+                sessions.append(channel)
+
+    def _add_forward(self, transport, chanid, sock):
+        with self._lock:
+            self._forwards[(transport, chanid)] = sock
+
+    def _count_forwarded(self, size):
+        with self._lock:
+            self.bytes_forwarded += size
+
+    def _forward(self, channel, sock):
+        # Like sshd, pass on each side's EOF and carry on with the other
+        readers = [sock, channel]
+
+        try:
+            while readers:
+                readable, _, _ = select.select(readers, [], [])
+
+                if sock in readable:
+                    data = sock.recv(BUFFER_SIZE)
+
+                    if len(data) == 0:
+                        channel.shutdown_write()
+                        readers.remove(sock)
+                    else:
+                        channel.sendall(data)
+                        self._count_forwarded(len(data))
+
+                if channel in readable:
+                    data = channel.recv(BUFFER_SIZE)
+
+                    if len(data) == 0:
+                        sock.shutdown(socket.SHUT_WR)
+                        readers.remove(channel)
+                    else:
+                        sock.sendall(data)
+                        self._count_forwarded(len(data))
+        except (socket.error, EOFError) as e:
+            LOG.debug('Forwarded connection failed: %s', e)
+        finally:
+            channel.close()
+            sock.close()
+
+    def _exec(self, channel, command):
+        if isinstance(command, six.binary_type):
+            command = command.decode('utf-8')
+
+        with self._lock:
+            self.commands_run.append(command)
+
+        exit_status = 255
+
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+
+            exit_status, stdout, stderr = self._run_command(command)
+
+            if stdout:
+                channel.sendall(stdout)
+
+            if stderr:
+                channel.sendall_stderr(stderr)
+        except Exception:
+            LOG.exception('Command %r failed', command)
+        finally:
+            # Leave closing the channel to the client. Closing it here can
+            # beat the reply to the exec request, which paramiko's client
+            # takes as the request failing.
+            channel.send_exit_status(exit_status)
+            channel.shutdown_write()
+
+    def _run_command(self, command):
+        if command in self.commands:
+            return self.commands[command]
+
+        if not self.shell:
+            return (127, '', '%s: command not found\n' % command)
+
+        process = subprocess.Popen(command, shell=True, cwd=self.root,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+
+        return (process.returncode, stdout, stderr)
@@ -0,0 +1,657 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""In-process fakes of the Nova and Neutron APIs
+
+A FakeCloud holds the state of both, and FakeClientRegistry hands out
+clients onto it in place of a contractor.clients.ClientRegistry:
+
+    cloud = fakes.FakeCloud(latency=0.05, build_time=2)
+    runner.Runner(config, 'test', clients=fakes.FakeClientRegistry(cloud))
+
+Every call sleeps for the configured latency, may fail with the configured
+error rate, and is reported to the registry's observers like a real API
+request. Servers go through BUILD, RESIZE, REBUILD and deletion in the
+background, taking build_time seconds.
+"""
+import copy
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+
+from contractor.openstack.common import timeutils
+from neutronclient.common import exceptions as ne_exceptions
+from novaclient import exceptions as nv_exceptions
+
+
+def _neutron_error(status_code, message):
+    return ne_exceptions.NeutronClientException(message=message,
+                                                status_code=status_code)
+
+
+class FakeCloud(object):
+    """The state shared by the fake Nova and Neutron clients
+
+    :param latency: Seconds each API call takes
+    :param error_rate: Fraction of API calls which fail, with a 503
+    :param build_time: Seconds servers spend building, resizing, rebuilding
+                       or deleting
+    :param build_error_rate: Fraction of server builds which go to ERROR
+    :param seed: Seed for the random failures, for repeatable runs
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, build_time=1.0,
+                 build_error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.build_time = build_time
+        self.build_error_rate = build_error_rate
+
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.observers = []
+
+        self.servers = {}
+        self.keypairs = {}
+
+        self.routers = {}
+        self.networks = {}
+        self.subnets = {}
+        self.ports = {}
+        self.security_groups = {}
+
+        self._ips = itertools.count(10)
+
+    def call(self, service, method, url, func, *args, **kwargs):
+        """Make a fake API call, with latency, errors and observers"""
+        start = time.time()
+        status = 200
+
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+
+            with self.lock:
+                failed = self.random.random() < self.error_rate
+
+            if failed:
+                status = 503
+
+                if service == 'compute':
+                    raise nv_exceptions.ClientException(
+                        503, 'Injected failure')
+
+                raise _neutron_error(503, 'Injected failure')
+
+            return func(*args, **kwargs)
+        except (nv_exceptions.ClientException,
+                ne_exceptions.NeutronClientException) as e:
+            status = getattr(e, 'code', None) or \
+                getattr(e, 'status_code', None)
+            raise
+        finally:
+            duration = time.time() - start
+
+            for observer in self.observers:
+                observer(service, method, url, status, start, duration, None)
+
+    def next_ip(self, cidr='10.0.0.0/8'):
+        with self.lock:
+            n = next(self._ips)
+
+        prefix = cidr.split('/')[0].split('.')[:2]
+        return '.'.join(prefix + [str(n // 250 % 250), str(n % 250 + 2)])
+
+    def tick(self):
+        """Move servers through their status transitions"""
+        now = time.time()
+
+        with self.lock:
+            for server in list(self.servers.values()):
+                transition = server.pop('_transition', None)
+
+                if transition is None:
+                    continue
+
+                at, status = transition
+
+                if now < at:
+                    server['_transition'] = transition
+                    continue
+
+                server['status'] = status
+                server['updated'] = timeutils.utcnow()
+
+                if status == 'DELETED':
+                    for port_id in [p['id'] for p in self.ports.values()
+                                    if p['device_id'] == server['id']]:
+                        del self.ports[port_id]
+
+    def transition(self, server, status, final):
+        """Put a server in status, until it becomes final after build_time"""
+        server['status'] = status
+        server['updated'] = timeutils.utcnow()
+        server['_transition'] = (
+            time.time() + self.build_time * self.random.uniform(0.5, 1.5),
+            final)
+
+
+class FakeResource(object):
+    """A snapshot of a resource, like a novaclient Resource"""
+    def __init__(self, manager, info, loaded=False):
+        self.manager = manager
+        self._info = info
+
+        for k, v in info.items():
+            setattr(self, k, v)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self._info.get('id'))
+
+
+class FakeServer(FakeResource):
+    def delete(self):
+        self.manager.delete(self)
+
+    def add_floating_ip(self, address, fixed_address=None):
+        self.manager.add_floating_ip(self, address, fixed_address)
+
+    def interface_list(self):
+        return self.manager.interface_list(self)
+
+    def interface_attach(self, port_id, net_id, fixed_ip):
+        return self.manager.interface_attach(self, port_id, net_id, fixed_ip)
+
+    def interface_detach(self, port_id):
+        return self.manager.interface_detach(self, port_id)
+
+
+class FakeKeypair(FakeResource):
+    @property
+    def id(self):
+        return self.name
+
+
+class FakeInterface(FakeResource):
+    pass
+
+
+class FakeServerManager(object):
+    resource_class = FakeServer
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def _call(self, method, url, func, *args, **kwargs):
+        return self.cloud.call('compute', method, url, func, *args,
+                               **kwargs)
+
+    def _get(self, server):
+        server_id = getattr(server, 'id', server)
+        info = self.cloud.servers.get(server_id, None)
+
+        if info is None or info['status'] == 'DELETED':
+            raise nv_exceptions.NotFound(404, 'No server %s' % server_id)
+
+        return info
+
+    def _to_resource(self, info):
+        info = dict((k, copy.deepcopy(v)) for k, v in info.items()
+                    if not k.startswith('_') and k != 'updated')
+        return self.resource_class(self, info, loaded=True)
+
+    def _network_name(self, net_id):
+        return self.cloud.networks[net_id]['name']
+
+    def _list(self, search_opts):
+        search_opts = dict(search_opts or {})
+        limit = search_opts.pop('limit', None)
+        marker = search_opts.pop('marker', None)
+        since = search_opts.pop('changes-since', None)
+        name = search_opts.pop('name', None)
+
+        if since is not None:
+            since = timeutils.normalize_time(timeutils.parse_isotime(since))
+
+        self.cloud.tick()
+
+        with self.cloud.lock:
+            servers = sorted(self.cloud.servers.values(),
+                             key=lambda s: s['id'])
+
+            if marker is not None:
+                servers = [s for s in servers if s['id'] > marker]
+
+            if since is not None:
+                # Like Nova, changes-since listings include deleted servers
+                servers = [s for s in servers if s['updated'] >= since]
+            else:
+                servers = [s for s in servers if s['status'] != 'DELETED']
+
+            if name is not None:
+                servers = [s for s in servers if re.search(name, s['name'])]
+
+            if limit is not None:
+                servers = servers[:limit]
+
+            return [self._to_resource(s) for s in servers]
+
+    def list(self, detailed=True, search_opts=None):
+        return self._call('GET', '/servers/detail', self._list, search_opts)
+
+    def get(self, server):
+        def _get():
+            self.cloud.tick()
+
+            with self.cloud.lock:
+                return self._to_resource(self._get(server))
+
+        return self._call('GET', '/servers/{id}', _get)
+
+    def _create(self, name, image, flavor, availability_zone=None,
+                nics=None, security_groups=None, key_name=None, meta=None):
+        with self.cloud.lock:
+            server = {
+                'id': str(uuid.uuid4()),
+                'name': name,
+                'image': {'id': image},
+                'flavor': {'id': flavor},
+                'metadata': dict(meta or {}),
+                'networks': {},
+                'security_groups': [{'name': g}
+                                    for g in security_groups or []],
+                'key_name': key_name,
+                'OS-EXT-AZ:availability_zone': availability_zone,
+            }
+
+            failed = self.cloud.random.random() < \
+                self.cloud.build_error_rate
+            self.cloud.transition(server, 'BUILD',
+                                  'ERROR' if failed else 'ACTIVE')
+
+            for nic in nics or []:
+                self._add_port(server, nic['net-id'],
+                               nic.get('v4-fixed-ip', None))
+
+            self.cloud.servers[server['id']] = server
+
+            return self._to_resource(server)
+
+    def create(self, name, image, flavor, **kwargs):
+        return self._call('POST', '/servers', self._create, name, image,
+                          flavor, **kwargs)
+
+    def _add_port(self, server, net_id, fixed_ip=None):
+        subnets = [s for s in self.cloud.subnets.values()
+                   if s['network_id'] == net_id]
+        cidr = subnets[0]['cidr'] if subnets else '10.0.0.0/8'
+        fixed_ip = fixed_ip or self.cloud.next_ip(cidr)
+
+        port = {
+            'id': str(uuid.uuid4()),
+            'name': '',
+            'network_id': net_id,
+            'device_id': server['id'],
+            'device_owner': 'compute:%s' % (
+                server['OS-EXT-AZ:availability_zone'] or 'nova'),
+            'fixed_ips': [{'subnet_id': s['id'], 'ip_address': fixed_ip}
+                          for s in subnets[:1]],
+        }
+        self.cloud.ports[port['id']] = port
+
+        server['networks'].setdefault(self._network_name(net_id),
+                                      []).append(fixed_ip)
+
+        return port
+
+    def _delete(self, server):
+        with self.cloud.lock:
+            info = self._get(server)
+            self.cloud.transition(info, info['status'], 'DELETED')
+            info['OS-EXT-STS:task_state'] = 'deleting'
+
+    def delete(self, server):
+        return self._call('DELETE', '/servers/{id}', self._delete, server)
+
+    def _action(self, server, status, final, **changes):
+        with self.cloud.lock:
+            info = self._get(server)
+            info.update(changes)
+            self.cloud.transition(info, status, final)
+
+    def resize(self, server, flavor):
+        return self._call('POST', '/servers/{id}/action', self._action,
+                          server, 'RESIZE', 'VERIFY_RESIZE',
+                          flavor={'id': flavor})
+
+    def confirm_resize(self, server):
+        def _confirm():
+            with self.cloud.lock:
+                info = self._get(server)
+                info['status'] = 'ACTIVE'
+                info['updated'] = timeutils.utcnow()
+
+        return self._call('POST', '/servers/{id}/action', _confirm)
+
+    def rebuild(self, server, image):
+        return self._call('POST', '/servers/{id}/action', self._action,
+                          server, 'REBUILD', 'ACTIVE', image={'id': image})
+
+    def set_meta(self, server, metadata):
+        def _set_meta():
+            with self.cloud.lock:
+                self._get(server)['metadata'].update(metadata)
+
+        return self._call('POST', '/servers/{id}/metadata', _set_meta)
+
+    def add_floating_ip(self, server, address, fixed_address=None):
+        def _add():
+            with self.cloud.lock:
+                info = self._get(server)
+
+                for addresses in info['networks'].values():
+                    addresses.append(address)
+                    break
+
+        return self._call('POST', '/servers/{id}/action', _add)
+
+    def interface_list(self, server):
+        def _list():
+            with self.cloud.lock:
+                info = self._get(server)
+                return [FakeInterface(self, {'port_id': p['id'],
+                                             'net_id': p['network_id']})
+                        for p in self.cloud.ports.values()
+                        if p['device_id'] == info['id']]
+
+        return self._call('GET', '/servers/{id}/os-interface', _list)
+
+    def interface_attach(self, server, port_id, net_id, fixed_ip):
+        def _attach():
+            with self.cloud.lock:
+                port = self._add_port(self._get(server), net_id, fixed_ip)
+                return FakeInterface(self, {'port_id': port['id'],
+                                            'net_id': net_id})
+
+        return self._call('POST', '/servers/{id}/os-interface', _attach)
+
+    def interface_detach(self, server, port_id):
+        def _detach():
+            with self.cloud.lock:
+                info = self._get(server)
+                port = self.cloud.ports.pop(port_id)
+                info['networks'].pop(
+                    self._network_name(port['network_id']), None)
+
+        return self._call('DELETE', '/servers/{id}/os-interface/{id}',
+                          _detach)
+
+
+class FakeKeypairManager(object):
+    resource_class = FakeKeypair
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def list(self):
+        def _list():
+            with self.cloud.lock:
+                return [FakeKeypair(self, dict(k))
+                        for k in self.cloud.keypairs.values()]
+
+        return self.cloud.call('compute', 'GET', '/os-keypairs', _list)
+
+    def create(self, name, public_key=None):
+        def _create():
+            with self.cloud.lock:
+                if name in self.cloud.keypairs:
+                    raise nv_exceptions.Conflict(409, 'Keypair exists')
+
+                keypair = {'name': name, 'public_key': public_key or
+                           'ssh-rsa AAAA fake'}
+                self.cloud.keypairs[name] = keypair
+
+                return FakeKeypair(self, dict(keypair))
+
+        return self.cloud.call('compute', 'POST', '/os-keypairs', _create)
+
+    def delete(self, key):
+        def _delete():
+            with self.cloud.lock:
+                if self.cloud.keypairs.pop(getattr(key, 'name', key),
+                                           None) is None:
+                    raise nv_exceptions.NotFound(404, 'No keypair')
+
+        return self.cloud.call('compute', 'DELETE', '/os-keypairs/{id}',
+                               _delete)
+
+
+class FakeNovaClient(object):
+    def __init__(self, cloud):
+        self.servers = FakeServerManager(cloud)
+        self.keypairs = FakeKeypairManager(cloud)
+
+
+class FakeNeutronClient(object):
+    # Collection name to the attribute of FakeCloud holding it
+    COLLECTIONS = ('routers', 'networks', 'subnets', 'ports',
+                   'security_groups')
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+        for collection in self.COLLECTIONS:
+            resource = collection[:-1]
+
+            for action in ('list', 'create', 'update', 'delete'):
+                func = getattr(self, '_%s' % action)
+                setattr(self, '%s_%s' % (action, collection if action ==
+                                         'list' else resource),
+                        self._bind(func, collection, resource))
+
+    def _bind(self, func, collection, resource):
+        def _method(*args, **kwargs):
+            return func(collection, resource, *args, **kwargs)
+
+        return _method
+
+    def _call(self, method, url, func, *args, **kwargs):
+        return self.cloud.call('network', method, url, func, *args,
+                               **kwargs)
+
+    def _matches(self, resource, filters):
+        for key, value in filters.items():
+            if key == 'fixed_ips':
+                subnets = set(v.split('=', 1)[1] for v in value)
+
+                if not any(f['subnet_id'] in subnets
+                           for f in resource['fixed_ips']):
+                    return False
+            elif isinstance(value, (list, tuple)):
+                if resource.get(key, None) not in value:
+                    return False
+            elif resource.get(key, None) != value:
+                return False
+
+        return True
+
+    def _list(self, collection, resource, retrieve_all=True, limit=None,
+              **filters):
+        def _page(resources):
+            return self._call('GET', '/%s' % collection,
+                              lambda: {collection: resources})
+
+        with self.cloud.lock:
+            resources = [copy.deepcopy(r) for r in
+                         sorted(getattr(self.cloud, collection).values(),
+                                key=lambda r: r['id'])
+                         if self._matches(r, filters)]
+
+        if retrieve_all:
+            return _page(resources)
+
+        def _pages():
+            size = limit or len(resources) or 1
+
+            for i in range(0, max(len(resources), 1), size):
+                yield _page(resources[i:i + size])
+
+        return _pages()
+
+    def _create_one(self, collection, body):
+        resource = dict(body)
+        resource.setdefault('id', str(uuid.uuid4()))
+        resource.setdefault('name', '')
+
+        if collection == 'subnets':
+            resource.setdefault('gateway_ip', resource['cidr'].rsplit(
+                '.', 1)[0] + '.1')
+            resource.setdefault('enable_dhcp', True)
+        elif collection == 'networks':
+            resource.setdefault('admin_state_up', True)
+            resource.setdefault('shared', False)
+        elif collection == 'routers':
+            resource.setdefault('external_gateway_info', None)
+
+        getattr(self.cloud, collection)[resource['id']] = resource
+
+        return copy.deepcopy(resource)
+
+    def _create(self, collection, resource, body=None):
+        def _create():
+            with self.cloud.lock:
+                if collection in body:
+                    return {collection: [self._create_one(collection, b)
+                                         for b in body[collection]]}
+
+                return {resource: self._create_one(collection,
+                                                   body[resource])}
+
+        return self._call('POST', '/%s' % collection, _create)
+
+    def _get(self, collection, resource_id):
+        resource = getattr(self.cloud, collection).get(resource_id, None)
+
+        if resource is None:
+            raise _neutron_error(404, 'No such resource %s' % resource_id)
+
+        return resource
+
+    def _update(self, collection, resource, resource_id, body=None):
+        def _update():
+            with self.cloud.lock:
+                r = self._get(collection, resource_id)
+                r.update(body[resource])
+                return {resource: copy.deepcopy(r)}
+
+        return self._call('PUT', '/%s/{id}' % collection, _update)
+
+    def _in_use(self, collection, resource_id):
+        ports = self.cloud.ports.values()
+
+        if collection == 'routers':
+            return any(p['device_id'] == resource_id for p in ports)
+        elif collection == 'networks':
+            return any(p['network_id'] == resource_id for p in ports)
+        elif collection == 'subnets':
+            return any(f['subnet_id'] == resource_id
+                       for p in ports for f in p['fixed_ips'])
+        elif collection == 'security_groups':
+            name = self.cloud.security_groups[resource_id]['name']
+            return any(g['name'] == name
+                       for s in self.cloud.servers.values()
+                       if s['status'] != 'DELETED'
+                       for g in s['security_groups'])
+
+        return False
+
+    def _delete(self, collection, resource, resource_id):
+        def _delete():
+            self.cloud.tick()
+
+            with self.cloud.lock:
+                self._get(collection, resource_id)
+
+                if self._in_use(collection, resource_id):
+                    raise _neutron_error(409, '%s %s is in use' % (
+                        resource, resource_id))
+
+                if collection == 'networks':
+                    for subnet_id in [s['id'] for s in
+                                      self.cloud.subnets.values()
+                                      if s['network_id'] == resource_id]:
+                        del self.cloud.subnets[subnet_id]
+
+                del getattr(self.cloud, collection)[resource_id]
+
+        return self._call('DELETE', '/%s/{id}' % collection, _delete)
+
+    def add_interface_router(self, router_id, body=None):
+        def _add():
+            with self.cloud.lock:
+                self._get('routers', router_id)
+                subnet = self._get('subnets', body['subnet_id'])
+
+                for port in self.cloud.ports.values():
+                    if port['device_id'] == router_id and \
+                            any(f['subnet_id'] == subnet['id']
+                                for f in port['fixed_ips']):
+                        raise _neutron_error(
+                            400, 'Router already has a port on subnet %s' %
+                            subnet['id'])
+
+                port = self._create_one('ports', {
+                    'network_id': subnet['network_id'],
+                    'device_id': router_id,
+                    'device_owner': 'network:router_interface',
+                    'fixed_ips': [{'subnet_id': subnet['id'],
+                                   'ip_address': subnet['gateway_ip']}],
+                })
+
+                return {'id': router_id, 'port_id': port['id'],
+                        'subnet_id': subnet['id']}
+
+        return self._call('PUT', '/routers/{id}/add_router_interface', _add)
+
+    def remove_interface_router(self, router_id, body=None):
+        def _remove():
+            with self.cloud.lock:
+                port = self._get('ports', body['port_id'])
+
+                if port['device_id'] != router_id:
+                    raise _neutron_error(404, 'Port %s is not on router %s' %
+                                         (port['id'], router_id))
+
+                del self.cloud.ports[port['id']]
+
+        return self._call('PUT', '/routers/{id}/remove_router_interface',
+                          _remove)
+
+
+class FakeClientRegistry(object):
+    """Stands in for a contractor.clients.ClientRegistry"""
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def add_observer(self, observer):
+        self.cloud.observers.append(observer)
+
+    def nova(self, credentials):
+        return FakeNovaClient(self.cloud)
+
+    def neutron(self, credentials):
+        return FakeNeutronClient(self.cloud)
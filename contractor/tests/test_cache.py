@@ -0,0 +1,169 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import os
+
+import fixtures
+
+from contractor import cache
+from contractor import runner
+from contractor.tests import base
+from contractor.tests import benchmark
+from contractor.tests import fakes
+
+
+SCOPE = ['http://keystone.invalid/v2.0', None, 'bench', 'bench']
+NETWORKS = [{'id': 'id-1', 'name': 'one'}]
+
+
+class IntrospectionCacheTestCase(base.TestCase):
+    def setUp(self):
+        super(IntrospectionCacheTestCase, self).setUp()
+
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'cache')
+
+    def _cache(self, **kwargs):
+        return cache.IntrospectionCache(path=self.path, **kwargs)
+
+    def test_disabled(self):
+        c = self._cache(ttl=0)
+        c.set(SCOPE, 'networks', NETWORKS)
+
+        self.assertIsNone(c.get(SCOPE, 'networks'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_ttl(self):
+        c = self._cache(ttl=60)
+        c.set(SCOPE, 'networks', NETWORKS)
+
+        self.now += 60
+        self.assertEqual(NETWORKS, c.get(SCOPE, 'networks'))
+
+        self.now += 1
+        self.assertIsNone(c.get(SCOPE, 'networks'))
+
+    def test_keyed_by_scope_and_kind(self):
+        c = self._cache(ttl=60)
+        c.set(SCOPE, 'networks', NETWORKS)
+
+        self.assertIsNone(c.get(SCOPE, 'subnets'))
+        self.assertIsNone(c.get(SCOPE[:3] + ['other'], 'networks'))
+
+    def test_refresh(self):
+        self._cache(ttl=60).set(SCOPE, 'networks', NETWORKS)
+
+        c = self._cache(ttl=60, refresh=True)
+
+        # Cached entries are ignored, but fresh ones still written back
+        self.assertIsNone(c.get(SCOPE, 'networks'))
+
+        c.set(SCOPE, 'networks', [])
+        self.assertEqual([], self._cache(ttl=60).get(SCOPE, 'networks'))
+
+    def test_invalidate(self):
+        c = self._cache(ttl=60)
+        c.set(SCOPE, 'networks', NETWORKS)
+        c.invalidate(SCOPE, 'networks')
+
+        self.assertIsNone(c.get(SCOPE, 'networks'))
+
+        # Invalidating what isn't cached is fine
+        c.invalidate(SCOPE, 'networks')
+
+    def test_corrupt_entry(self):
+        c = self._cache(ttl=60)
+        c.set(SCOPE, 'networks', NETWORKS)
+
+        with open(c._filename(SCOPE, 'networks'), 'w') as fh:
+            fh.write('{')
+
+        self.assertIsNone(c.get(SCOPE, 'networks'))
+
+    def test_directory_exists(self):
+        os.makedirs(self.path)
+
+        c = self._cache(ttl=60)
+        c.set(SCOPE, 'networks', NETWORKS)
+
+        self.assertEqual(NETWORKS, c.get(SCOPE, 'networks'))
+
+
+class TaskCacheTestCase(base.TestCase):
+    """Tasks read listings through the cache, and drop them on changes"""
+    def setUp(self):
+        super(TaskCacheTestCase, self).setUp()
+
+        self.cloud = fakes.FakeCloud(build_time=0.01, seed=1)
+        self.listings = []
+        self.cloud.observers.append(self._observe)
+
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.config_path = os.path.join(tempdir, 'contractor.json')
+        self.cache = cache.IntrospectionCache(
+            path=os.path.join(tempdir, 'cache'), ttl=300)
+
+        self._write_config(benchmark.make_config(0))
+
+    def _observe(self, service, method, url, status, start, duration, size):
+        if method == 'GET' and url.startswith('/networks'):
+            self.listings.append(url)
+
+    def _write_config(self, config):
+        with open(self.config_path, 'w') as fh:
+            json.dump(config, fh)
+
+    def _runner(self):
+        return runner.Runner(self.config_path, benchmark.ENVIRONMENT,
+                             cache=self.cache,
+                             clients=fakes.FakeClientRegistry(self.cloud))
+
+    def _cached_networks(self):
+        return self.cache.get(SCOPE, 'neutron_networks')
+
+    def test_cached_between_runs(self):
+        self._runner().plan()
+        self._runner().plan()
+
+        self.assertEqual(1, len(self.listings))
+        self.assertEqual([], self._cached_networks())
+
+    def test_invalidated_on_create_and_delete(self):
+        r = self._runner()
+        r.plan()
+        self.assertIsNotNone(self._cached_networks())
+
+        r.tasks['network'].build()
+        self.assertIsNone(self._cached_networks())
+
+        # The next run sees the new network
+        r = self._runner()
+        r.plan()
+        self.assertEqual(['bench-net'],
+                         [n['name'] for n in self._cached_networks()])
+
+        config = benchmark.make_config(0)
+        config['environments'][benchmark.ENVIRONMENT]['networks'] = {}
+        config['environments'][benchmark.ENVIRONMENT]['routers'] = {}
+        self._write_config(config)
+
+        r = self._runner()
+        r.plan()
+        r.tasks['network'].destroy()
+        self.assertIsNone(self._cached_networks())
@@ -0,0 +1,56 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from contractor.cmd import contractor
+from contractor.tests import base
+
+
+class LegacyCommandTestCase(base.TestCase):
+    def _assertArgv(self, expected, argv):
+        self.assertEqual(expected.split(),
+                         contractor._insert_legacy_command(argv.split()))
+
+    def test_environment(self):
+        self._assertArgv('apply prod', 'prod')
+        self._assertArgv('apply prod other.json', 'prod other.json')
+
+    def test_subcommands(self):
+        for command in contractor.COMMANDS:
+            self._assertArgv('%s prod' % command, '%s prod' % command)
+
+    def test_options_with_values(self):
+        self._assertArgv('--workers 8 apply prod', '--workers 8 prod')
+        self._assertArgv('--workers 8 --cache-ttl 60 apply prod',
+                         '--workers 8 --cache-ttl 60 prod')
+        self._assertArgv('--log-file run.log apply prod',
+                         '--log-file run.log prod')
+        self._assertArgv('--config-file c.conf apply prod',
+                         '--config-file c.conf prod')
+
+    def test_options_with_inline_values(self):
+        self._assertArgv('--workers=8 apply prod', '--workers=8 prod')
+
+    def test_flags(self):
+        self._assertArgv('--debug --refresh apply prod',
+                         '--debug --refresh prod')
+        self._assertArgv('-d apply prod', '-d prod')
+
+    def test_options_before_subcommand(self):
+        self._assertArgv('--workers 8 plan prod', '--workers 8 plan prod')
+
+    def test_no_command(self):
+        self._assertArgv('', '')
+        self._assertArgv('--help', '--help')
+        self._assertArgv('--workers 8', '--workers 8')
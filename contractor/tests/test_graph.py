@@ -0,0 +1,124 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+
+from contractor import graph
+from contractor.tests import base
+
+
+# network and router both wait on nothing, subnet on network, and
+# router_interface on both subnet and router
+DEPENDS = {
+    'network': set(),
+    'router': set(),
+    'subnet': set(['network']),
+    'router_interface': set(['subnet', 'router']),
+}
+
+DURATIONS = {
+    'network': 2.0,
+    'router': 1.0,
+    'subnet': 3.0,
+    'router_interface': 1.0,
+}
+
+
+class ScheduleTestCase(base.TestCase):
+    def test_critical_path(self):
+        total, path, tasks = graph.schedule(DEPENDS, DURATIONS)
+
+        self.assertEqual(6.0, total)
+        self.assertEqual(['network', 'subnet', 'router_interface'], path)
+
+    def test_times(self):
+        _, _, tasks = graph.schedule(DEPENDS, DURATIONS)
+
+        self.assertEqual({
+            'duration': 1.0,
+            'earliest_start': 5.0,
+            'earliest_finish': 6.0,
+            'latest_start': 5.0,
+            'latest_finish': 6.0,
+            'slack': 0.0,
+        }, tasks['router_interface'])
+
+        # The router could start as late as the router interface's
+        # other dependencies allow
+        self.assertEqual(0.0, tasks['router']['earliest_start'])
+        self.assertEqual(4.0, tasks['router']['latest_start'])
+        self.assertEqual(5.0, tasks['router']['latest_finish'])
+
+    def test_slack(self):
+        _, path, tasks = graph.schedule(DEPENDS, DURATIONS)
+
+        self.assertEqual({'network': 0.0, 'router': 4.0, 'subnet': 0.0,
+                          'router_interface': 0.0},
+                         dict((n, t['slack']) for n, t in tasks.items()))
+        self.assertEqual([0.0] * len(path),
+                         [tasks[n]['slack'] for n in path])
+
+    def test_missing_durations(self):
+        total, path, tasks = graph.schedule(DEPENDS, {'router': 1.0})
+
+        self.assertEqual(1.0, total)
+        self.assertEqual(['router', 'router_interface'], path)
+        self.assertEqual(0.0, tasks['subnet']['duration'])
+        self.assertEqual(1.0, tasks['subnet']['slack'])
+
+    def test_empty(self):
+        self.assertEqual((0.0, [], {}), graph.schedule({}, {}))
+
+    def test_cycle(self):
+        e = self.assertRaises(Exception, graph.schedule,
+                              {'a': set(['b']), 'b': set(['a']),
+                               'c': set()}, {})
+        self.assertIn('a, b', str(e))
+
+
+class TaskDurationsTestCase(base.TestCase):
+    def test_mean(self):
+        reports = [
+            {'tasks': [{'task': 'network', 'phase': 'build', 'duration': 1},
+                       {'task': 'network', 'phase': 'destroy',
+                        'duration': 5}]},
+            {'tasks': [{'task': 'network', 'phase': 'build', 'duration': 3},
+                       {'task': 'router', 'phase': 'build', 'duration': 2}]},
+        ]
+
+        self.assertEqual({'network': 2.0, 'router': 2.0},
+                         graph.task_durations(reports, 'build'))
+
+
+class RenderTestCase(base.TestCase):
+    def test_dot(self):
+        total, path, tasks = graph.schedule(DEPENDS, DURATIONS)
+        dot = graph.to_dot(DEPENDS, tasks, path).splitlines()
+
+        self.assertIn('    "network" -> "subnet" [color="red", '
+                      'penwidth="2"];', dot)
+        self.assertIn('    "router" -> "router_interface";', dot)
+        self.assertIn(r'    "router" [label="router\n1.0s (slack 4.0s)"];',
+                      dot)
+
+    def test_json(self):
+        total, path, tasks = graph.schedule(DEPENDS, DURATIONS)
+        result = json.loads(graph.to_json(DEPENDS, total, tasks, path))
+
+        self.assertEqual(6.0, result['duration'])
+        self.assertEqual(path, result['critical_path'])
+        self.assertEqual(['router', 'subnet'],
+                         result['tasks']['router_interface']['depends'])
+        self.assertEqual(4.0, result['tasks']['router']['slack'])
@@ -0,0 +1,203 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import fixtures
+from neutronclient.common import exceptions as ne_exceptions
+
+from contractor import store
+from contractor.task import neutron
+from contractor.tests import base
+
+
+ENVIRONMENT = 'test'
+
+
+class FakeRunner(object):
+    def __init__(self, neutron_config=None):
+        self.config = {
+            'environments': {
+                ENVIRONMENT: {'neutron': neutron_config or {}},
+            },
+        }
+
+
+def _error(status_code, message='Failed'):
+    return ne_exceptions.NeutronClientException(message=message,
+                                                status_code=status_code)
+
+
+class BulkCreateTestCase(base.TestCase):
+    def setUp(self):
+        super(BulkCreateTestCase, self).setUp()
+
+        self.requests = []
+        self.bulk_error = None
+
+    def _task(self, **neutron_config):
+        return neutron.NetworkTask(FakeRunner(neutron_config), ENVIRONMENT,
+                                   store.Store())
+
+    def _create_network(self, body):
+        self.requests.append(body)
+
+        if 'networks' in body:
+            if self.bulk_error is not None:
+                raise self.bulk_error
+
+            return {'networks': [dict(b, id='id-%s' % b['name'])
+                                 for b in body['networks']]}
+
+        network = body['network']
+        return {'network': dict(network, id='id-%s' % network['name'])}
+
+    def _bulk_create(self, task, count):
+        bodies = [{'name': 'net%d' % i} for i in range(count)]
+        return task._bulk_create('network', self._create_network, bodies)
+
+    def test_batches(self):
+        created = self._bulk_create(self._task(bulk_size=2), 5)
+
+        self.assertEqual(['id-net%d' % i for i in range(5)],
+                         [n['id'] for n in created])
+
+        # Two lists of two, then the last one on its own
+        self.assertEqual([['net0', 'net1'], ['net2', 'net3']],
+                         [[n['name'] for n in r['networks']]
+                          for r in self.requests[:2]])
+        self.assertEqual({'network': {'name': 'net4'}}, self.requests[2])
+
+    def test_bulk_disabled(self):
+        self._bulk_create(self._task(bulk_size=1), 3)
+
+        self.assertEqual(3, len(self.requests))
+        self.assertTrue(all('network' in r for r in self.requests))
+
+    def _assertFallsBack(self, error):
+        self.bulk_error = error
+
+        created = self._bulk_create(self._task(bulk_size=2), 4)
+
+        self.assertEqual(4, len(created))
+
+        # Once bulk has failed, it isn't tried again
+        self.assertEqual(['networks', 'network', 'network', 'network',
+                          'network'],
+                         [list(r.keys())[0] for r in self.requests])
+
+    def test_fallback_not_found(self):
+        self._assertFallsBack(_error(404))
+
+    def test_fallback_bulk_unsupported(self):
+        self._assertFallsBack(_error(400, 'Bulk operation not supported'))
+
+    def test_bad_request(self):
+        self.bulk_error = _error(400, "Invalid input for cidr: '10.0.0/8'")
+
+        self.assertRaises(ne_exceptions.NeutronClientException,
+                          self._bulk_create, self._task(bulk_size=2), 2)
+        self.assertEqual(1, len(self.requests))
+
+    def test_other_errors(self):
+        for status_code in (409, 413, 503):
+            self.requests = []
+            self.bulk_error = _error(status_code)
+
+            self.assertRaises(ne_exceptions.NeutronClientException,
+                              self._bulk_create, self._task(bulk_size=2), 2)
+            self.assertEqual(1, len(self.requests))
+
+
+class FakeTime(object):
+    """Stands in for the time module, with a clock only sleeping moves"""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class DeleteWithRetryTestCase(base.TestCase):
+    def setUp(self):
+        super(DeleteWithRetryTestCase, self).setUp()
+
+        self.time = FakeTime()
+        self.useFixture(fixtures.MonkeyPatch('contractor.task.neutron.time',
+                                             self.time))
+
+        self.attempts = 0
+        self.prepared = 0
+
+    def _delete_with_retry(self, errors, **neutron_config):
+        """Fail with each of the errors in turn, then succeed"""
+        def _delete():
+            self.attempts += 1
+
+            if self.attempts <= len(errors):
+                raise errors[self.attempts - 1]
+
+        def _prepare():
+            self.prepared += 1
+
+        task = neutron.SubnetTask(FakeRunner(neutron_config), ENVIRONMENT,
+                                  store.Store())
+        task._delete_with_retry('subnet', _delete, _prepare)
+
+    def test_deleted(self):
+        self._delete_with_retry([])
+
+        self.assertEqual(1, self.attempts)
+        self.assertEqual([], self.time.sleeps)
+
+    def test_in_use_retried(self):
+        self._delete_with_retry([_error(409)] * 3)
+
+        self.assertEqual(4, self.attempts)
+        self.assertEqual(4, self.prepared)
+
+        # Backing off, with jitter, between attempts
+        for expected, actual in zip([2, 3, 4.5], self.time.sleeps):
+            self.assertTrue(expected * 0.8 <= actual <= expected * 1.2,
+                            '%s is not about %s' % (actual, expected))
+
+        self.assertEqual(3, len(self.time.sleeps))
+
+    def test_gone(self):
+        self._delete_with_retry([_error(404)])
+
+        self.assertEqual(1, self.attempts)
+        self.assertEqual([], self.time.sleeps)
+
+    def test_gone_while_retrying(self):
+        self._delete_with_retry([_error(409), _error(404)])
+
+        self.assertEqual(2, self.attempts)
+
+    def test_other_errors(self):
+        self.assertRaises(ne_exceptions.NeutronClientException,
+                          self._delete_with_retry, [_error(500)])
+        self.assertEqual(1, self.attempts)
+
+    def test_timeout(self):
+        self.assertRaises(ne_exceptions.NeutronClientException,
+                          self._delete_with_retry, [_error(409)] * 10,
+                          delete_timeout=1)
+
+        # One retry takes it past the timeout
+        self.assertEqual(2, self.attempts)
@@ -0,0 +1,173 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from contractor import store
+from contractor.task import nova
+from contractor.tests import base
+
+
+ENVIRONMENT = 'test'
+NAME = 'svc-testaz1-web0001'
+
+
+class FakeRunner(object):
+    def __init__(self, nics=None, numbers=(1,)):
+        instances = [{'number': n, 'az': 'az1'} for n in numbers]
+
+        if nics is not None:
+            for instance in instances:
+                instance['nics'] = [{'network': n} for n in nics]
+
+        self.config = {
+            'environments': {ENVIRONMENT: {}},
+            'roles': {
+                'web': {
+                    'image': 'image-1',
+                    'flavor': '100',
+                    'instances': {ENVIRONMENT: instances},
+                },
+            },
+        }
+
+
+class FakeInterface(object):
+    def __init__(self, net_id):
+        self.net_id = net_id
+        self.port_id = 'port-%s' % net_id
+
+
+class FakeServer(object):
+    """A server, which records the interface changes made to it"""
+    def __init__(self, networks=(), name=NAME):
+        self.id = 'id-%s' % name
+        self.name = name
+        self.flavor = {'id': '100'}
+        self.image = {'id': 'image-1'}
+        self.metadata = {'environment': ENVIRONMENT, 'role': 'web'}
+        self.networks = dict((n, ['10.0.0.1']) for n in networks)
+        self.calls = []
+
+    def interface_list(self):
+        return [FakeInterface('id-%s' % n) for n in sorted(self.networks)]
+
+    def interface_attach(self, port_id, net_id, fixed_ip):
+        self.calls.append(('attach', net_id))
+
+    def interface_detach(self, port_id):
+        self.calls.append(('detach', port_id))
+
+
+class NetworkUpdateTestCase(base.TestCase):
+    def _task(self, server, nics=None):
+        task = nova.InstanceTask(FakeRunner(nics), ENVIRONMENT,
+                                 store.Store())
+        task.store.add_collection('_os-nova_instances', 'instance', [server])
+        task.store.add_collection('_os-neutron_networks', 'network', [
+            {'id': 'id-%s' % n, 'name': n} for n in ('auto', 'one', 'two')])
+
+        return task
+
+    def test_networks_not_configured(self):
+        # Nova attached a network of its choosing
+        server = FakeServer(['auto'])
+        task = self._task(server)
+
+        self.assertEqual({}, task._get_update(NAME))
+
+        task._update_instance(NAME)
+        self.assertEqual([], server.calls)
+
+    def test_networks_unchanged(self):
+        self.assertEqual({}, self._task(FakeServer(['one']),
+                                        nics=['one'])._get_update(NAME))
+
+    def test_network_replaced(self):
+        server = FakeServer(['one'])
+        task = self._task(server, nics=['two'])
+
+        self.assertEqual({'networks': ['two']}, task._get_update(NAME))
+
+        task._update_instance(NAME)
+
+        # The new network is attached before the old is detached
+        self.assertEqual([('attach', 'id-two'), ('detach', 'port-id-one')],
+                         server.calls)
+
+    def test_only_interface_kept(self):
+        server = FakeServer(['one'])
+        task = self._task(server)
+
+        task._update_networks(server, [])
+
+        self.assertEqual([], server.calls)
+
+
+class RecreateTestCase(base.TestCase):
+    def setUp(self):
+        super(RecreateTestCase, self).setUp()
+
+        self.names = ['svc-testaz1-web%04d' % n for n in range(4)]
+        self.task = nova.InstanceTask(FakeRunner(numbers=range(4)),
+                                      ENVIRONMENT, store.Store())
+        self.task.store.add_collection(
+            '_os-nova_instances', 'instance',
+            [FakeServer(name=n) for n in self.names])
+
+        self.created = []
+        self.task._delete_servers = lambda servers: []
+        self.task._create_instance = self._create_instance
+        self.task._wait_for_status = self._wait_for_status
+        self.task._check_health = lambda names, policy: None
+        self.task._add_floating_ips = lambda server: None
+
+    def _create_instance(self, name):
+        self.created.append(name)
+
+        if name == self.names[1]:
+            raise Exception('Quota exceeded')
+
+        return self._new_server(name)
+
+    def _new_server(self, name):
+        server = FakeServer(name=name)
+        server.id = 'new-%s' % name
+
+        return server
+
+    def _wait_for_status(self, ids, status, since):
+        # The last goes to ERROR, the rest come up
+        errored = set(i for i in ids if i.endswith(self.names[3]))
+        return dict((i, self._new_server(i[4:])) for i in ids
+                    if i not in errored), errored
+
+    def test_failures_collected(self):
+        e = self.assertRaises(Exception, self.task._replace_batch,
+                              self.names, {'method': nova.REPLACE_RECREATE})
+
+        # Every instance was created, despite the failure
+        self.assertEqual(self.names, sorted(self.created))
+        self.assertEqual('2 instances are missing: %s (Quota exceeded), '
+                         '%s (ERROR)' % (self.names[1], self.names[3]),
+                         str(e))
+
+    def test_created_kept(self):
+        self.assertRaises(Exception, self.task._replace_batch, self.names,
+                          {'method': nova.REPLACE_RECREATE})
+
+        # Those which came up are known about, for the next batch
+        instances = self.task.store['_os-nova_instances']
+        self.assertEqual([True, False, True, False],
+                         ['new-%s' % n in instances.find_ids(n)
+                          for n in self.names])
@@ -0,0 +1,144 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import re
+
+from contractor import pagination
+from contractor.tests import base
+
+
+class FakeResource(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeManager(object):
+    """A novaclient manager over ids 0 to count - 1
+
+    :param max_limit: Like Nova's osapi_max_limit, the most returned at once
+    :param honour_limit: Whether the limit is applied at all
+    :param honour_marker: Whether the marker is applied at all
+    """
+    resource_class = FakeResource
+
+    def __init__(self, count, max_limit=1000, honour_limit=True,
+                 honour_marker=True):
+        self.resources = [FakeResource(i) for i in range(count)]
+        self.max_limit = max_limit
+        self.honour_limit = honour_limit
+        self.honour_marker = honour_marker
+        self.requests = []
+
+    def list(self, search_opts):
+        self.requests.append(dict(search_opts))
+        resources = self.resources
+
+        if self.honour_marker and 'marker' in search_opts:
+            resources = [r for r in resources
+                         if r.id > search_opts['marker']]
+
+        if self.honour_limit:
+            resources = resources[:min(search_opts['limit'],
+                                       self.max_limit)]
+
+        return resources
+
+
+class IterNovaTestCase(base.TestCase):
+    def _ids(self, manager, **kwargs):
+        return [r.id for r in pagination.iter_nova(manager, **kwargs)]
+
+    def test_short_page(self):
+        manager = FakeManager(3)
+
+        self.assertEqual([0, 1, 2], self._ids(manager, page_size=10))
+
+        # A short page is the last, without asking for another
+        self.assertEqual(1, len(manager.requests))
+
+    def test_pages(self):
+        manager = FakeManager(25)
+
+        self.assertEqual(list(range(25)), self._ids(manager, page_size=10))
+        self.assertEqual([None, 9, 19],
+                         [r.get('marker') for r in manager.requests])
+
+    def test_empty_last_page(self):
+        manager = FakeManager(20)
+
+        self.assertEqual(list(range(20)), self._ids(manager, page_size=10))
+        self.assertEqual(3, len(manager.requests))
+
+    def test_empty(self):
+        manager = FakeManager(0)
+
+        self.assertEqual([], self._ids(manager))
+        self.assertEqual(1, len(manager.requests))
+
+    def test_page_size_capped_to_max_limit(self):
+        manager = FakeManager(25, max_limit=10)
+
+        self.assertEqual(list(range(25)),
+                         self._ids(manager, page_size=100, max_limit=10))
+        self.assertEqual([10, 10, 10],
+                         [r['limit'] for r in manager.requests])
+
+    def test_search_opts(self):
+        manager = FakeManager(3)
+
+        self._ids(manager, search_opts={'name': '^svc'}, page_size=2)
+
+        self.assertEqual(['^svc', '^svc'],
+                         [r['name'] for r in manager.requests])
+
+    def test_ignored_limit(self):
+        manager = FakeManager(25, honour_limit=False)
+
+        self.assertEqual(list(range(25)), self._ids(manager, page_size=10))
+        self.assertEqual(1, len(manager.requests))
+
+    def test_ignored_marker(self):
+        manager = FakeManager(25, honour_marker=False)
+
+        # The first page again isn't handed out twice
+        self.assertEqual(list(range(10)), self._ids(manager, page_size=10))
+        self.assertEqual(2, len(manager.requests))
+
+
+class IterNeutronTestCase(base.TestCase):
+    def test_pages(self):
+        calls = []
+
+        def _list(**kwargs):
+            calls.append(kwargs)
+            yield {'networks': [{'id': 1}, {'id': 2}]}
+            yield {'networks': [{'id': 3}]}
+
+        networks = list(pagination.iter_neutron(_list, 'networks',
+                                                page_size=2,
+                                                tenant_id='t'))
+
+        self.assertEqual([1, 2, 3], [n['id'] for n in networks])
+        self.assertEqual([{'retrieve_all': False, 'limit': 2,
+                           'tenant_id': 't'}], calls)
+
+
+class NamePrefixRegexTestCase(base.TestCase):
+    def test_escapes(self):
+        regex = pagination.name_prefix_regex('svc-prod.az1(')
+
+        self.assertEqual(r'^svc-prod\.az1\(', regex)
+        self.assertIsNotNone(re.match(regex, 'svc-prod.az1(web'))
+        self.assertIsNone(re.match(regex, 'svc-prodXaz1(web'))
@@ -0,0 +1,223 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import os
+import sys
+
+import fixtures
+
+from contractor import remote
+from contractor import ssh
+from contractor.tests import base
+from contractor.tests import fake_ssh
+
+
+ENVIRONMENT = 'test'
+
+# Stands in for scp on the seed instance: copies the file straight into
+# the destination server's root, once the seed's key is trusted there.
+FAKE_SCP = '''#!%s
+import json, os, shutil, sys
+
+args = sys.argv[1:]
+key_path = args[args.index('-i') + 1]
+source, destination = args[-2:]
+host, path = destination.split('@', 1)[1].split(':', 1)
+
+marker = os.path.basename(key_path)
+
+port = args[args.index('-P') + 1] if '-P' in args else '22'
+
+if port != os.environ['FAKE_SCP_PORT']:
+    sys.exit('ssh: connect to host ' + host + ': Connection refused')
+
+with open(os.path.expanduser('~/.ssh/authorized_keys')) as fh:
+    if not os.path.exists(key_path) or not any(
+            line.endswith(' ' + marker) for line in fh.read().splitlines()):
+        sys.exit('Permission denied (publickey).')
+
+roots = json.loads(os.environ['FAKE_SCP_ROOTS'])
+shutil.copy2(source, os.path.join(roots[host], path))
+'''
+
+
+class _FailingCleanupServer(fake_ssh.FakeSSHServer):
+    """Fails to untrust keys, e.g. from a full disk"""
+    def _run_command(self, command):
+        if command.startswith('sed -i'):
+            return (4, '', 'sed: couldn\'t open temporary file\n')
+
+        return super(_FailingCleanupServer, self)._run_command(command)
+
+
+class FakeRunner(object):
+    def __init__(self, ssh_config, instances):
+        self.config = {'environments': {ENVIRONMENT: {'ssh': ssh_config}}}
+        self.environment = ENVIRONMENT
+        self.store = {'instances': instances}
+        self.ssh = ssh.SSHConnectionPool()
+
+
+class DistributeTestCase(base.TestCase):
+    def setUp(self):
+        super(DistributeTestCase, self).setUp()
+
+        self.useFixture(fixtures.EnvironmentVariable('SSH_AUTH_SOCK'))
+        self.useFixture(fixtures.EnvironmentVariable('HPCS_SSO_USERNAME'))
+
+        self.host_key = fake_ssh.generate_key()
+        self.client_key = fake_ssh.generate_key()
+        self.servers = {}
+
+        bin_path = self.useFixture(fixtures.TempDir()).path
+
+        with open(os.path.join(bin_path, 'scp'), 'w') as fh:
+            fh.write(FAKE_SCP % sys.executable)
+
+        os.chmod(os.path.join(bin_path, 'scp'), 0o755)
+        self.useFixture(fixtures.EnvironmentVariable(
+            'PATH', '%s:%s' % (bin_path, os.environ.get('PATH', ''))))
+
+        self.local_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'payload')
+
+        with open(self.local_path, 'w') as fh:
+            fh.write('payload\n' * 1000)
+
+    def _executor(self, zones, server_class=fake_ssh.FakeSSHServer):
+        """Start a server per instance, and an Executor for them
+
+        :param zones: Map of instance name to its availability zone
+        """
+        instances = {}
+        port = 0
+
+        for i, name in enumerate(sorted(zones)):
+            server = self.useFixture(server_class(
+                host_key=self.host_key, client_key=self.client_key,
+                bind_address='127.0.0.%d' % (i + 2), port=port))
+            port = server.port
+
+            self.servers[name] = server
+            instances[name] = {
+                'role': 'test',
+                'az': zones[name],
+                'nics': [{'fixed_ip': server.hostname, 'floating_ip': None}],
+            }
+
+        self.useFixture(fixtures.EnvironmentVariable(
+            'FAKE_SCP_ROOTS', json.dumps(dict(
+                (s.hostname, s.root) for s in self.servers.values()))))
+        self.useFixture(fixtures.EnvironmentVariable('FAKE_SCP_PORT',
+                                                     str(port)))
+
+        runner = FakeRunner({'username': 'test', 'port': port,
+                             'private_key': self.servers[name].private_key},
+                            instances)
+        self.addCleanup(runner.ssh.close)
+
+        return remote.Executor(runner)
+
+    def _assertDistributed(self):
+        with open(self.local_path) as fh:
+            expected = fh.read()
+
+        for name, server in self.servers.items():
+            with open(os.path.join(server.root, 'payload')) as fh:
+                self.assertEqual(expected, fh.read(), name)
+
+    def _assertKeyRemoved(self):
+        """Check the seeds' copies of relay keys were deleted"""
+        removed = [c.split()[-1] for s in self.servers.values()
+                   for c in s.commands_run
+                   if c.startswith('rm -f /tmp/contractor-relay-')]
+
+        self.assertNotEqual([], removed)
+        self.assertEqual([], [p for p in removed if os.path.exists(p)])
+
+    def _assertNoRelayKey(self):
+        self._assertKeyRemoved()
+
+        with open(os.path.expanduser('~/.ssh/authorized_keys')) as fh:
+            self.assertNotIn('contractor-relay-', fh.read())
+
+    def test_distribute(self):
+        executor = self._executor({'a': 'az1', 'b': 'az1', 'c': 'az2'})
+        names = sorted(self.servers)
+
+        self.assertEqual({'a': True, 'b': True, 'c': True},
+                         executor.distribute(self.local_path, 'payload',
+                                             names, mode=0o640))
+        self._assertDistributed()
+        self.assertEqual(0o640, os.stat(os.path.join(
+            self.servers['a'].root, 'payload')).st_mode & 0o777)
+
+        # Up to date copies are left alone
+        self.assertEqual({'a': False, 'b': False, 'c': False},
+                         executor.distribute(self.local_path, 'payload',
+                                             names))
+
+    def test_distribute_per_az(self):
+        executor = self._executor({'a': 'az1', 'b': 'az1', 'c': 'az1',
+                                   'd': 'az2'})
+        names = sorted(self.servers)
+
+        self.assertEqual({'a': True, 'b': True, 'c': True, 'd': True},
+                         executor.distribute(self.local_path, 'payload',
+                                             names, per_az=True))
+        self._assertDistributed()
+        self._assertNoRelayKey()
+
+        # Only the seed of each zone had it uploaded, the rest were copied
+        # to from the seed
+        scp = [c for c in self.servers['a'].commands_run
+               if c.startswith('scp')]
+        self.assertEqual(2, len(scp))
+        self.assertFalse(any(c.startswith('scp')
+                             for c in self.servers['d'].commands_run))
+
+        self.assertEqual({'a': False, 'b': False, 'c': False, 'd': False},
+                         executor.distribute(self.local_path, 'payload',
+                                             names, per_az=True))
+
+    def test_relay_key_not_removed(self):
+        executor = self._executor({'a': 'az1', 'b': 'az1'},
+                                  server_class=_FailingCleanupServer)
+
+        e = self.assertRaises(Exception, executor.distribute,
+                              self.local_path, 'payload', ['a', 'b'],
+                              per_az=True)
+        self.assertIn('Failed to distribute', str(e))
+        self.assertIn('az1', str(e))
+
+        # The copy itself worked, and the seed's copy of the key is gone
+        self._assertDistributed()
+        self._assertKeyRemoved()
+        self.assertTrue(any(
+            'Failed to remove relay key' in line and ' b' in line
+            for line in self.log_fixture.output.splitlines()))
+
+    def test_unreachable(self):
+        executor = self._executor({'a': 'az1', 'b': 'az1'})
+
+        # Nothing listens there
+        executor.store['instances']['b']['nics'][0]['fixed_ip'] = '127.0.0.99'
+        del self.servers['b']
+
+        e = self.assertRaises(Exception, executor.distribute,
+                              self.local_path, 'payload', ['a', 'b'])
+        self.assertIn('Failed to distribute %s to: b' % self.local_path,
+                      str(e))
@@ -0,0 +1,104 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import os
+
+import fixtures
+
+from contractor import cache
+from contractor import runner
+from contractor.tests import base
+from contractor.tests import benchmark
+from contractor.tests import fakes
+
+
+class RunnerTestCase(base.TestCase):
+    def setUp(self):
+        super(RunnerTestCase, self).setUp()
+
+        self.cloud = fakes.FakeCloud(build_time=0.01, seed=1)
+        self.config_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'contractor.json')
+
+    def _runner(self, instances, **kwargs):
+        with open(self.config_path, 'w') as fh:
+            json.dump(benchmark.make_config(instances), fh)
+
+        return runner.Runner(self.config_path, benchmark.ENVIRONMENT,
+                             cache=cache.IntrospectionCache(ttl=0),
+                             clients=fakes.FakeClientRegistry(self.cloud),
+                             **kwargs)
+
+    def _pool_sizes(self):
+        """Record the size of each phase's pool"""
+        sizes = []
+        pool = runner.ThreadPool
+
+        def _pool(processes):
+            sizes.append(processes)
+            return pool(processes)
+
+        self.useFixture(fixtures.MonkeyPatch('contractor.runner.ThreadPool',
+                                             _pool))
+
+        return sizes
+
+    def test_introspect_all_at_once(self):
+        sizes = self._pool_sizes()
+
+        r = self._runner(0, workers=1)
+        r.plan()
+
+        self.assertEqual([len(r.tasks)], sizes)
+
+    def test_introspect_workers(self):
+        sizes = self._pool_sizes()
+
+        self._runner(0, workers=1, introspect_workers=2).plan()
+
+        self.assertEqual([2], sizes)
+
+    def test_introspect_lists_once(self):
+        requests = []
+        self.cloud.observers.append(
+            lambda service, method, url, *args: requests.append(url))
+
+        self._runner(0).plan()
+
+        # The router interfaces reuse the router and subnet listings
+        self.assertEqual(1, requests.count('/routers'))
+        self.assertEqual(1, requests.count('/subnets'))
+
+    def test_execute(self):
+        self._runner(4).execute()
+
+        servers = [s for s in self.cloud.servers.values()
+                   if s['status'] != 'DELETED']
+
+        self.assertEqual(['ACTIVE'] * 4, [s['status'] for s in servers])
+        self.assertEqual(['bench-net'],
+                         [n['name'] for n in self.cloud.networks.values()])
+        self.assertEqual(['bench-subnet'],
+                         [s['name'] for s in self.cloud.subnets.values()])
+        self.assertEqual(['bench-router'],
+                         [r['name'] for r in self.cloud.routers.values()])
+
+        # Applying it again has nothing left to do
+        plan = self._runner(4).plan()
+
+        for name, task in plan['tasks'].items():
+            for action, changes in task['changes'].items():
+                self.assertEqual([], changes, '%s %s' % (name, action))
@@ -0,0 +1,279 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import os
+import socket
+import threading
+import time
+
+import fixtures
+
+from contractor import ssh
+from contractor import utils
+from contractor.tests import base
+from contractor.tests import fake_ssh
+
+
+class _CountingSemaphore(object):
+    """A BoundedSemaphore which records how many held it at once"""
+    def __init__(self, value):
+        self._semaphore = threading.BoundedSemaphore(value)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+        # Give the others a chance to pile in
+        time.sleep(0.05)
+
+    def __exit__(self, *args):
+        with self._lock:
+            self.active -= 1
+
+        self._semaphore.release()
+
+
+class SSHConnectionTestCase(base.TestCase):
+    def setUp(self):
+        super(SSHConnectionTestCase, self).setUp()
+
+        # No agent, and the temporary home directory has no keys, so only
+        # the key given to the connection can log in
+        self.useFixture(fixtures.EnvironmentVariable('SSH_AUTH_SOCK'))
+        self.useFixture(fixtures.EnvironmentVariable('HPCS_SSO_USERNAME'))
+
+        self.server = self.useFixture(fake_ssh.FakeSSHServer(commands={
+            'big': (0, 'x' * 1000 + '\n' * 1000, 'y' * 100000),
+            'lines': (3, 'one\ntwo\nthree', 'warning\n'),
+        }))
+
+        self.connection = ssh.SSHConnection(
+            self.server.hostname, 'test', self.server.private_key,
+            port=self.server.port)
+        self.addCleanup(self.connection.disconnect)
+
+    def test_connect_without_agent_or_keys(self):
+        self.connection.connect()
+
+        # The first attempt has nothing to log in with, the second uses
+        # the connection's key
+        self.assertTrue(self.connection.connected)
+        self.assertEqual(2, self.server.connections)
+
+    def test_connect_sets_nodelay(self):
+        self.connection.connect()
+
+        sock = self.connection.client.get_transport().sock
+
+        self.assertNotEqual(0, sock.getsockopt(socket.IPPROTO_TCP,
+                                               socket.TCP_NODELAY))
+
+    def test_run_collects_all_output(self):
+        result = self.connection.run('big')
+
+        self.assertTrue(result.ok)
+        self.assertEqual(0, result.exit_status)
+        self.assertEqual('x' * 1000 + '\n' * 1000, result.stdout)
+        self.assertEqual('y' * 100000, result.stderr)
+
+    def test_run_output_callback(self):
+        lines = []
+
+        result = self.connection.run(
+            'lines', output=lambda stream, line: lines.append((stream, line)))
+
+        self.assertFalse(result.ok)
+        self.assertEqual(3, result.exit_status)
+        self.assertEqual('one\ntwo\nthree', result.stdout)
+        self.assertEqual('warning\n', result.stderr)
+
+        # A final line without a newline is still passed on
+        self.assertEqual([('stdout', 'one'), ('stdout', 'two'),
+                          ('stdout', 'three')],
+                         [l for l in lines if l[0] == 'stdout'])
+        self.assertEqual([('stderr', 'warning')],
+                         [l for l in lines if l[0] == 'stderr'])
+
+    def _local_file(self, name, data):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, name)
+
+        with open(path, 'wb') as fh:
+            fh.write(data)
+
+        return path
+
+    def test_put(self):
+        local_path = self._local_file('src', b'data' * 100000)
+        remote_path = os.path.join(self.server.root, 'dst')
+
+        self.connection.put(local_path, remote_path, mode=0o600)
+
+        with open(remote_path, 'rb') as fh:
+            self.assertEqual(b'data' * 100000, fh.read())
+
+        self.assertEqual(0o600, os.stat(remote_path).st_mode & 0o777)
+
+    def test_upload_skips_unchanged(self):
+        local_path = self._local_file('src', b'data')
+        remote_path = os.path.join(self.server.root, 'dst')
+
+        self.assertTrue(self.connection.upload(local_path, remote_path))
+        self.assertFalse(self.connection.upload(local_path, remote_path))
+
+        with open(local_path, 'wb') as fh:
+            fh.write(b'changed')
+
+        self.assertTrue(self.connection.upload(local_path, remote_path))
+
+    def test_put_uses_a_session(self):
+        sessions = _CountingSemaphore(2)
+        self.connection._sessions = sessions
+
+        local_path = self._local_file('src', b'data' * 100000)
+
+        def _put(i):
+            self.connection.put(local_path,
+                                os.path.join(self.server.root, 'dst%d' % i))
+
+        for _, _, exc_info in utils.parallel_map(_put, range(6), 6):
+            self.assertIsNone(exc_info)
+
+        self.assertEqual(2, sessions.peak)
+
+    def test_run_many_times(self):
+        self.connection.connect()
+        connections = self.server.connections
+
+        for i in range(20):
+            result = self.connection.run('echo %d; echo %d >&2' % (i, i))
+
+            self.assertEqual('%d\n' % i, result.stdout)
+            self.assertEqual('%d\n' % i, result.stderr)
+
+        self.assertEqual(connections, self.server.connections)
+
+
+class _Upper(threading.Thread):
+    """Reads each connection to EOF, then replies with it upper cased"""
+    def __init__(self):
+        super(_Upper, self).__init__()
+        self.daemon = True
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+
+            thread = threading.Thread(target=self._reply, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _reply(self, sock):
+        data = b''
+
+        try:
+            while True:
+                chunk = sock.recv(ssh.BUFFER_SIZE)
+
+                if len(chunk) == 0:
+                    break
+
+                data += chunk
+
+            sock.sendall(data.upper())
+        finally:
+            sock.close()
+
+    def close(self):
+        self.listener.close()
+
+
+class TunnelTestCase(base.TestCase):
+    def setUp(self):
+        super(TunnelTestCase, self).setUp()
+
+        self.server = self.useFixture(fake_ssh.FakeSSHServer())
+
+        self.upper = _Upper()
+        self.upper.start()
+        self.addCleanup(self.upper.close)
+
+        connection = ssh.SSHConnection(
+            self.server.hostname, 'test', self.server.private_key,
+            port=self.server.port)
+        self.addCleanup(connection.disconnect)
+
+        self.port = connection.tunnel('127.0.0.1', self.upper.port)
+
+    def _request(self, data, results=None):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        reply = b''
+
+        try:
+            sock.sendall(data)
+
+            # The reply only comes once the server sees our EOF
+            sock.shutdown(socket.SHUT_WR)
+
+            while True:
+                chunk = sock.recv(ssh.BUFFER_SIZE)
+
+                if len(chunk) == 0:
+                    break
+
+                reply += chunk
+        finally:
+            sock.close()
+
+        if results is not None:
+            results.append(reply)
+
+        return reply
+
+    def test_half_close(self):
+        self.assertEqual(b'HELLO', self._request(b'hello'))
+
+    def test_large_reply_after_half_close(self):
+        data = b'abcdefgh' * (ssh.Forwarder.MAX_PENDING // 2)
+
+        self.assertEqual(data.upper(), self._request(data))
+
+    def test_concurrent_connections(self):
+        results = []
+        threads = [threading.Thread(target=self._request,
+                                    args=(b'connection %d' % i, results))
+                   for i in range(20)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(b'CONNECTION %d' % i for i in range(20)),
+                         sorted(results))
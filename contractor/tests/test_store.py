@@ -0,0 +1,97 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from contractor import store
+from contractor.tests import base
+
+
+class FakeServer(object):
+    """Nova hands back objects, rather than dicts"""
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class ResourceCollectionTestCase(base.TestCase):
+    def setUp(self):
+        super(ResourceCollectionTestCase, self).setUp()
+
+        self.collection = store.ResourceCollection('network', [
+            {'id': 'id-1', 'name': 'one'},
+            {'id': 'id-2', 'name': 'two'},
+        ])
+
+    def test_indexes(self):
+        self.assertEqual(2, len(self.collection))
+        self.assertEqual(set(['one', 'two']), self.collection.names())
+        self.assertIn('one', self.collection)
+        self.assertNotIn('three', self.collection)
+
+        self.assertEqual('one', self.collection.get('id-1')['name'])
+        self.assertIsNone(self.collection.get('id-3'))
+        self.assertEqual('id-2', self.collection.get_id('two'))
+
+    def test_objects(self):
+        collection = store.ResourceCollection('server', [
+            FakeServer('id-1', 'one')])
+
+        self.assertEqual('id-1', collection.get_id('one'))
+        self.assertEqual([collection.get('id-1')], collection.find('one'))
+
+    def test_duplicate_names(self):
+        self.collection.append({'id': 'id-3', 'name': 'one'})
+
+        self.assertEqual(3, len(self.collection))
+        self.assertEqual(['id-1', 'id-3'], self.collection.find_ids('one'))
+        self.assertEqual(['id-1', 'id-3'],
+                         [r['id'] for r in self.collection.find('one')])
+
+        # The one resource with a name can't be picked out
+        self.assertRaises(Exception, self.collection.get_by_name, 'one')
+
+    def test_get_by_name_missing(self):
+        self.assertRaises(Exception, self.collection.get_by_name, 'three')
+        self.assertEqual([], self.collection.find('three'))
+
+    def test_remove(self):
+        self.collection.append({'id': 'id-3', 'name': 'one'})
+
+        self.assertEqual('id-1', self.collection.remove('id-1')['id'])
+        self.assertEqual('id-3', self.collection.get_id('one'))
+
+        self.collection.remove('id-3')
+
+        self.assertNotIn('one', self.collection)
+        self.assertEqual(set(['two']), self.collection.names())
+
+    def test_replace_renamed(self):
+        # A refreshed copy of a resource replaces the old one, under its
+        # new name
+        self.collection.append({'id': 'id-1', 'name': 'uno'})
+
+        self.assertEqual(2, len(self.collection))
+        self.assertNotIn('one', self.collection)
+        self.assertEqual('id-1', self.collection.get_id('uno'))
+
+
+class StoreTestCase(base.TestCase):
+    def test_add_collection(self):
+        s = store.Store()
+        collection = s.add_collection('_os-neutron_networks', 'network',
+                                      [{'id': 'id-1', 'name': 'one'}])
+
+        self.assertIs(collection, s['_os-neutron_networks'])
+        self.assertEqual('network', collection.kind)
+        self.assertEqual('id-1', collection.get_id('one'))
@@ -0,0 +1,125 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import time
+
+import fixtures
+
+from contractor import utils
+from contractor.tests import base
+
+
+class FakeTime(object):
+    """Stands in for the time module, with a clock only sleeping moves"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTestCase(base.TestCase):
+    def setUp(self):
+        super(RateLimiterTestCase, self).setUp()
+
+        self.time = FakeTime()
+        self.useFixture(fixtures.MonkeyPatch('contractor.utils.time',
+                                             self.time))
+
+    def test_unlimited(self):
+        limiter = utils.RateLimiter()
+
+        for i in range(100):
+            limiter.wait()
+
+        self.assertEqual([], self.time.sleeps)
+
+    def test_spaced_out(self):
+        limiter = utils.RateLimiter(4)
+
+        for i in range(4):
+            limiter.wait()
+
+        # The first goes straight away
+        self.assertEqual([0.25, 0.25, 0.25], self.time.sleeps)
+
+    def test_no_burst_after_idle(self):
+        limiter = utils.RateLimiter(4)
+        limiter.wait()
+
+        self.time.now += 10
+        limiter.wait()
+        limiter.wait()
+
+        # Being idle doesn't bank calls to make all at once later
+        self.assertEqual([0.25], self.time.sleeps)
+
+    def test_partly_waited(self):
+        limiter = utils.RateLimiter(4)
+        limiter.wait()
+
+        self.time.now += 0.1
+        limiter.wait()
+
+        self.assertEqual(1, len(self.time.sleeps))
+        self.assertAlmostEqual(0.15, self.time.sleeps[0])
+
+
+class ConcurrentRateLimiterTestCase(base.TestCase):
+    def test_shared(self):
+        limiter = utils.RateLimiter(50)
+        returned = []
+
+        def _wait(i):
+            limiter.wait()
+            returned.append(time.time())
+
+        utils.parallel_map(_wait, range(10), 10)
+
+        # Spread out across the threads, not each at their own rate
+        returned.sort()
+        self.assertTrue(returned[-1] - returned[0] >= 9 * 0.02 * 0.9)
+
+
+class ParallelMapTestCase(base.TestCase):
+    def test_results_in_order(self):
+        def _func(i):
+            time.sleep(0.01 * (5 - i))
+            return i * 2
+
+        self.assertEqual([(i, i * 2, None) for i in range(5)],
+                         utils.parallel_map(_func, range(5), 5))
+
+    def test_failures(self):
+        def _func(i):
+            if i == 1:
+                raise ValueError('one')
+
+            return i
+
+        results = utils.parallel_map(_func, range(3), 2)
+
+        self.assertEqual([0, None, 2], [r[1] for r in results])
+        self.assertIsNone(results[0][2])
+        self.assertIs(ValueError, results[1][2][0])
+        self.assertEqual('one', str(results[1][2][1]))
+
+    def test_empty(self):
+        self.assertEqual([], utils.parallel_map(lambda i: i, [], 5))
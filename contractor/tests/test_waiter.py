@@ -0,0 +1,144 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import fixtures
+
+from contractor.tests import base
+from contractor import waiter
+
+
+class FakeClock(object):
+    """Stands in for time.time() and time.sleep(), without sleeping"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class WaiterTestCase(base.TestCase):
+    def setUp(self):
+        super(WaiterTestCase, self).setUp()
+
+        self.clock = FakeClock()
+        self.useFixture(fixtures.MonkeyPatch('time.time', self.clock.time))
+        self.useFixture(fixtures.MonkeyPatch('time.sleep', self.clock.sleep))
+
+        self.polls = []
+
+    def _poll(self, *statuses):
+        """Return a poll callable which answers with each dict in turn"""
+        statuses = list(statuses)
+
+        def _poll(ids):
+            self.polls.append(ids)
+            return statuses.pop(0) if len(statuses) > 1 else statuses[0]
+
+        return _poll
+
+    def test_one_poll_per_tick(self):
+        poll = self._poll({'a': 'BUILD', 'b': 'BUILD'},
+                          {'a': 'ACTIVE', 'b': 'BUILD'},
+                          {'a': 'ACTIVE', 'b': 'ACTIVE'})
+
+        done, failed = waiter.Waiter(poll, jitter=0).wait(['a', 'b'],
+                                                          'ACTIVE')
+
+        self.assertEqual(set(['a', 'b']), done)
+        self.assertEqual(set(), failed)
+
+        # Each tick checks everything still pending with a single call
+        self.assertEqual([frozenset(['a', 'b']), frozenset(['a', 'b']),
+                          frozenset(['b'])], self.polls)
+
+    def test_backoff(self):
+        poll = self._poll(*([{'a': 'BUILD'}] * 5 + [{'a': 'ACTIVE'}]))
+
+        waiter.Waiter(poll, interval=1, max_interval=3, backoff=1.5,
+                      jitter=0).wait(['a'], 'ACTIVE')
+
+        self.assertEqual([1, 1.5, 2.25, 3, 3, 3], self.clock.sleeps)
+
+    def test_jitter(self):
+        bounds = []
+
+        def _uniform(low, high):
+            bounds.append((low, high))
+            return high
+
+        self.useFixture(fixtures.MonkeyPatch('random.uniform', _uniform))
+
+        waiter.Waiter(self._poll({'a': 'ACTIVE'}), interval=10,
+                      jitter=0.2).wait(['a'], 'ACTIVE')
+
+        self.assertEqual([(-2.0, 2.0)], bounds)
+        self.assertEqual([12.0], self.clock.sleeps)
+
+    def test_missing_status(self):
+        poll = self._poll({'a': 'DELETED'}, {})
+
+        done, failed = waiter.Waiter(poll, jitter=0).wait(
+            ['a', 'b'], 'DELETED', missing_status='DELETED')
+
+        self.assertEqual(set(['a', 'b']), done)
+
+    def test_missing_is_pending_by_default(self):
+        poll = self._poll({}, {'a': 'ACTIVE'})
+
+        done, failed = waiter.Waiter(poll, jitter=0).wait(['a'], 'ACTIVE')
+
+        self.assertEqual(set(['a']), done)
+        self.assertEqual(2, len(self.polls))
+
+    def test_error_policy_abort(self):
+        poll = self._poll({'a': 'ERROR', 'b': 'BUILD'})
+
+        self.assertRaises(Exception, waiter.Waiter(poll, jitter=0).wait,
+                          ['a', 'b'], 'ACTIVE', errors=('ERROR',))
+        self.assertEqual(1, len(self.polls))
+
+    def test_error_policy_continue(self):
+        poll = self._poll({'a': 'ERROR', 'b': 'BUILD'},
+                          {'b': 'ACTIVE'})
+
+        done, failed = waiter.Waiter(
+            poll, jitter=0, error_policy=waiter.ERROR_POLICY_CONTINUE).wait(
+                ['a', 'b'], 'ACTIVE', errors=('ERROR',))
+
+        self.assertEqual(set(['b']), done)
+        self.assertEqual(set(['a']), failed)
+
+        # Failed resources aren't polled again
+        self.assertEqual(frozenset(['b']), self.polls[-1])
+
+    def test_unknown_error_policy(self):
+        self.assertRaises(ValueError, waiter.Waiter, self._poll({}),
+                          error_policy='ignore')
+
+    def test_timeout(self):
+        poll = self._poll({'a': 'BUILD'})
+
+        self.assertRaises(waiter.WaitTimeout,
+                          waiter.Waiter(poll, interval=2, max_interval=2,
+                                        jitter=0, timeout=5).wait,
+                          ['a'], 'ACTIVE')
+
+        # The last sleep is cut short at the deadline
+        self.assertEqual([2, 2, 1], self.clock.sleeps)
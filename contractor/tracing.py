@@ -0,0 +1,110 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import collections
+import json
+import logging
+import os
+import random
+import threading
+
+from contractor import metrics
+
+
+LOG = logging.getLogger(__name__)
+DEFAULT_CAPACITY = 10000
+
+
+class Tracer(object):
+    """Keeps a trace of the most recent API calls
+
+    Add trace() to a ClientRegistry as an observer. Calls are kept in a ring
+    buffer of the last `capacity`, so tracing a long run costs a bounded
+    amount of memory.
+
+    :param sample_rate: Fraction of successful calls to keep
+    :param keep_errors: Keep every failed call, whatever the sample rate
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, sample_rate=1.0,
+                 keep_errors=True):
+        self.sample_rate = sample_rate
+        self.keep_errors = keep_errors
+
+        self.calls = collections.deque(maxlen=capacity)
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+
+    def trace(self, service, method, url, status, start, duration,
+              size=None):
+        error = status is None or status >= 400
+
+        if not (error and self.keep_errors) and \
+                random.random() >= self.sample_rate:
+            return
+
+        call = {
+            'service': service,
+            'method': method,
+            'url': metrics.url_template(url),
+            'status': status,
+            'bytes': size,
+            'start': start,
+            'duration': duration,
+            'thread': threading.current_thread().name,
+        }
+
+        with self._lock:
+            if len(self.calls) == self.calls.maxlen:
+                self.dropped += 1
+
+            self.calls.append(call)
+
+    def export_chrome(self, path):
+        """Save the trace in Chrome's trace event format
+
+        Load it in chrome://tracing, or any other trace event viewer, to see
+        each thread's API calls on a timeline.
+        """
+        with self._lock:
+            calls = list(self.calls)
+
+        threads = {}
+        events = []
+
+        for call in calls:
+            tid = threads.setdefault(call['thread'], len(threads) + 1)
+
+            events.append({
+                'name': '%s %s' % (call['method'], call['url']),
+                'cat': call['service'],
+                'ph': 'X',
+                'ts': int(call['start'] * 1000000),
+                'dur': int(call['duration'] * 1000000),
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'status': call['status'], 'bytes': call['bytes']},
+            })
+
+        for name, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': os.getpid(), 'tid': tid,
+                           'args': {'name': name}})
+
+        with open(path, 'w') as fh:
+            json.dump({'traceEvents': events}, fh)
+
+        LOG.info('Trace of %d API calls written to %s (%d dropped from the '
+                 'buffer)', len(calls), path, self.dropped)
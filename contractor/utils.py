@@ -0,0 +1,67 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+import time
+
+
+class RateLimiter(object):
+    """Spaces out calls to wait() so at most `rate` return per second"""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+def parallel_map(func, items, workers):
+    """Call func for each item on a pool of up to `workers` threads
+
+    Failures don't stop the remaining items from being processed.
+
+    :returns: A list of (item, result, exc_info) tuples, in the same order as
+              items. exc_info is None when the call succeeded.
+    """
+    items = list(items)
+
+    if len(items) == 0:
+        return []
+
+    def _call(item):
+        try:
+            return (item, func(item), None)
+        except Exception:
+            return (item, None, sys.exc_info())
+
+    pool = ThreadPool(max(1, min(workers, len(items))))
+
+    try:
+        return pool.map(_call, items)
+    finally:
+        pool.close()
+        pool.join()
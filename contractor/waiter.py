@@ -0,0 +1,112 @@
+# Copyright 2013 Hewlett-Packard Development Company, L.P.
+#
+# Author: Kiall Mac Innes <kiall@hp.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+import random
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 2
+DEFAULT_MAX_INTERVAL = 30
+DEFAULT_BACKOFF = 1.5
+DEFAULT_JITTER = 0.2
+
+# What to do when a resource reaches an error status
+ERROR_POLICY_ABORT = 'abort'
+ERROR_POLICY_CONTINUE = 'continue'
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+class Waiter(object):
+    """Waits for a set of resources to reach a status
+
+    Rather than fetching each resource in turn, the poll callable is handed
+    the ids still pending and is expected to check all of them with a single
+    (list) API call, returning a dict of id to status. Ids absent from the
+    returned dict are treated as having missing_status, or as still pending
+    if that is None.
+    """
+    def __init__(self, poll, interval=DEFAULT_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF,
+                 jitter=DEFAULT_JITTER, timeout=None,
+                 error_policy=ERROR_POLICY_ABORT):
+        if error_policy not in (ERROR_POLICY_ABORT, ERROR_POLICY_CONTINUE):
+            raise ValueError('Unknown error policy: %s' % error_policy)
+
+        self.poll = poll
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.error_policy = error_policy
+
+    def _sleep(self, interval):
+        jitter = interval * self.jitter
+        time.sleep(max(0, interval + random.uniform(-jitter, jitter)))
+
+    def wait(self, ids, target, errors=(), missing_status=None):
+        """Block until every id has the target status
+
+        :returns: A (done, failed) tuple of id sets. failed is only ever
+                  non-empty with the continue error policy.
+        """
+        pending = set(ids)
+        done = set()
+        failed = set()
+
+        interval = self.interval
+        deadline = (time.time() + self.timeout) if self.timeout else None
+
+        while len(pending) > 0:
+            if deadline is not None:
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    raise WaitTimeout('Timed out waiting for %d resources to '
+                                      'become %s' % (len(pending), target))
+
+                interval = min(interval, remaining)
+
+            self._sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+            statuses = self.poll(frozenset(pending))
+
+            for id_ in list(pending):
+                status = statuses.get(id_, missing_status)
+
+                if status == target:
+                    LOG.debug('Resource %s is %s', id_, status)
+                    pending.discard(id_)
+                    done.add(id_)
+                elif status in errors:
+                    if self.error_policy == ERROR_POLICY_ABORT:
+                        raise Exception('Resource %s is %s' % (id_, status))
+
+                    pending.discard(id_)
+                    failed.add(id_)
+
+            if len(pending) > 0:
+                LOG.info('Waiting for %d resources to become %s (%d done, '
+                         '%d failed)', len(pending), target, len(done),
+                         len(failed))
+
+        return (done, failed)
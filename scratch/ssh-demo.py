@@ -55,12 +55,10 @@ print("Is Connected? %r" % conn.connected)
 
 print("Who am I? %s" % stdout.read(100))
 
-print("Trying to tunnel :D")
-
-lport = conn.tunnel('172.17.4.3')
+print("Trying to hop through the gateway :D")
 
 try:
-    conn2 = ssh.SSHConnection('127.0.0.1', 'ubuntu2', KEY, port=lport)
+    conn2 = ssh.SSHConnection('172.17.4.3', 'ubuntu2', KEY, gateway=conn)
 
     (stdout, stderr, ) = conn2.execute('/usr/bin/whoami')
 